@@ -0,0 +1,54 @@
+# /mpcfit/benchmarks/bench_gcm.py
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Timing of GCM (straight port) versus GCMNEW (numpy-native)
+# for single tracklets of 3, 5 and 50 observations.
+#
+# Run from the top-level directory:
+#   python -m benchmarks.bench_gcm
+#
+# --------------------------------------------------------------
+"""
+
+# Import third-party packages
+# --------------------------------------------------------------
+import numpy as np
+import timeit
+
+# Import the specific package/module/function we are timing
+# --------------------------------------------------------------
+import mpcfit.gcm as gcm
+
+
+def tracklet(npt, seed=0):
+    '''A moving object near (RA, Dec) = (1, 0.5) radians, with 1" noise.'''
+    rng = np.random.RandomState(seed)
+    date = 56123. + np.linspace(0, 0.05, npt)
+    ra = 1.0 + 0.02 * (date - date[0]) + rng.normal(0, 5e-6, npt)
+    dec = 0.5 + 0.01 * (date - date[0]) + rng.normal(0, 5e-6, npt)
+    return date, ra, dec
+
+
+def best(stmt, number):
+    '''Best of 5 repeats, in microseconds per call.'''
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    print('{:>6} {:>12} {:>12} {:>8}'.format(
+        'npts', 'GCM (us)', 'GCMNEW (us)', 'speedup'))
+    for npt in (3, 5, 50):
+        date, ra, dec = tracklet(npt)
+        dlist = list(date)
+        pos = [gcm.Sphr(r, d) for r, d in zip(ra, dec)]
+        old = best(lambda: gcm.GCM(dlist, pos).rmsRes(), 2000)
+        new = best(lambda: gcm.GCMNEW(date, ra, dec).rmsRes(), 2000)
+        print('{:>6} {:>12.1f} {:>12.1f} {:>8.1f}'.format(
+            npt, old, new, old / new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,489 @@
+# /mpcfit/benchmarks/run.py
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Benchmark suite for mpcfit.
+#
+# Times the gcm, transformations, fit, ingest and ephemeris modules
+# on synthetic inputs (see synthetic.py) and writes the results as
+# JSON, so that regressions can be tracked across releases.
+# Needs nothing beyond mpcfit's own requirements, and no network.
+#
+# Run from the top-level directory:
+#   python -m benchmarks.run --output results.json
+#   python -m benchmarks.run --quick --filter gcm
+#   python -m benchmarks.run --compare old.json new.json
+#
+# --------------------------------------------------------------
+"""
+
+# Import third-party packages
+# --------------------------------------------------------------
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+# Import neighboring packages
+# --------------------------------------------------------------
+import mpcfit as package
+from mpcfit import cache
+from mpcfit import ephemeris
+from mpcfit import gcm
+from mpcfit import ingest
+from mpcfit import kepler
+from mpcfit import mpcfit
+from mpcfit import nbody
+from mpcfit import observatories
+from mpcfit import transformations
+from benchmarks import synthetic
+
+
+# Registry of benchmark cases
+# --------------------------------------------------------------
+#
+# Each case is a generator function taking `quick` (bool) and
+# yielding (params, func, nItems):
+#   params : dict describing the case; params['name'] names it
+#   func   : callable with no arguments, the thing timed
+#   nItems : number of items (tracklets, points, matrices, ...)
+#            one call of func processes
+# A case that can't run in this tree raises Skip.
+
+CASES = []
+
+
+class Skip(Exception):
+    '''Raised by a case that cannot be run in this tree.'''
+
+
+def case(group):
+    '''Decorator adding a case generator to the registry.'''
+    def register(f):
+        CASES.append((group, f))
+        return f
+    return register
+
+
+@case('gcm')
+def gcm_single(quick):
+    '''GCM and GCMNEW on single tracklets.'''
+    for npts in ((3, 50) if quick else (3, 5, 20, 50)):
+        for geometry in synthetic.GEOMETRIES:
+            date, ra, dec, _ = synthetic.tracklets(1, npts, geometry)
+            dlist = list(date)
+            pos = [gcm.Sphr(r, d) for r, d in zip(ra, dec)]
+            params = dict(npts=npts, geometry=geometry)
+            yield (dict(name='GCM', **params),
+                   lambda: gcm.GCM(dlist, pos).rms(), 1)
+            yield (dict(name='GCMNEW', **params),
+                   lambda: gcm.GCMNEW(date, ra, dec).rms(), 1)
+
+
+@case('gcm')
+def gcm_batch(quick):
+    '''GCMBATCH over batches of tracklets.'''
+    for n in ((1000,) if quick else (100, 10000, 100000)):
+        for npts in (3, 5):
+            for geometry in synthetic.GEOMETRIES:
+                args = synthetic.tracklets(n, npts, geometry)
+                yield (dict(name='GCMBATCH', ntracklets=n, npts=npts,
+                            geometry=geometry),
+                       lambda: gcm.GCMBATCH(*args).rms(), n)
+
+
+@case('gcm')
+def gcm_incremental(quick):
+    '''GCMINC: add an observation, query the RMS, remove it again.'''
+    for npts in (5, 50):
+        date, ra, dec, _ = synthetic.tracklets(1, npts)
+        inc = gcm.GCMINC(date, ra, dec)
+        t, r, d = date[-1] + 0.001, ra[-1], dec[-1]
+
+        def cycle():
+            key = inc.add(t, r, d)
+            inc.rms()
+            inc.remove(key)
+        yield dict(name='GCMINC.add+rms+remove', npts=npts), cycle, 1
+
+
+@case('gcm')
+def gcm_kernels(quick):
+    '''Coordinate conversion & rotation: namedtuple API versus arrays.'''
+    rm = gcm.GCMNEW(*synthetic.tracklets(1, 3)[:3]).rm
+    for n in ((3, 10000) if quick else (3, 100, 10000, 1000000)):
+        date, ra, dec, _ = synthetic.tracklets(1, n)
+        sph = np.column_stack((ra, dec))
+        cart = gcm.sphrToCartArr(sph)
+        out = np.empty_like(cart)
+        if n <= 10000:
+            carts = [gcm.Cart(*c) for c in cart.tolist()]
+            sphrs = [gcm.Sphr(*s) for s in sph.tolist()]
+            yield (dict(name='cartRot', npts=n),
+                   lambda: gcm.cartRot(rm, carts), n)
+            yield (dict(name='sphrToCart', npts=n),
+                   lambda: gcm.sphrToCart(sphrs), n)
+        yield (dict(name='cartRotArr', npts=n),
+               lambda: gcm.cartRotArr(rm, cart, out=out), n)
+        yield (dict(name='sphrToCartArr', npts=n),
+               lambda: gcm.sphrToCartArr(sph, out=out), n)
+
+
+@case('transformations')
+def covariance_remap(quick):
+    '''TRANSFORMS.covarianceRemap, one matrix per call.'''
+    T = transformations.TRANSFORMS()
+    for k in (2, 6, 9):
+        cov, partial = synthetic.covariances(1, k)
+        yield (dict(name='covarianceRemap', k=k, m=k),
+               lambda: T.covarianceRemap(cov[0], partial[0]), 1)
+
+
+@case('transformations')
+def covariance_remap_batch(quick):
+    '''TRANSFORMS.covarianceRemap on stacks of matrices, one call.'''
+    T = transformations.TRANSFORMS()
+    for n in ((1000,) if quick else (1000, 100000)):
+        for k in (6, 9):
+            cov, partial = synthetic.covariances(n, k)
+            out = np.empty_like(cov)
+            yield (dict(name='covarianceRemap[stack]', n=n, k=k, m=k),
+                   lambda: T.covarianceRemap(cov, partial, out=out), n)
+
+
+@case('transformations')
+def elements(quick):
+    '''Element transforms, with Jacobians, over a catalogue.'''
+    T = transformations.TRANSFORMS()
+    for n in ((1000,) if quick else (1, 1000, 100000)):
+        state = synthetic.states(n)
+        kep = T.cartesianToKeplerian(state)[0]
+        yield (dict(name='cartesianToKeplerian', n=n),
+               lambda: T.cartesianToKeplerian(state), n)
+        yield (dict(name='keplerianToCartesian', n=n),
+               lambda: T.keplerianToCartesian(kep), n)
+        yield (dict(name='equatorialToEcliptic', n=n),
+               lambda: T.equatorialToEcliptic(state), n)
+
+
+@case('fit')
+def residuals(quick):
+    '''FIT.get_residuals over one object's observations (& light time).'''
+    f = mpcfit.FIT()
+    for n in ((10, 1000) if quick else (10, 100, 1000, 10000)):
+        x, epoch, t, d, observer = synthetic.observations(n)
+        params = dict(epoch=epoch, observer=observer)
+        out = np.empty((n, 2))
+        yield (dict(name='get_residuals', nobs=n),
+               lambda: f.get_residuals(x, t, d, params, out=out), n)
+        lightTime = dict(params, lightTime=True)
+        yield (dict(name='get_residuals', lightTime=True, nobs=n),
+               lambda: f.get_residuals(x, t, d, lightTime, out=out), n)
+
+
+@case('fit')
+def explicit(quick):
+    '''FIT.get_best_fit_EXPLICIT & _LAZY from a perturbed starting orbit.'''
+    f = mpcfit.FIT()
+    for n in ((10, 1000) if quick else (10, 100, 1000, 10000)):
+        x, epoch, t, d, observer = synthetic.observations(n)
+        params = dict(epoch=epoch, observer=observer, sigma=0.1)
+        start = x * (1 + 1e-5 * np.arange(1, 7))
+        yield (dict(name='get_best_fit_EXPLICIT', nobs=n),
+               lambda: f.get_best_fit_EXPLICIT(start, t, d, params), n)
+        for backend in mpcfit.LSQ_BACKENDS:
+            if backend != 'scipy' or mpcfit._haveScipy():
+                yield (dict(name='get_best_fit_LAZY', backend=backend,
+                            nobs=n),
+                       lambda: f.get_best_fit_LAZY(start, t, d, params,
+                                                   backend=backend), n)
+
+
+@case('fit')
+def weights(quick):
+    '''normalEquations with diagonal, 2 x 2 and per-night weights.'''
+    rng = np.random.RandomState(0)
+    for n in ((1000,) if quick else (1000, 10000, 100000)):
+        nu, B = rng.normal(size=(n, 2)), rng.normal(size=(n, 2, 6))
+        pairs = np.zeros((n, 2, 2))
+        pairs[:, 0, 0] = pairs[:, 1, 1] = 1.
+        pairs[:, 0, 1] = pairs[:, 1, 0] = 0.3
+        offsets = np.arange(0, n + 1, 4)
+        block = mpcfit.BLOCK_WEIGHTS.fromCovariance(
+            offsets, synthetic.covariances(len(offsets) - 1, 8)[0])
+        for name, W in (('diagonal', np.ones((n, 2))), ('2x2', pairs),
+                        ('block4', block)):
+            yield (dict(name='normalEquations', weights=name, nobs=n),
+                   lambda: mpcfit.normalEquations(B, W, nu), n)
+
+
+@case('fit')
+def reject(quick):
+    '''FIT.get_best_fit_REJECT with 2% of observations 10" off.'''
+    f = mpcfit.FIT()
+    for n in ((100,) if quick else (100, 1000, 10000)):
+        x, epoch, t, d, observer = synthetic.observations(n)
+        d[::50, 0] += 5e-5
+        params = dict(epoch=epoch, observer=observer, sigma=0.1)
+        yield (dict(name='get_best_fit_REJECT', nobs=n),
+               lambda: f.get_best_fit_REJECT(x, t, d, params), n)
+
+
+@case('fit')
+def batch(quick):
+    '''FIT.get_best_fit_BATCH against a loop of get_best_fit_EXPLICIT.'''
+    f = mpcfit.FIT()
+    for m in ((100,) if quick else (100, 1000)):
+        nobs = 20
+        x, epoch, t, d, observer, offsets = synthetic.objects(m, nobs)
+        start = x * (1 + 1e-5 * np.arange(1, 7))
+        params = dict(epoch=epoch, observer=observer, sigma=0.1)
+        yield (dict(name='get_best_fit_BATCH', nobjects=m, nobs=nobs),
+               lambda: f.get_best_fit_BATCH(start, t, d, offsets, params), m)
+        if m <= 100:
+            def loop():
+                for i in range(m):
+                    s = slice(offsets[i], offsets[i + 1])
+                    f.get_best_fit_EXPLICIT(start[i], t[s], d[s],
+                                            dict(params, observer=observer[s]))
+            yield (dict(name='get_best_fit_EXPLICIT[loop]', nobjects=m,
+                        nobs=nobs), loop, m)
+
+
+@case('fit')
+def advance(quick):
+    '''kepler.advance, one state per time, with & without STMs.'''
+    for n in ((1000,) if quick else (1000, 100000)):
+        x = synthetic.states(n)
+        t = np.random.RandomState(0).uniform(-3000, 3000, n)
+        index = np.arange(n)
+        for stm in (False, True):
+            yield (dict(name='kepler.advance', stm=stm, npts=n),
+                   lambda: kepler.advance(x, np.zeros(n), t, stm=stm,
+                                          index=index), n)
+
+
+@case('fit')
+def perturbed(quick):
+    '''get_best_fit_EXPLICIT with nbody.NBODY (2 perturbers) over a year.'''
+    x = synthetic.states(3, seed=1)
+    t = np.arange(57700., 58300.5, 0.5)
+    ephem = ephemeris.EPHEMERIS.fromTable(t, np.stack(
+        [kepler.advance(xi, t[0], t)[:, :3] for xi in x[1:]]),
+        ['earth', 'jupiter'])
+    for n in ((100,) if quick else (100, 1000)):
+        x, epoch, t, d, observer = synthetic.observations(n)
+        params = dict(epoch=epoch, observer=observer, sigma=0.1)
+        start = x * (1 + 1e-5 * np.arange(1, 7))
+        # a new NBODY each run, which has no integrations kept
+        yield (dict(name='get_best_fit_EXPLICIT', advance='NBODY', nobs=n),
+               lambda: mpcfit.FIT().get_best_fit_EXPLICIT(start, t, d, dict(
+                params, advance=nbody.NBODY(ephem).advance)), n)
+
+
+@case('ingest')
+def parse(quick):
+    '''ingest.parseMPC80 & parsePSV of in-memory files.'''
+    for n in ((10000,) if quick else (10000, 100000, 1000000)):
+        mpc80, psv = synthetic.mpc80(n), synthetic.psv(n)
+        yield (dict(name='parseMPC80', nlines=n),
+               lambda: ingest.parseMPC80(mpc80), n)
+        yield (dict(name='parsePSV', nlines=n),
+               lambda: ingest.parsePSV(psv), n)
+
+
+@case('ingest')
+def cached(quick):
+    '''CACHE.updateFile of an MPC80 file that hasn't changed, against
+    decoding it all.'''
+    def fitter(objId, obs, previous):
+        orbit = mpcfit.ORBIT_FIT()
+        orbit.xBest_Vec, orbit.G_Mat = np.zeros(6), np.eye(6)
+        orbit.nu_Vec, orbit.Q_Mat, orbit.converged = \
+            np.zeros((len(obs), 2)), 0., True
+        return orbit, 58000.
+    tmp = tempfile.mkdtemp()
+    try:
+        for n in ((10000,) if quick else (10000, 100000)):
+            path = os.path.join(tmp, 'obs{}.txt'.format(n))
+            with open(path, 'wb') as f:
+                f.write(synthetic.mpc80(n))
+            c = cache.CACHE(os.path.join(tmp, 'cache{}'.format(n)))
+            c.updateFile(path, fitter)
+            yield (dict(name='CACHE.updateFile[unchanged]', nlines=n),
+                   lambda: c.updateFile(path, fitter), n)
+            yield (dict(name='read', nlines=n), lambda: ingest.read(path), n)
+    finally:
+        shutil.rmtree(tmp)
+
+
+@case('ephemeris')
+def chebyshev(quick):
+    '''EPHEMERIS.evaluate of 2 bodies at random times over 10 years.'''
+    x = synthetic.states(2)
+    t = np.arange(55000., 58660.5, 0.5)
+    ephem = ephemeris.EPHEMERIS.fromTable(t, np.stack(
+        [kepler.advance(xi, t[0], t)[:, :3] for xi in x]), ['a', 'b'])
+    for n in ((1000, 100000) if quick else (1000, 100000, 1000000)):
+        times = np.random.RandomState(0).uniform(ephem.start, ephem.end, n)
+        yield (dict(name='EPHEMERIS.evaluate', npts=n),
+               lambda: ephem.evaluate(times), n)
+        yield (dict(name='EPHEMERIS.evaluate', velocity=True, npts=n),
+               lambda: ephem.evaluate(times, velocity=True), n)
+
+
+@case('ephemeris')
+def geocentric(quick):
+    '''OBSCODES.index & geocentric for 1000 sites at random times.'''
+    rng = np.random.RandomState(0)
+    sites = observatories.OBSCODES(
+        ['{:03d}'.format(i) for i in range(1000)], rng.uniform(0, 360, 1000),
+        rng.uniform(0.5, 1, 1000), rng.uniform(-0.8, 0.8, 1000))
+    for n in ((1000, 100000) if quick else (1000, 100000, 1000000)):
+        codes = sites.codes[rng.randint(0, 1000, n)]
+        times = rng.uniform(55000., 60000., n)
+        index = sites.index(codes)
+        yield (dict(name='OBSCODES.index', npts=n),
+               lambda: sites.index(codes), n)
+        yield (dict(name='OBSCODES.geocentric', npts=n),
+               lambda: sites.geocentric(index, times), n)
+
+
+# Running & reporting
+# --------------------------------------------------------------
+
+def timeFunc(func, repeat=5, minTime=0.05):
+    '''Best and median time per call (seconds) over `repeat` runs of
+    enough calls to take at least minTime seconds.'''
+    number = 1
+    while True:
+        t = timeit.timeit(func, number=number)
+        if t >= minTime:
+            break
+        number *= 2 if t == 0 else max(2, int(1.5 * minTime / t))
+    times = [timeit.timeit(func, number=number) / number
+             for _ in range(repeat)]
+    return number, min(times), float(np.median(times))
+
+
+def environment():
+    '''Description of where the results came from.'''
+    return dict(
+        date=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        mpcfit=package.__version__,
+        python=platform.python_version(),
+        numpy=np.__version__,
+        platform=platform.platform(),
+        machine=platform.machine(),
+        processor=platform.processor())
+
+
+def run(groups=None, filter=None, quick=False, repeat=5, log=None):
+    '''Run the registered cases.
+
+    Parameters
+    ----------
+    groups : iterable of str, optional
+        Only run cases in these groups.
+    filter : str, optional
+        Only run cases whose name contains this string.
+    quick : bool
+        Run a reduced set of sizes.
+    repeat : int
+        Number of timing runs per case.
+    log : file-like, optional
+        Progress is written here.
+
+    Returns
+    -------
+    dict
+        'environment' and a list of 'results', one per case, with
+        params, calls per run, best & median seconds per call and
+        seconds per item; skipped cases have a 'skipped' reason.
+    '''
+    results = []
+    for group, gen in CASES:
+        if groups and group not in groups:
+            continue
+        try:
+            for params, func, nItems in gen(quick):
+                if filter and filter not in params['name']:
+                    continue
+                # keep stdout clean of anything the timed code prints
+                with contextlib.redirect_stdout(io.StringIO()):
+                    number, best, median = timeFunc(func, repeat)
+                r = dict(group=group, params=params, number=number,
+                         best=best, median=median, perItem=best / nItems)
+                results.append(r)
+                if log:
+                    log.write('{:<16} {:<56} {:>12.3e} s\n'.format(
+                        group, label(params), best))
+        except Skip as e:
+            results.append(dict(group=group, params=dict(name=gen.__name__),
+                                skipped=str(e)))
+            if log:
+                log.write('{:<16} {:<56} skipped: {}\n'.format(
+                    group, gen.__name__, e))
+    return dict(environment=environment(), results=results)
+
+
+def label(params):
+    '''One-line description of a case.'''
+    return ' '.join([params['name']] + [
+        '{}={}'.format(k, v) for k, v in sorted(params.items())
+        if k != 'name'])
+
+
+def compare(old, new, out=sys.stdout):
+    '''Print the ratio new/old of best times for cases in both results.'''
+    def index(res):
+        return {(r['group'], label(r['params'])): r['best']
+                for r in res['results'] if 'best' in r}
+    a, b = index(old), index(new)
+    for key in sorted(set(a) & set(b)):
+        out.write('{:<16} {:<56} {:>7.2f}\n'.format(
+            key[0], key[1], b[key] / a[key]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='mpcfit benchmarks')
+    parser.add_argument('--output', '-o', help='write JSON results here')
+    parser.add_argument('--group', action='append',
+                        help='only run this group (gcm, transformations, '
+                        'fit, ingest, ephemeris); repeatable')
+    parser.add_argument('--filter', help='only run cases whose name '
+                        'contains this string')
+    parser.add_argument('--quick', action='store_true',
+                        help='reduced set of sizes')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two JSON result files instead of '
+                        'running')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            compare(json.load(f), json.load(g))
+        return 0
+
+    res = run(args.group, args.filter, args.quick, args.repeat,
+              log=sys.stdout)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(res, f, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,185 @@
+# /mpcfit/benchmarks/synthetic.py
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Synthetic inputs for the benchmarks.
+# Everything is generated from a fixed seed, so that timings
+# from different machines / releases are of the same work.
+#
+# --------------------------------------------------------------
+"""
+
+# Import third-party packages
+# --------------------------------------------------------------
+import numpy as np
+
+# Import neighboring packages
+# --------------------------------------------------------------
+from mpcfit import mpcfit
+from mpcfit import transformations
+
+
+GEOMETRIES = ('generic', 'equator', 'pole', 'wrap')
+'''Tracklet geometries, each taking a different path through GCM:
+generic - anywhere on the sky, rotated to the equator before fitting
+equator - moving along the equator, so not rotated
+pole    - within an arc minute of the north pole
+wrap    - crossing RA = 0
+'''
+
+
+def tracklets(n, npts, geometry='generic', seed=0):
+    '''n tracklets of npts observations each, with 0.1" noise.
+
+    Parameters
+    ----------
+    n : int
+        Number of tracklets.
+    npts : int
+        Observations per tracklet (>= 2).
+    geometry : str
+        One of GEOMETRIES.
+    seed : int
+
+    Returns
+    -------
+    date, RA, DEC, offsets : ndarrays
+        In the concatenated form used by gcm.GCMBATCH. RA & DEC in radians.
+    '''
+    if geometry not in GEOMETRIES:
+        raise ValueError('unknown geometry {}'.format(geometry))
+    rng = np.random.RandomState(seed)
+    dt = np.sort(rng.uniform(0, 0.05, (n, npts)), axis=1)
+    dt -= dt[:, :1]
+    dt[:, -1] = 0.05
+    rate = rng.normal(0, 0.05, (n, 2))
+    ra0 = rng.uniform(0, 2 * np.pi, n)
+    dec0 = rng.uniform(-1.4, 1.4, n)
+    if geometry == 'equator':
+        dec0[:], rate[:, 1] = 0., 0.
+    elif geometry == 'pole':
+        dec0[:] = np.pi / 2 - 3e-4
+        rate[:, 1] = -np.abs(rate[:, 1])
+    elif geometry == 'wrap':
+        ra0[:] = 2 * np.pi - 1e-3
+        rate[:, 0] = np.abs(rate[:, 0]) + 0.03
+    noise = rng.normal(0, 5e-7, (2, n, npts))
+    ra = np.fmod(ra0[:, None] + rate[:, :1] * dt + noise[0], 2 * np.pi)
+    dec = dec0[:, None] + rate[:, 1:] * dt + noise[1]
+    date = 58000. + rng.uniform(0, 1000, n)[:, None] + dt
+    offsets = np.arange(n + 1) * npts
+    return date.ravel(), ra.ravel(), dec.ravel(), offsets
+
+
+def covariances(n, k, m=None, seed=0):
+    '''n random symmetric positive definite k x k covariance matrices,
+    and n m x k partial derivative matrices to remap them with.
+
+    Returns
+    -------
+    cov : ndarray, shape (n, k, k)
+    partial : ndarray, shape (n, m, k)
+    '''
+    m = k if m is None else m
+    rng = np.random.RandomState(seed)
+    a = rng.normal(size=(n, k, k))
+    cov = np.matmul(a, a.transpose(0, 2, 1)) + k * np.eye(k)
+    partial = rng.normal(size=(n, m, k))
+    return cov, partial
+
+
+def states(n, seed=0):
+    '''n heliocentric Cartesian states (au, au/day) of bound orbits:
+    a in 1 - 5 au, e up to 0.5, i up to 30 degrees.
+
+    Returns
+    -------
+    ndarray, shape (n, 6)
+    '''
+    rng = np.random.RandomState(seed)
+    el = np.column_stack((rng.uniform(1, 5, n), rng.uniform(0.01, 0.5, n),
+                          rng.uniform(0.01, 0.5, n),
+                          rng.uniform(0, 2 * np.pi, (3, n)).T))
+    return transformations.TRANSFORMS().keplerianToCartesian(el)[0]
+
+
+def observations(n, seed=0):
+    '''An object observed n times over a year from a (circular,
+    ecliptic) Earth orbit, with 0.1" noise.
+
+    Returns
+    -------
+    x, epoch : ndarray shape (6,), float
+        The object's heliocentric equatorial state at epoch.
+    t : ndarray, shape (n,)
+    d : ndarray, shape (n, 2)
+        Observed RA, Dec in radians.
+    observer : ndarray, shape (n, 3)
+        Heliocentric equatorial observer positions.
+    '''
+    rng = np.random.RandomState(seed)
+    x = states(1, seed)[0]
+    epoch = 58000.
+    t = epoch + np.sort(rng.uniform(-180, 180, n))
+    lon = 2 * np.pi * (t - 58000.) / 365.25
+    earth = np.column_stack((np.cos(lon), np.sin(lon), np.zeros(n)))
+    observer = transformations.TRANSFORMS().eclipticToEquatorial(earth)[0]
+    rho = mpcfit.twoBodyAdvance(x, epoch, t)[:, :3] - observer
+    d = np.column_stack((
+        np.arctan2(rho[:, 1], rho[:, 0]),
+        np.arctan2(rho[:, 2], np.hypot(rho[:, 0], rho[:, 1]))))
+    d += rng.normal(0, 5e-7, d.shape)
+    return x, epoch, t, d, observer
+
+
+def objects(m, n, seed=0):
+    '''m objects, each with observations(n) of its own orbit, in the
+    concatenated form used by FIT.get_best_fit_BATCH.
+
+    Returns
+    -------
+    x : ndarray, shape (m, 6)
+    epoch : float
+    t, d, observer : concatenated observations(n) output
+    offsets : ndarray, shape (m + 1,)
+    '''
+    obs = [observations(n, seed + i) for i in range(m)]
+    return (np.array([o[0] for o in obs]), obs[0][1],
+            np.concatenate([o[2] for o in obs]),
+            np.concatenate([o[3] for o in obs]),
+            np.concatenate([o[4] for o in obs]), np.arange(m + 1) * n)
+
+
+def mpc80(n, seed=0):
+    '''n MPC 80-column records (as bytes), of objects observed 1000
+    times each.'''
+    rng = np.random.RandomState(seed)
+    day = rng.uniform(1, 29, n)
+    h, m = rng.randint(0, 24, n), rng.randint(0, 60, n)
+    s = rng.uniform(0, 59.999, n)
+    d, dm = rng.randint(-89, 90, n), rng.randint(0, 60, n)
+    ds = rng.uniform(0, 59.99, n)
+    lines = ['{:05d}         C2017 09 {:09.6f}{:02d} {:02d} {:06.3f}{:+03d} '
+             '{:02d} {:05.2f}         20.5 V      F51'.format(i // 1000, *r)
+             for i, r in enumerate(zip(
+                 day.tolist(), h.tolist(), m.tolist(), s.tolist(),
+                 d.tolist(), dm.tolist(), ds.tolist()))]
+    return '\n'.join(lines).encode() + b'\n'
+
+
+def psv(n, seed=0):
+    '''n ADES PSV records (as bytes), as for mpc80.'''
+    rng = np.random.RandomState(seed)
+    day, h, m = rng.randint(1, 29, n), rng.randint(0, 24, n), \
+        rng.randint(0, 60, n)
+    s = rng.uniform(0, 59.999, n)
+    ra, dec = rng.uniform(0, 360, n), rng.uniform(-89, 89, n)
+    header = (b'# version=2017\n! mpcCode F51\n'
+              b'permID|stn|obsTime|ra|dec|rmsRA|rmsDec\n')
+    lines = ['{}|F51|2017-09-{:02d}T{:02d}:{:02d}:{:06.3f}Z|{:.7f}|{:+.7f}|'
+             '0.1|0.1'.format(i // 1000, *r)
+             for i, r in enumerate(zip(day.tolist(), h.tolist(), m.tolist(),
+                                       s.tolist(), ra.tolist(), dec.tolist()))]
+    return header + '\n'.join(lines).encode() + b'\n'
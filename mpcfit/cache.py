@@ -0,0 +1,296 @@
+# /mpcfit/mpcfit/cache.py
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# On-disk cache of objects' observations & their last orbit fits.
+#
+# Each object is stored with a hash of its observations. When an
+# object's observations are unchanged, its stored fit is used
+# rather than refitting it; for MPC 80-column files the hash is
+# of the records themselves, so unchanged objects are not even
+# decoded.
+#
+# A cache is a directory of .npy files, memory mapped when opened:
+# - observations/ : OBSERVATIONS archive, grouped by object
+# - objId, hash   : (M,) per object
+# - x_Vec (M, 6), epoch (M,), G_Mat (M, 6, 6), Q_Mat (M,),
+#   rms (M,), converged (M,) : per object, from its ORBIT_FIT
+# - nu_Vec (N, 2) : residuals, per observation
+#
+# --------------------------------------------------------------
+"""
+
+
+# Import third-party packages
+# --------------------------------------------------------------
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+# Import neighboring packages
+# --------------------------------------------------------------
+from mpcfit import ingest
+from mpcfit import mpcfit
+from mpcfit.observations import OBSERVATIONS
+
+
+# Hashes
+# --------------------------------------------------------------
+
+HASH_DTYPE = 'S32'
+
+
+def _digest(buf):
+    '''Hex digest (as bytes) of a buffer.'''
+    return hashlib.blake2b(buf, digest_size=16).hexdigest().encode()
+
+
+def objectHashes(obs):
+    '''
+    Hash of the observations of each object of an OBSERVATIONS
+
+    Returns
+    -------
+    ndarray, shape (M,)
+        In the order of obs.objects().
+    '''
+    records = np.empty(len(obs), dtype=[(c, OBSERVATIONS.DTYPES[c])
+                                        for c in OBSERVATIONS.COLUMNS])
+    for c in OBSERVATIONS.COLUMNS:
+        records[c] = getattr(obs, c)
+    raw, size = memoryview(records.view(np.uint8)), records.itemsize
+    offsets = obs.objects()[1]
+    return np.array([_digest(raw[lo * size:hi * size])
+                     for lo, hi in zip(offsets[:-1], offsets[1:])],
+                    dtype=HASH_DTYPE)
+
+
+def _ranges(starts, lengths):
+    '''Concatenated aranges of the given starts & lengths.'''
+    ends = np.cumsum(lengths)
+    return np.arange(ends[-1] if len(ends) else 0) - \
+        np.repeat(ends - lengths - starts, lengths)
+
+
+# The cache
+# --------------------------------------------------------------
+
+class CACHE:
+    '''
+    Observations & fits of objects, kept in a directory
+
+    The cache is rewritten (to a new directory, which then replaces
+    the old) by each update that fits anything; between updates it
+    is only read.
+    '''
+
+    FIELDS = dict(x_Vec=('f8', (6,)), epoch=('f8', ()),
+                  G_Mat=('f8', (6, 6)), Q_Mat=('f8', ()), rms=('f8', ()),
+                  converged=('?', ()))
+    '''Per-object arrays: dtype & shape of one object's entry.'''
+
+    def __init__(self, path, mmap=True):
+        '''
+        Open the cache in directory path (which needn't exist yet)
+
+        Parameters
+        ----------
+        path : str
+        mmap : bool
+            Memory map the arrays (read-only), rather than reading
+            them into memory.
+        '''
+        self.path, self.mmap = path, mmap
+        if os.path.exists(os.path.join(path, 'hash.npy')):
+            def load(name):
+                return np.load(os.path.join(path, name + '.npy'),
+                               mmap_mode='r' if mmap else None)
+            self.observations = OBSERVATIONS.open(
+                os.path.join(path, 'observations'), mmap)
+            self.objId, self.hash = load('objId'), load('hash')
+            self.nu_Vec = load('nu_Vec')
+            self.fits = {name: load(name) for name in self.FIELDS}
+        else:
+            self.observations = OBSERVATIONS([], [], [])
+            self.objId = np.zeros(0, dtype='S16')
+            self.hash = np.zeros(0, dtype=HASH_DTYPE)
+            self.nu_Vec = np.zeros((0, 2))
+            self.fits = {name: np.zeros((0,) + shape, dtype=dtype)
+                         for name, (dtype, shape) in self.FIELDS.items()}
+        self._offsets = self.observations.objects()[1]
+        self._row = {objId: i for i, objId in enumerate(self.objId.tolist())}
+
+    def __len__(self):
+        return len(self.objId)
+
+    def __contains__(self, objId):
+        return _key(objId) in self._row
+
+    def get(self, objId):
+        '''
+        The stored observations & fit of an object
+
+        Returns
+        -------
+        observations : OBSERVATIONS
+            View of the cache's (memory mapped) columns.
+        orbit : ORBIT_FIT
+            With xBest_Vec, G_Mat, nu_Vec, Q_Mat & converged, as
+            stored, and also epoch & rms (of the residuals, arc
+            seconds).
+        '''
+        i = self._row[_key(objId)]
+        lo, hi = self._offsets[i], self._offsets[i + 1]
+        orbit = mpcfit.ORBIT_FIT()
+        orbit.x_Vec = orbit.xBest_Vec = self.fits['x_Vec'][i]
+        orbit.G_Mat, orbit.Q_Mat = self.fits['G_Mat'][i], \
+            float(self.fits['Q_Mat'][i])
+        orbit.converged = bool(self.fits['converged'][i])
+        orbit.epoch, orbit.rms = float(self.fits['epoch'][i]), \
+            float(self.fits['rms'][i])
+        orbit.nu_Vec = self.nu_Vec[lo:hi]
+        orbit.counters = dict(method='CACHE')
+        return self.observations[lo:hi], orbit
+
+    def update(self, obs, fitter, hashes=None):
+        '''
+        Fit the objects of obs whose observations aren't those in the
+        cache, & store them. Cached objects not in obs are kept.
+
+        Parameters
+        ----------
+        obs : OBSERVATIONS
+            The observations of each object must be consecutive (see
+            OBSERVATIONS.sort).
+        fitter : callable
+            fitter(objId, observations, previous) -> (ORBIT_FIT, epoch)
+            previous is the object's (observations, ORBIT_FIT) from the
+            cache (e.g. as a starting orbit), or None. The fit must
+            have nu_Vec for all the observations; a fit of None (a
+            failure) is stored as NaN.
+        hashes : array-like, shape (M,), or None
+            Hash of each object of obs, objectHashes(obs) by default.
+
+        Returns
+        -------
+        list of str
+            The objects that were fitted.
+        '''
+        ids, offsets = obs.objects()
+        if len(np.unique(ids)) != len(ids):
+            raise ValueError('observations of each object must be '
+                             'consecutive')
+        hashes = objectHashes(obs) if hashes is None else \
+            np.asarray(hashes, dtype=HASH_DTYPE)
+
+        fresh = []
+        for i, objId in enumerate(ids.tolist()):
+            row = self._row.get(objId)
+            if row is not None and self.hash[row] == hashes[i]:
+                continue
+            view = obs[offsets[i]:offsets[i + 1]]
+            previous = None if row is None else self.get(objId)
+            orbit, epoch = fitter(objId.decode(), view, previous)
+            fresh.append((objId, hashes[i], view, orbit, epoch))
+        if fresh:
+            self._write(fresh)
+        return [f[0].decode() for f in fresh]
+
+    def updateFile(self, path, fitter, format=None,
+                   chunkSize=ingest.CHUNK_SIZE):
+        '''
+        update, from a file of observations
+
+        For MPC 80-column files the hashes are of each object's
+        records, & only the objects whose records have changed are
+        decoded. Other files are read in full (ingest.read).
+
+        Parameters
+        ----------
+        path : str
+        fitter : callable
+            As for update.
+        format, chunkSize :
+            As for ingest.iterChunks.
+
+        Returns
+        -------
+        list of str
+            The objects that were fitted.
+        '''
+        format = ingest.guessFormat(path) if format is None else format
+        if format != 'mpc80':
+            return self.update(ingest.read(path, format), fitter)
+        changed, hashes = [], {}
+        for objId, records in ingest.iterRecords(path, chunkSize):
+            h = _digest(records)
+            row = self._row.get(objId.encode())
+            if row is None or self.hash[row] != h:
+                changed.append(records)
+                hashes[objId.encode()] = h
+        obs = ingest.parseMPC80(b''.join(changed))
+        return self.update(obs, fitter,
+                           [hashes[i] for i in obs.objects()[0].tolist()])
+
+    def _write(self, fresh):
+        '''Write the kept & the fresh objects, & reopen.'''
+        replaced = {f[0] for f in fresh}
+        keep = np.array([i for i, objId in enumerate(self.objId.tolist())
+                         if objId not in replaced], dtype=int)
+        rows = _ranges(self._offsets[keep], np.diff(self._offsets)[keep])
+
+        columns = dict(objId=[self.objId[keep]], hash=[self.hash[keep]],
+                       nu_Vec=[self.nu_Vec[rows]])
+        for name in self.FIELDS:
+            columns[name] = [self.fits[name][keep]]
+        pieces = [self.observations[rows]]
+        for objId, h, view, orbit, epoch in fresh:
+            values = _fitValues(orbit, epoch, len(view))
+            columns['nu_Vec'].append(values.pop('nu_Vec'))
+            for name, value in values.items():
+                columns[name].append(np.asarray(value)[None])
+            columns['objId'].append([objId])
+            columns['hash'].append([h])
+            pieces.append(view)
+
+        parent = os.path.dirname(os.path.abspath(self.path))
+        tmp = tempfile.mkdtemp(prefix='.cache-', dir=parent)
+        OBSERVATIONS.concatenate(pieces).save(
+            os.path.join(tmp, 'observations'))
+        for name, parts in columns.items():
+            np.save(os.path.join(tmp, name + '.npy'),
+                    np.concatenate(parts))
+        if os.path.exists(self.path):
+            old = tempfile.mkdtemp(prefix='.cache-', dir=parent)
+            os.rename(self.path, os.path.join(old, 'cache'))
+            os.rename(tmp, self.path)
+            shutil.rmtree(old)
+        else:
+            os.rename(tmp, self.path)
+        self.__init__(self.path, self.mmap)
+
+
+def _key(objId):
+    '''objId as the bytes the cache is keyed by.'''
+    return objId.encode() if isinstance(objId, str) else bytes(objId)
+
+
+def _fitValues(orbit, epoch, n):
+    '''The arrays stored for one object, from its ORBIT_FIT.'''
+    if orbit is None:
+        return dict(x_Vec=np.full(6, np.nan), epoch=epoch,
+                    G_Mat=np.full((6, 6), np.nan), Q_Mat=np.nan,
+                    rms=np.nan, converged=False,
+                    nu_Vec=np.full((n, 2), np.nan))
+    nu = np.asarray(orbit.nu_Vec, dtype=float)
+    if nu.shape != (n, 2):
+        raise ValueError('fit must have residuals for all {} '
+                         'observations'.format(n))
+    return dict(x_Vec=orbit.xBest_Vec, epoch=epoch, G_Mat=orbit.G_Mat,
+                Q_Mat=orbit.Q_Mat, rms=np.sqrt(np.mean(nu**2)),
+                converged=orbit.converged, nu_Vec=nu)
@@ -0,0 +1,211 @@
+# /mpcfit/mpcfit/ephemeris.py
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Ephemerides of the observer & of perturbing bodies, as piecewise
+# Chebyshev series.
+#
+# A store is built once from a tabulated source (e.g. JPL Horizons
+# vectors): the time span is cut into equal segments, and each
+# body's position in each segment is fitted by a Chebyshev series
+# of the tabulated points in it. Stores are saved as directories
+# of .npy files & memory mapped when opened; open stores are kept
+# (see load), so that fits never rebuild or re-read them.
+#
+# Evaluation is vectorised over arbitrary (non-uniform) times:
+# each time picks out its segment's coefficients & the series is
+# summed for all times at once.
+#
+# --------------------------------------------------------------
+"""
+
+
+# Import third-party packages
+# --------------------------------------------------------------
+import os
+
+import numpy as np
+from numpy.polynomial import chebyshev
+
+
+# Ephemeris store
+# --------------------------------------------------------------
+
+_BLOCK = 1 << 14
+'''Times evaluated together (bounds the gathered coefficients).'''
+
+
+class EPHEMERIS:
+    '''
+    Positions of bodies, as Chebyshev series in equal time segments
+
+    names       :   ndarray, shape (B,): the bodies
+    start       :   float, start of the first segment
+    segment     :   float, length of the segments
+    coef        :   ndarray, shape (B, S, 3, K): the coefficients of
+                    each body, segment & coordinate (degree K - 1)
+    '''
+
+    def __init__(self, names, start, segment, coef):
+        self.names = np.asarray(names)
+        self.start, self.segment = float(start), float(segment)
+        self.coef = coef
+        self.end = self.start + self.segment * coef.shape[1]
+        self._body = {name: i for i, name in
+                      enumerate(self.names.tolist())}
+
+    @classmethod
+    def fromTable(cls, t, positions, names, segment=8., degree=12):
+        '''
+        Fit a store to tabulated positions
+
+        Parameters
+        ----------
+        t           :   ndarray, shape (T,)
+            Times of the table (increasing)
+        positions   :   ndarray, shape (B, T, 3)
+            Positions of each body at each time
+        names       :   sequence of str, length B
+        segment     :   float
+            Length of the segments; the store covers t[0] to the end
+            of the last segment that the table covers
+        degree      :   int
+            Degree of the series; each segment needs more than
+            degree tabulated points, ends included
+
+        Returns
+        -------
+        EPHEMERIS
+        '''
+        t = np.asarray(t, dtype=float)
+        positions = np.asarray(positions, dtype=float)
+        if positions.shape[1:] != (len(t), 3) or \
+                len(names) != len(positions):
+            raise ValueError('positions must have shape (bodies, times, 3)')
+        nSeg = int(np.floor((t[-1] - t[0]) / segment * (1 + 1e-12)))
+        if nSeg < 1:
+            raise ValueError('table is shorter than a segment')
+
+        B, K = len(positions), degree + 1
+        coef = np.empty((B, nSeg, 3, K))
+        # segment edges, with the points on the ends in both segments
+        edges = t[0] + segment * np.arange(nSeg + 1)
+        tol = 1e-9 * segment
+        lo = np.searchsorted(t, edges[:-1] - tol)
+        hi = np.searchsorted(t, edges[1:] + tol)
+        for s in range(nSeg):
+            if hi[s] - lo[s] <= degree:
+                raise ValueError('too few tabulated points in a segment')
+            x = 2 * (t[lo[s]:hi[s]] - edges[s]) / segment - 1
+            V = chebyshev.chebvander(x, degree)
+            y = positions[:, lo[s]:hi[s]].transpose(1, 0, 2).reshape(
+                len(x), -1)
+            c = np.linalg.lstsq(V, y, rcond=None)[0]
+            coef[:, s] = c.reshape(K, B, 3).transpose(1, 2, 0)
+        return cls(names, t[0], segment, coef)
+
+    def save(self, path):
+        '''Write the store to a directory of .npy files.'''
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'names.npy'), self.names)
+        np.save(os.path.join(path, 'grid.npy'),
+                np.array([self.start, self.segment]))
+        np.save(os.path.join(path, 'coef.npy'),
+                np.ascontiguousarray(self.coef))
+
+    @classmethod
+    def open(cls, path, mmap=True):
+        '''
+        Open a store written by save (see also load)
+
+        Parameters
+        ----------
+        path : str
+        mmap : bool
+            Memory map the coefficients (read-only), so that only the
+            segments used are read.
+        '''
+        start, segment = np.load(os.path.join(path, 'grid.npy'))
+        return cls(np.load(os.path.join(path, 'names.npy')), start,
+                   segment, np.load(os.path.join(path, 'coef.npy'),
+                                    mmap_mode='r' if mmap else None))
+
+    def bodies(self, names):
+        '''Indices of the named bodies.'''
+        try:
+            return np.array([self._body[name] for name in names], dtype=int)
+        except KeyError as e:
+            raise ValueError('no ephemeris for {}'.format(e.args[0]))
+
+    def evaluate(self, t_Vec, bodies=None, velocity=False):
+        '''
+        Positions (& velocities) of bodies at many times at once
+
+        Parameters
+        ----------
+        t_Vec       :   ndarray, shape (N,)
+        bodies      :   sequence of str, length B', optional
+            Default all the bodies of the store
+        velocity    :   bool
+            Whether to return the velocities (per unit of time) too
+
+        Returns
+        -------
+        positions   :   ndarray, shape (B', N, 3)
+        velocities  :   ndarray, shape (B', N, 3); only if velocity
+        '''
+        t_Vec = np.asarray(t_Vec, dtype=float)
+        if np.any(t_Vec < self.start) or np.any(t_Vec > self.end):
+            raise ValueError('times outside the ephemeris, {} to {}'
+                             .format(self.start, self.end))
+        b = np.arange(len(self.names)) if bodies is None else \
+            self.bodies(bodies)
+        u = (t_Vec - self.start) / self.segment
+        seg = np.minimum(u.astype(int), self.coef.shape[1] - 1)
+        x = 2 * (u - seg) - 1
+
+        # T_k(x) & their derivatives, shape (K, N)
+        K = self.coef.shape[3]
+        T, dT = np.empty((K, len(x))), np.zeros((K, len(x)))
+        T[0] = 1.
+        if K > 1:
+            T[1], dT[1] = x, 1.
+        for k in range(2, K):
+            T[k] = 2 * x * T[k - 1] - T[k - 2]
+            dT[k] = 2 * T[k - 1] + 2 * x * dT[k - 1] - dT[k - 2]
+
+        # read each segment used once (pages of a memory map), then sum
+        # the series for blocks of times
+        used, inverse = np.unique(seg, return_inverse=True)
+        c = np.asarray(self.coef[b[:, None], used[None, :]])
+        positions = np.empty((len(b), len(x), 3))
+        velocities = np.empty((len(b), len(x), 3)) if velocity else None
+        for lo in range(0, len(x), _BLOCK):
+            block = slice(lo, lo + _BLOCK)
+            cb = c[:, inverse[block]]
+            positions[:, block] = np.einsum('bnck,kn->bnc', cb, T[:, block])
+            if velocity:
+                velocities[:, block] = np.einsum('bnck,kn->bnc', cb,
+                                                 dT[:, block])
+        if not velocity:
+            return positions
+        return positions, velocities * (2 / self.segment)
+
+
+# Open stores
+# --------------------------------------------------------------
+
+_OPEN = {}
+
+
+def load(path):
+    '''
+    The store in directory path, opened (memory mapped) on the first
+    call only: later calls return the same EPHEMERIS.
+    '''
+    key = os.path.realpath(path)
+    if key not in _OPEN:
+        _OPEN[key] = EPHEMERIS.open(path)
+    return _OPEN[key]
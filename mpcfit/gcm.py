@@ -23,6 +23,9 @@
 import numpy as np
 import collections
 import math
+import os
+from concurrent import futures
+from multiprocessing import shared_memory
 
 # Import neighboring packages
 # --------------------------------------------------------------
@@ -70,6 +73,8 @@ Sphr.__str__ = lambda self: '({}, {})'.format(dms(self.ra), dms(self.dec))
 def cartToSphr(cl):
     '''Convert 3D cartesian coordinates to spherical (RA, Dec) in radians.
 
+    Thin wrapper around cartToSphrArr.
+
     Parameters
     ----------
     cl : iterable of objects with x, y, z attributes
@@ -78,13 +83,15 @@ def cartToSphr(cl):
     -------
     list of Sphr
     '''
-    return [Sphr(math.fmod(math.atan2(c.y, c.x) + math.tau, math.tau),
-        math.asin(c.z)) for c in cl]
+    c = np.array([(c.x, c.y, c.z) for c in cl], dtype=float).reshape(-1, 3)
+    return [Sphr(*s) for s in cartToSphrArr(c).tolist()]
 
 
 def sphrToCart(sl):
     '''Convert spherical coordinates to 3D cartesian unit vectors.
 
+    Thin wrapper around sphrToCartArr.
+
     Parameters
     ----------
     sl : iterable of objects with ra, dec attributes
@@ -94,34 +101,38 @@ def sphrToCart(sl):
     list of Cart
 
     '''
-    return [Cart(t * math.cos(s.ra), t * math.sin(s.ra), math.sin(s.dec))
-        for s, t in zip(sl, [math.cos(s.dec) for s in sl])]
+    s = np.array([(s.ra, s.dec) for s in sl], dtype=float).reshape(-1, 2)
+    return [Cart(*c) for c in sphrToCartArr(s).tolist()]
 
 
 def cartCross(a, b):
     '''3D vector cross product, a x b.
 
+    Pure python: for single vectors this is quicker than np.cross.
+    Use cartCrossArr for arrays of vectors.
+
     Parameters
     ----------
     a, b : objects with x, y, z attributes
     '''
-    return Cart(*np.cross(a,b).tolist())   # MJP: Forcing into a Cart for now ...
-    """
     return Cart(
         a.y * b.z - a.z * b.y,
         a.z * b.x - a.x * b.z,
         a.x * b.y - a.y * b.x)
-    """
+
 
 def cartDot(a, b):
     '''3D vector dot product.
-        
-        Parameters
-        ----------
-        a, b : objects with x, y, z attributes
-        '''
-    return np.inner(a,b)
-    #return a.x * b.x + a.y * b.y + a.z * b.z
+
+    Pure python: for single vectors this is quicker than np.inner.
+    Use cartDotArr for arrays of vectors.
+
+    Parameters
+    ----------
+    a, b : objects with x, y, z attributes
+    '''
+    return a.x * b.x + a.y * b.y + a.z * b.z
+
 
 def cartSquare(a):
     '''a dot a
@@ -133,17 +144,13 @@ def cartSquare(a):
     return cartDot(a, a)
 
 
-
-
 def cartRot(rm, aa):
     '''Rotate cartesian coordinates.
 
     It does matrix multiplication, specialized to broadcast multiplication of
-    a rotation matrix to a list of carts.'''
-    return [Cart(
-        rm[0][0] * a.x + rm[0][1] * a.y + rm[0][2] * a.z,
-        rm[1][0] * a.x + rm[1][1] * a.y + rm[1][2] * a.z,
-        rm[2][0] * a.x + rm[2][1] * a.y + rm[2][2] * a.z) for a in aa]
+    a rotation matrix to a list of carts. Thin wrapper around cartRotArr.'''
+    c = np.array([(a.x, a.y, a.z) for a in aa], dtype=float).reshape(-1, 3)
+    return [Cart(*r) for r in cartRotArr(rm, c).tolist()]
 
 
 def transpose3(a):
@@ -167,6 +174,178 @@ eye3 = ((1., 0., 0.), (0., 1., 0.), (0., 0., 1.))
 '''3x3 identity matrix as tuple of tuples of floats'''
 
 
+# Array-native versions of the above
+# - Take (N,2) RA,Dec or (N,3) X,Y,Z ndarrays rather than lists of tuples
+# - Accept out= so that hot loops can reuse buffers
+# - out may be the same array as an input
+# --------------------------------------------------------------
+
+def _outArr(out, shape):
+    '''Check a caller-supplied output buffer, or allocate one.'''
+    if out is None:
+        return np.empty(shape)
+    if out.shape != shape:
+        raise ValueError('out has shape {}, {} needed'.format(
+            out.shape, shape))
+    return out
+
+
+def _unalias(a, out):
+    '''Copy of input a if writing to out could overwrite it, else a.'''
+    return a.copy() if np.may_share_memory(a, out) else a
+
+
+def sphrToCartArr(sph, out=None):
+    '''Convert spherical coordinates to 3D cartesian unit vectors.
+
+    Parameters
+    ----------
+    sph : (N,2) array-like
+        RA, Dec pairs, in radians.
+    out : (N,3) ndarray of floats, optional
+        Buffer for the result.
+
+    Returns
+    -------
+    (N,3) ndarray
+    '''
+    sph = np.asarray(sph, dtype=float)
+    out = _outArr(out, sph.shape[:-1] + (3,))
+    sph = _unalias(sph, out)
+    cosd = np.cos(sph[..., 1])
+    np.cos(sph[..., 0], out=out[..., 0])
+    out[..., 0] *= cosd
+    np.sin(sph[..., 0], out=out[..., 1])
+    out[..., 1] *= cosd
+    np.sin(sph[..., 1], out=out[..., 2])
+    return out
+
+
+def cartToSphrArr(cart, out=None):
+    '''Convert 3D cartesian unit vectors to spherical (RA, Dec) in radians.
+
+    Parameters
+    ----------
+    cart : (N,3) array-like
+    out : (N,2) ndarray of floats, optional
+        Buffer for the result.
+
+    Returns
+    -------
+    (N,2) ndarray
+        RA in [0, 2 pi), Dec in [-pi/2, pi/2].
+    '''
+    cart = np.asarray(cart, dtype=float)
+    out = _outArr(out, cart.shape[:-1] + (2,))
+    cart = _unalias(cart, out)
+    np.arctan2(cart[..., 1], cart[..., 0], out=out[..., 0])
+    out[..., 0] += math.tau
+    np.fmod(out[..., 0], math.tau, out=out[..., 0])
+    np.arcsin(cart[..., 2], out=out[..., 1])
+    return out
+
+
+def cartRotArr(rm, cart, idx=None, out=None):
+    '''Rotate cartesian coordinates.
+
+    Parameters
+    ----------
+    rm : 3x3 or (K,3,3) array-like
+        Rotation matrix, or one matrix per vector (K == N), or a table of
+        matrices indexed by idx.
+    cart : (N,3) array-like
+    idx : (N,) array of ints, optional
+        Row j of cart is rotated by rm[idx[j]].
+        Written out component by component, so that no (N,3,3) array of
+        gathered matrices has to be built.
+    out : (N,3) ndarray of floats, optional
+        Buffer for the result.
+
+    Returns
+    -------
+    (N,3) ndarray
+    '''
+    rm = np.asarray(rm, dtype=float)
+    cart = np.asarray(cart, dtype=float)
+    out = _outArr(out, cart.shape)
+    cart = _unalias(cart, out)
+    if rm.ndim == 2:
+        return np.matmul(cart, rm.T, out=out)
+    if idx is None:
+        return np.einsum('nij,nj->ni', rm, cart, out=out)
+    tmp = np.empty(len(cart))
+    for i in range(3):
+        np.multiply(rm[idx, i, 0], cart[:, 0], out=out[:, i])
+        out[:, i] += np.multiply(rm[idx, i, 1], cart[:, 1], out=tmp)
+        out[:, i] += np.multiply(rm[idx, i, 2], cart[:, 2], out=tmp)
+    return out
+
+
+def cartCrossArr(a, b, out=None):
+    '''3D vector cross products, a x b, of (N,3) arrays.'''
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    out = _outArr(out, np.broadcast(a, b).shape)
+    a = _unalias(a, out)
+    b = _unalias(b, out)
+    tmp = np.empty(out.shape[:-1])
+    for i, j, k in ((0, 1, 2), (1, 2, 0), (2, 0, 1)):
+        np.multiply(a[..., j], b[..., k], out=out[..., i])
+        out[..., i] -= np.multiply(a[..., k], b[..., j], out=tmp)
+    return out
+
+
+def cartDotArr(a, b, out=None):
+    '''3D vector dot products of (N,3) arrays.'''
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    out = _outArr(out, np.broadcast(a, b).shape[:-1])
+    return np.einsum('...i,...i->...', a, b, out=out)
+
+
+def transpose3Arr(a, out=None):
+    '''Transpose of a 3x3, or of each of a (K,3,3) array of, matrices.'''
+    a = np.asarray(a, dtype=float)
+    out = _outArr(out, a.shape)
+    out[...] = _unalias(a, out).swapaxes(-1, -2)
+    return out
+
+
+def _derotateArr(rm, sph, idx=None):
+    '''Rotate an (N,2) array of RA, Dec (radians) by the matrix rm, or by
+    rm[idx[j]] for point j if idx is given, returning the rotated RA, Dec.'''
+    return cartToSphrArr(cartRotArr(rm, sphrToCartArr(sph), idx))
+
+
+def _gcmRes(obs, rm, ra0, r0, rr, d0, dr, nt, idx=None):
+    '''Residuals in arc seconds, as an (N,2) array of (dec, ra) pairs.
+
+    Parameters
+    ----------
+    obs : (N,2) ndarray
+        Observed RA, Dec, already rotated-and-derotated.
+    rm : 3x3 or (K,3,3) array
+        Derotation matrix, or matrices indexed by idx.
+    ra0, r0, rr, d0, dr : float or ndarray parallel to nt
+        RA normalization and fitted RA & Dec offsets and rates.
+    nt : ndarray
+        Normalized times.
+    '''
+    sc = np.empty((len(nt), 2))
+    np.multiply(rr, nt, out=sc[:, 0])
+    sc[:, 0] += r0
+    sc[:, 0] += ra0
+    np.multiply(dr, nt, out=sc[:, 1])
+    sc[:, 1] += d0
+    sc = cartToSphrArr(cartRotArr(rm, sphrToCartArr(sc), idx), out=sc)
+    res = np.empty((len(nt), 2))
+    np.subtract(obs[:, 1], sc[:, 1], out=res[:, 0])
+    np.subtract(obs[:, 0], sc[:, 0], out=res[:, 1])
+    res[:, 1] *= np.cos(sc[:, 1])
+    res *= 180 / math.pi * 3600
+    return res
+
+
 class GCM:
     def __init__(self, date, pos):
         '''Fit positions and times to linear motion along a great circle.
@@ -232,7 +411,7 @@ class GCM:
 
             # transpose rotation array so it will derotate, after
             # least-squares fit.
-            transpose3(self.rm)
+            self.rm = transpose3(self.rm)
 
             # convert back to spherical coordinates for adjustment.
             # this does a cylindrical projection.
@@ -278,60 +457,361 @@ class GCM:
             self.d0 = invd * (sumdec * sumt2 - sumtdec * sumt)
             self.dr = invd * (len(nt) * sumtdec - sumdec * sumt)
 
+        # residuals are computed on rotated-and-derotated observed to
+        # minimize any systematic errors from rotating and derotating the
+        # computed. the observed only need doing once.
+        self._obs = _derotateArr(self.rm, np.array(rs) + (ra0, 0.))
+        self._res = None
+        self._rms = None
+
     def rms(self):
         '''RMS of residuals, in arc seconds.'''
-        rms, _ = self.rmsRes()
-        return rms
+        if self._rms is None:
+            res = self._resArr()
+            self._rms = math.sqrt(np.vdot(res, res) / len(res))
+        return self._rms
 
     def rmsRes(self):
         '''RMS and residuals, in arc seconds.'''
-        res = self.res()
-        return math.sqrt(sum(r[0] * r[0] + r[1] * r[1] for r in res) /
-            len(res)), res
+        return self.rms(), self.res()
 
     def res(self):
         '''Residuals in arc seconds.'''
+        return self._resArr().tolist()
 
-        rsc = [Sphr(self.r0 + self.rr * t, self.d0 + self.dr * t)
-            for t in self.nt]
+    def chi(self, sigma=1.):
+        '''Per-observation chi: total residual over sigma (arc seconds).'''
+        res = self._resArr()
+        return (np.hypot(res[:, 0], res[:, 1]) / sigma).tolist()
 
-        ''' residuals are computed on rotated-and-derotated observed to
-        minimize any systematic errors from rotating and derotating the
-        computed.'''
+    def _resArr(self):
+        '''Residuals as an (N,2) ndarray, computed once and then cached.'''
+        if self._res is None:
+            self._res = _gcmRes(
+                self._obs, self.rm, self.ra0, self.r0, self.rr, self.d0,
+                self.dr, np.array(self.nt))
+        return self._res
 
-        # fix up ra on both observed and computed
-        rso = [Sphr(o.ra + self.ra0, o.dec) for o in self.rs]
-        rsc = [Sphr(c.ra + self.ra0, c.dec) for c in rsc]
 
-        # rotate both back up to original place in the sky
-        rco = sphrToCart(rso)
-        rcc = sphrToCart(rsc)
-        co = cartRot(self.rm, rco)
-        cc = cartRot(self.rm, rcc)
-        so = cartToSphr(co)
-        sc = cartToSphr(cc)
+class GCMBATCH:
+    def __init__(self, date, RA, DEC, offsets, nWorkers=1, executor=None):
+        '''Fit many tracklets at once to linear motion along great circles.
 
-        return [[  # residuals in arc seconds
-            R2D(o.dec - c.dec) * 3600,
-            R2D(o.ra - c.ra) * 3600 * math.cos(c.dec)]
-            for o, c in zip(so, sc)]
+        The observations of all tracklets are concatenated into flat
+        arrays, and tracklet i occupies the slice offsets[i]:offsets[i+1].
+        Each tracklet is fit exactly as GCM would fit it, but the work for
+        all of them is done with vectorized numpy operations.
+
+        Parameters
+        ----------
+        date : array-like of floats, shape (M,)
+            Times of the observations, on some linear time scale.
+            Within each tracklet the first time must precede the last.
+        RA : array-like of floats, shape (M,)
+            Right-ascension of the observations, in radians.
+        DEC : array-like of floats, shape (M,)
+            Declination of the observations, in radians.
+        offsets : array-like of ints, shape (N+1,)
+            Start of each tracklet in the flat arrays, followed by M.
+        nWorkers : int or None
+            Number of processes to fit with. With more than one, tracklets
+            are split into chunks that are fit in a process pool; inputs and
+            results are passed through shared memory rather than pickled.
+            None means one per CPU. Results do not depend on nWorkers.
+        executor : concurrent.futures.ProcessPoolExecutor, optional
+            An open pool to fit in (with more than one worker), so that
+            many batches can share one pool instead of starting their
+            own; it is left open. nWorkers should be its size.
+
+        Attributes
+        ----------
+        r0, rr, d0, dr : ndarray, shape (N,)
+            Fitted RA & Dec offsets and rates in the rotated frame.
+        ra0, t0 : ndarray, shape (N,)
+            RA and time normalizations of each tracklet.
+        rm : ndarray, shape (N,3,3)
+            Matrices that derotate each tracklet back to its place in the sky.
+        '''
+        date = np.asarray(date, dtype=float)
+        RA = np.asarray(RA, dtype=float)
+        DEC = np.asarray(DEC, dtype=float)
+        offsets = np.asarray(offsets, dtype=np.intp)
+        if date.shape != RA.shape:
+            raise ValueError('date and RA different lengths')
+        if date.shape != DEC.shape:
+            raise ValueError('date and DEC different lengths')
+        if (offsets.ndim != 1 or len(offsets) < 2 or offsets[0] != 0 or
+                offsets[-1] != len(date)):
+            raise ValueError('offsets must run from 0 to len(date)')
+        npts = np.diff(offsets)
+        if np.any(npts < 2):
+            raise ValueError('at least two positions needed')
+        first = offsets[:-1]
+        last = offsets[1:] - 1
+        if np.any(date[first] >= date[last]):
+            raise ValueError('positive elapsed time needed')
+        if np.any((RA[first] == RA[last]) & (DEC[first] == DEC[last])):
+            raise ValueError('motion across sky needed')
+
+        self.offsets = offsets
+        self.npts = npts
+        # tracklet index of every observation
+        self.tid = np.repeat(np.arange(len(npts)), npts)
+        self._res = None
+        self._rms = None
+
+        if nWorkers is None:
+            nWorkers = os.cpu_count() or 1
+        if nWorkers < 1:
+            raise ValueError('nWorkers must be at least one')
+        if nWorkers == 1 or len(npts) == 1:
+            self._fit(date, RA, DEC)
+        else:
+            self._fitParallel(date, RA, DEC, nWorkers, executor)
+
+    def _fit(self, date, RA, DEC):
+        '''Fit all tracklets in this process.'''
+        offsets, npts, tid = self.offsets, self.npts, self.tid
+        first = offsets[:-1]
+        last = offsets[1:] - 1
+
+        # convert obs to cartesian
+        sph = np.column_stack((RA, DEC))
+        c = sphrToCartArr(sph)
+
+        # vectors normal to motion
+        norm = cartCrossArr(c[first], c[last])
+        nmag = np.sqrt(cartDotArr(norm, norm))
+
+        # rotation angle is angle from norm to +z
+        xy = np.hypot(norm[:, 0], norm[:, 1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tana = xy / norm[:, 2]
+            sina = xy / nmag
+            cosa = norm[:, 2] / nmag
+            lmix = norm[:, 1] / xy
+            lmiy = -norm[:, 0] / xy
+
+        # tracklets whose norm is close to the pole already are not rotated
+        rotate = np.abs(tana) > .0003
+
+        # build the rotation matrices, exactly as GCM does one at a time
+        sinagx = sina * lmix
+        sinagy = sina * lmiy
+        onemcosa = 1 - cosa
+        onemcosagx = onemcosa * lmix
+        onemcosagxgy = onemcosagx * lmiy
+        rmf = np.empty((len(npts), 3, 3))
+        rmf[:, 0, 0] = cosa + onemcosagx * lmix
+        rmf[:, 0, 1] = onemcosagxgy
+        rmf[:, 0, 2] = sinagy
+        rmf[:, 1, 0] = onemcosagxgy
+        rmf[:, 1, 1] = cosa + onemcosa * lmiy * lmiy
+        rmf[:, 1, 2] = -sinagx
+        rmf[:, 2, 0] = -sinagy
+        rmf[:, 2, 1] = sinagx
+        rmf[:, 2, 2] = cosa
+        rmf[~rotate] = np.eye(3)
+
+        # rotate the obs and convert back to spherical coordinates
+        # (a cylindrical projection); unrotated tracklets keep their input
+        rot = cartToSphrArr(cartRotArr(rmf, c, tid))
+        self.rs = rs = np.where(rotate[tid, None], rot, sph)
+        rsRA, rsDEC = rs[:, 0], rs[:, 1]
+
+        # transpose rotation arrays so they will derotate
+        self.rm = transpose3Arr(rmf)
+
+        # normalize ra to near 0 to avoid wraparound problems
+        self.ra0 = ra0 = rsRA[first]
+        ra0t = ra0[tid]
+        rsRA += 3 * math.pi
+        rsRA -= ra0t
+        np.fmod(rsRA, 2 * math.pi, out=rsRA)
+        rsRA -= math.pi
+
+        # normalize time to near 0 to maintain precision
+        self.t0 = t0 = date[first]
+        self.nt = nt = date - t0[tid]
+
+        # least squares fit of every tracklet
+        sumt = np.add.reduceat(nt, first)
+        sumra = np.add.reduceat(rsRA, first)
+        sumdec = np.add.reduceat(rsDEC, first)
+        sumt2 = np.add.reduceat(nt * nt, first)
+        sumtra = np.add.reduceat(nt * rsRA, first)
+        sumtdec = np.add.reduceat(nt * rsDEC, first)
+        n = npts.astype(float)
+        invd = 1 / (n * sumt2 - sumt * sumt)
+        self.r0 = invd * (sumra * sumt2 - sumtra * sumt)
+        self.rr = invd * (n * sumtra - sumra * sumt)
+        self.d0 = invd * (sumdec * sumt2 - sumtdec * sumt)
+        self.dr = invd * (n * sumtdec - sumdec * sumt)
+
+        # least squares fit not needed with just two points.
+        two = npts == 2
+        self.r0[two] = 0.
+        self.rr[two] = rsRA[last[two]] / nt[last[two]]
+        self.d0[two] = 0.
+        self.dr[two] = 0.
+
+        # cache the rotated-and-derotated observed
+        sph[:, 0] = rsRA
+        sph[:, 0] += ra0t
+        sph[:, 1] = rsDEC
+        self._obs = _derotateArr(self.rm, sph, tid)
+
+    def _fitParallel(self, date, RA, DEC, nWorkers, executor=None):
+        '''Fit chunks of tracklets in a pool of nWorkers processes.
+
+        Inputs are copied once into a shared memory block, and each worker
+        writes its results into its own slots of the same block, so the
+        results come back in input order whatever order chunks finish in.
+        The pool is executor if given, else one made for this batch.
+        '''
+        N, M = len(self.npts), len(date)
+
+        # chunks of about equal numbers of observations, a few per worker
+        nChunk = min(N, 4 * nWorkers)
+        bounds = np.unique(np.searchsorted(
+            self.offsets, np.linspace(0, M, nChunk + 1)))
+        bounds[0], bounds[-1] = 0, N
+
+        shm = shared_memory.SharedMemory(create=True, size=_batchNbytes(N, M))
+        try:
+            v = _batchViews(shm.buf, N, M)
+            v['date'][:] = date
+            v['RA'][:] = RA
+            v['DEC'][:] = DEC
+            v['offsets'][:] = self.offsets
+            if executor is None:
+                with futures.ProcessPoolExecutor(max_workers=nWorkers) as ex:
+                    _runBatchJobs(ex, shm.name, N, M, bounds)
+            else:
+                _runBatchJobs(executor, shm.name, N, M, bounds)
+            for name in _BATCH_TRACKLET_FIELDS + _BATCH_POINT_FIELDS:
+                setattr(self, name, v[name].copy())
+            v = None
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def rms(self):
+        '''RMS of residuals of each tracklet, in arc seconds.'''
+        if self._rms is None:
+            res = self._resArr()
+            sq = np.add.reduceat(
+                np.einsum('ij,ij->i', res, res), self.offsets[:-1])
+            self._rms = np.sqrt(sq / self.npts)
+        return self._rms.copy()
+
+    def rmsRes(self):
+        '''RMS of each tracklet and residuals of each observation, in arc
+        seconds.'''
+        return self.rms(), self.res()
+
+    def res(self):
+        '''Residuals in arc seconds, as an (M,2) array of (dec, ra) pairs.'''
+        return self._resArr().copy()
+
+    def chi(self, sigma=1.):
+        '''Per-observation chi: total residual over sigma (arc seconds).'''
+        res = self._resArr()
+        return np.hypot(res[:, 0], res[:, 1]) / sigma
+
+    def _resArr(self):
+        '''Residuals, computed once and then cached.'''
+        if self._res is None:
+            tid = self.tid
+            self._res = _gcmRes(
+                self._obs, self.rm, self.ra0[tid], self.r0[tid],
+                self.rr[tid], self.d0[tid], self.dr[tid], self.nt, tid)
+        return self._res
+
+
+_BATCH_TRACKLET_FIELDS = ('r0', 'rr', 'd0', 'dr', 'ra0', 't0', 'rm')
+_BATCH_POINT_FIELDS = ('rs', 'nt', '_obs')
+
+
+def _batchLayout(N, M):
+    '''(name, dtype, shape) of the GCMBATCH arrays in a shared memory block
+    for N tracklets of M observations in total.'''
+    return ([('date', np.float64, (M,)), ('RA', np.float64, (M,)),
+             ('DEC', np.float64, (M,)), ('offsets', np.intp, (N + 1,))] +
+            [(name, np.float64, (N,))
+             for name in _BATCH_TRACKLET_FIELDS[:-1]] +
+            [('rm', np.float64, (N, 3, 3)), ('rs', np.float64, (M, 2)),
+             ('nt', np.float64, (M,)), ('_obs', np.float64, (M, 2))])
+
+
+def _batchNbytes(N, M):
+    '''Size in bytes of the shared memory block for _batchLayout(N, M).'''
+    return sum(np.dtype(dtype).itemsize * int(np.prod(shape))
+               for _, dtype, shape in _batchLayout(N, M))
+
+
+def _batchViews(buf, N, M):
+    '''Dictionary of ndarray views of the arrays in a shared buffer.'''
+    views, pos = {}, 0
+    for name, dtype, shape in _batchLayout(N, M):
+        views[name] = np.ndarray(shape, dtype=dtype, buffer=buf, offset=pos)
+        pos += views[name].nbytes
+    return views
+
+
+def _runBatchJobs(ex, shmName, N, M, bounds):
+    '''Fit the chunks between bounds in pool ex and wait for them.'''
+    jobs = [ex.submit(_gcmBatchWorker, shmName, N, M, lo, hi)
+            for lo, hi in zip(bounds[:-1], bounds[1:])]
+    for job in jobs:
+        job.result()
+
+
+def _gcmBatchWorker(shmName, N, M, lo, hi):
+    '''Fit tracklets lo:hi of a GCMBATCH held in shared memory, writing the
+    results back into the same block. Runs in a worker process.'''
+    # pool workers share the parent's resource tracker, which forgets the
+    # block when the parent unlinks it, so attaching here is safe.
+    shm = shared_memory.SharedMemory(name=shmName)
+    try:
+        v = _batchViews(shm.buf, N, M)
+        a, b = v['offsets'][lo], v['offsets'][hi]
+        g = GCMBATCH(v['date'][a:b], v['RA'][a:b], v['DEC'][a:b],
+                     v['offsets'][lo:hi + 1] - a)
+        for name in _BATCH_TRACKLET_FIELDS:
+            v[name][lo:hi] = getattr(g, name)
+        for name in _BATCH_POINT_FIELDS:
+            v[name][a:b] = getattr(g, name)
+        v = None
+    finally:
+        shm.close()
+    return hi - lo
 
 
 class GCMNEW:
-    def __init__(self, date, RA, DEC, pos):
+    def __init__(self, date, RA, DEC):
         '''Fit positions and times to linear motion along a great circle.
-            
+
+        Numpy-native version of GCM: observations are passed as arrays and
+        all of the per-observation work (rotation, cylindrical projection,
+        least squares and residuals) is done on ndarrays.
+        Gives the same numbers as GCM.
+
         Parameters
         ----------
-        date : iterable of floats
+        date : array-like of floats
             Iterable parallel to RA & DEC, representing times at positions.
             Times must be on some linear time scale, for example JD or MJD.
-        RA : iterable of objects
-            Iterable parallel to date & DEC, representing right-ascention
+        RA : array-like of floats
+            Iterable parallel to date & DEC, representing right-ascension
             RA values must be in radians.
-        DEC: iterable of objects
+        DEC: array-like of floats
             Iterable parallel to date & RA, representing declination
+            DEC values must be in radians.
         '''
+        date = np.asarray(date, dtype=float)
+        RA = np.asarray(RA, dtype=float)
+        DEC = np.asarray(DEC, dtype=float)
         if len(date) != len(RA):
             raise ValueError('date and RA different lengths')
         if len(date) != len(DEC):
@@ -340,45 +820,264 @@ class GCMNEW:
             raise ValueError('at least two positions needed')
         if date[0] >= date[-1]:
             raise ValueError('positive elapsed time needed')
-        if RA[0] == RA[-1] and DEC[0] == DEC[-1] :
+        if RA[0] == RA[-1] and DEC[0] == DEC[-1]:
             raise ValueError('motion across sky needed')
-        
+
         # convert RA,DEC observations to cartesian unit vectors
-        self.cartUV = np.reshape(
-                                 np.array( [np.cos(DEC) * np.cos(RA), np.cos(DEC) * np.sin(RA), np.sin(DEC)]) ,
-                                 (-1,3)
-                                 )
+        self.rs = rs = np.column_stack((RA, DEC))
+        self.cartUV = cartUV = sphrToCartArr(rs)
 
         # vector normal to motion
-        # *** MJP : Note that at this point Sonia uses first and last points in the tracklet ( [0] & [-1] )
-        # *** MJP : May well be OK to do this, but I am slightly suspicious: why not fit generally ?
-        c = sphrToCart(pos)
-        print("pos=", pos)
-        print("c=", c)
+        # *** MJP : Note that at this point Sonia uses first and last points
+        # *** in the tracklet ( [0] & [-1] ), as does GCM
+        ax, ay, az = cartUV[0].tolist()
+        bx, by, bz = cartUV[-1].tolist()
+        nx = ay * bz - az * by
+        ny = az * bx - ax * bz
+        nz = ax * by - ay * bx
+        nmag = math.sqrt(nx * nx + ny * ny + nz * nz)
 
         # rotation angle is angle from norm to +z
+        xy = math.hypot(nx, ny)
+        try:
+            tana = xy / nz
+        except ZeroDivisionError:
+            tana = math.inf
 
-        # if norm is close to the pole already, don't mess with rotation.
-
-        # Build "rm", the rotation matrix that will rotate the coordinate system
-        # to the obs, so that a cylindrical projection will have negligible
-        # distortion.'''
-
-        # rotate all of cart
+        if not (abs(tana) > .0003):
+            # if norm is close to the pole already, don't mess with rotation.
+            self.rm = np.eye(3)
+        else:
+            # Build "rm", the rotation matrix that will rotate the coordinate
+            # system to the obs, so that a cylindrical projection will have
+            # negligible distortion.
+            sina = xy / nmag
+            cosa = nz / nmag
+            lmix = ny / xy
+            lmiy = -nx / xy
+            sinagx = sina * lmix
+            sinagy = sina * lmiy
+            onemcosa = 1 - cosa
+            onemcosagx = onemcosa * lmix
+            onemcosagxgy = onemcosagx * lmiy
 
-        # transpose rotation array so it will derotate,
-        # after least-squares fit.
+            # stored transposed, so that it will derotate after the fit
+            self.rm = np.array((
+                (cosa + onemcosagx * lmix, onemcosagxgy, -sinagy),
+                (onemcosagxgy, cosa + onemcosa * lmiy * lmiy, sinagx),
+                (sinagy, -sinagx, cosa)))
 
-        # convert back to spherical coordinates for adjustment.
-        # this does a cylindrical projection.
+            # rotate all of cart, and convert back to spherical coordinates
+            # for adjustment. this does a cylindrical projection.
+            cartToSphrArr(cartRotArr(self.rm.T, cartUV), out=rs)
 
         # normalize ra to near 0 to avoid wraparound problems
+        rsRA = rs[:, 0]
+        self.ra0 = ra0 = rsRA[0].item()
+        rsRA += 3 * math.pi
+        rsRA -= ra0
+        np.fmod(rsRA, 2 * math.pi, out=rsRA)
+        rsRA -= math.pi
 
         # normalize time to near 0 to maintain precision
+        self.t0 = t0 = date[0].item()
+        self.nt = nt = date - t0
 
+        if len(nt) == 2:
+            # Least squares fit not needed with just two points.
+            self.r0 = 0.
+            self.rr = (rsRA[1] / nt[1]).item()
+            self.d0 = 0.
+            self.dr = 0.
+        else:
+            # Calculate least squares
+            n = len(nt)
+            sumt = nt.sum().item()
+            sumt2 = np.dot(nt, nt).item()
+            sumra, sumdec = self.rs.sum(axis=0).tolist()
+            sumtra, sumtdec = np.dot(nt, self.rs).tolist()
+            invd = 1 / (n * sumt2 - sumt * sumt)
+            self.r0 = invd * (sumra * sumt2 - sumtra * sumt)
+            self.rr = invd * (n * sumtra - sumra * sumt)
+            self.d0 = invd * (sumdec * sumt2 - sumtdec * sumt)
+            self.dr = invd * (n * sumtdec - sumdec * sumt)
 
-        # Calculate least squares
+        # cache the rotated-and-derotated observed
+        self._obs = _derotateArr(self.rm, self.rs + (ra0, 0.))
+        self._res = None
+        self._rms = None
 
-        # Least squares fit not needed with just two points.
+    def rms(self):
+        '''RMS of residuals, in arc seconds.'''
+        if self._rms is None:
+            res = self._resArr()
+            self._rms = math.sqrt(np.vdot(res, res) / len(res))
+        return self._rms
 
+    def rmsRes(self):
+        '''RMS and residuals, in arc seconds.'''
+        return self.rms(), self.res()
 
+    def res(self):
+        '''Residuals in arc seconds, as an (N,2) array of (dec, ra) pairs.'''
+        return self._resArr().copy()
+
+    def chi(self, sigma=1.):
+        '''Per-observation chi: total residual over sigma (arc seconds).'''
+        res = self._resArr()
+        return np.hypot(res[:, 0], res[:, 1]) / sigma
+
+    def _resArr(self):
+        '''Residuals, computed once and then cached.'''
+        if self._res is None:
+            self._res = _gcmRes(
+                self._obs, self.rm, self.ra0, self.r0, self.rr, self.d0,
+                self.dr, self.nt)
+        return self._res
+
+
+class GCMINC:
+    def __init__(self, date, RA, DEC):
+        '''Fit to linear motion along a great circle that can be updated
+        one observation at a time.
+
+        The rotation frame, ra0 and t0 are those GCMNEW chooses for the
+        initial observations, and stay fixed. The sums over the rotated
+        observations that the least squares fit needs (sumt, sumra, ...)
+        are kept, so add() and remove() update the fit and the RMS in O(1).
+        Observations are kept by key (their position in date, RA & DEC,
+        then the key add() returns), so removing one is O(1) too.
+        While the frame stays valid (see frameValid) the results agree with
+        a fresh fit of the same observations; refit() re-derives the frame
+        from the current observations.
+
+        Parameters
+        ----------
+        date, RA, DEC : array-like of floats
+            As for GCMNEW. RA & DEC in radians.
+        '''
+        g = GCMNEW(date, RA, DEC)
+        self.rm = g.rm
+        self.ra0 = g.ra0
+        self.t0 = g.t0
+        self._rotate = not np.array_equal(g.rm, np.eye(3))
+        self._rf = g.rm.T.tolist()   # forward rotation
+
+        # original and rotated-normalized (nt, ra, dec) of each observation,
+        # by key
+        self._sky = dict(enumerate(zip(
+            np.asarray(date, dtype=float).tolist(),
+            np.asarray(RA, dtype=float).tolist(),
+            np.asarray(DEC, dtype=float).tolist())))
+        self._obs = dict(enumerate(zip(
+            g.nt.tolist(), g.rs[:, 0].tolist(), g.rs[:, 1].tolist())))
+        self._next = len(self._obs)
+
+        self.n = 0
+        self.sumt = self.sumra = self.sumdec = 0.
+        self.sumt2 = self.sumtra = self.sumtdec = 0.
+        self.sumra2 = self.sumdec2 = 0.
+        for o in self._obs.values():
+            self._accumulate(o, 1.)
+        self._update()
+
+    def _project(self, t, ra, dec):
+        '''Normalized time, and rotated & normalized RA, Dec, of one
+        observation, as in GCM.'''
+        if self._rotate:
+            cosd = math.cos(dec)
+            x, y, z = cosd * math.cos(ra), cosd * math.sin(ra), math.sin(dec)
+            m = self._rf
+            rx = m[0][0] * x + m[0][1] * y + m[0][2] * z
+            ry = m[1][0] * x + m[1][1] * y + m[1][2] * z
+            rz = m[2][0] * x + m[2][1] * y + m[2][2] * z
+            ra = math.fmod(math.atan2(ry, rx) + math.tau, math.tau)
+            dec = math.asin(rz)
+        ra = math.fmod(ra + 3 * math.pi - self.ra0, 2 * math.pi) - math.pi
+        return t - self.t0, ra, dec
+
+    def _accumulate(self, o, sign):
+        '''Add (sign = 1) or subtract (sign = -1) one observation's terms.'''
+        t, ra, dec = o
+        self.n += int(sign)
+        self.sumt += sign * t
+        self.sumra += sign * ra
+        self.sumdec += sign * dec
+        self.sumt2 += sign * t * t
+        self.sumtra += sign * t * ra
+        self.sumtdec += sign * t * dec
+        self.sumra2 += sign * ra * ra
+        self.sumdec2 += sign * dec * dec
+
+    def _update(self):
+        '''Fit parameters from the sums, as in GCM.
+
+        With two points this is the line through both, which is what GCM's
+        two-point case gives for the points that defined the frame.'''
+        n = self.n
+        invd = 1 / (n * self.sumt2 - self.sumt * self.sumt)
+        self.r0 = invd * (self.sumra * self.sumt2 - self.sumtra * self.sumt)
+        self.rr = invd * (n * self.sumtra - self.sumra * self.sumt)
+        self.d0 = invd * (self.sumdec * self.sumt2 - self.sumtdec * self.sumt)
+        self.dr = invd * (n * self.sumtdec - self.sumdec * self.sumt)
+
+    def add(self, t, ra, dec):
+        '''Add an observation and update the fit. RA & Dec in radians.
+
+        Returns the observation's key, for remove().'''
+        key = self._next
+        self._next += 1
+        o = self._project(t, ra, dec)
+        self._sky[key] = (t, ra, dec)
+        self._obs[key] = o
+        self._accumulate(o, 1.)
+        self._update()
+        return key
+
+    def remove(self, key):
+        '''Remove the observation with key (its position in the initial
+        observations, or what add() returned) and update the fit.'''
+        if self.n <= 2:
+            raise ValueError('at least two positions needed')
+        del self._sky[key]
+        self._accumulate(self._obs.pop(key), -1.)
+        self._update()
+
+    def rms(self):
+        '''RMS of residuals, in arc seconds, from the sums.
+
+        Residuals are measured in the rotated frame, where the observations
+        lie close to the equator and so the RA residual needs no cos(dec)
+        factor. This agrees with GCM's rms() while the frame is valid,
+        down to a floor of ~1e-4 arc seconds set by cancellation between
+        the sums.'''
+        ssr = 0.
+        for s, s2, st, a, b in (
+                (self.sumra, self.sumra2, self.sumtra, self.r0, self.rr),
+                (self.sumdec, self.sumdec2, self.sumtdec, self.d0, self.dr)):
+            ssr += (s2 - 2 * a * s - 2 * b * st + self.n * a * a +
+                    2 * a * b * self.sumt + b * b * self.sumt2)
+        return R2D(math.sqrt(max(ssr, 0.) / self.n)) * 3600
+
+    def predict(self, t):
+        '''Fitted RA, Dec (radians) at times t, as an (N,2) array.'''
+        nt = np.asarray(t, dtype=float).reshape(-1) - self.t0
+        sc = np.empty((len(nt), 2))
+        np.multiply(self.rr, nt, out=sc[:, 0])
+        sc[:, 0] += self.r0
+        sc[:, 0] += self.ra0
+        np.multiply(self.dr, nt, out=sc[:, 1])
+        sc[:, 1] += self.d0
+        return _derotateArr(self.rm, sc)
+
+    def frameValid(self, maxDec=1e-3):
+        '''Whether all observations lie within maxDec radians of the equator
+        of the rotated frame, so the cylindrical projection is negligibly
+        distorted (relative distortion ~ maxDec**2 / 2). O(N).'''
+        return max(abs(o[2]) for o in self._obs.values()) <= maxDec
+
+    def refit(self):
+        '''Re-derive the frame and the sums from the current observations,
+        ordered by time. Their keys become their positions in that order.'''
+        date, RA, DEC = zip(*sorted(self._sky.values()))
+        self.__init__(date, RA, DEC)
@@ -0,0 +1,197 @@
+# /mpcfit/mpcfit/gcmscreen.py
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Screen tracklets for consistency with great circle motion.
+#
+# Tracklets are read lazily, fit in fixed-size chunks with
+# gcm.GCMBATCH, and results are yielded one tracklet at a time,
+# so memory use does not grow with the size of the input.
+#
+# Input is plain text, one observation per line:
+#   trkId  date  RA  Dec
+# with RA & Dec in degrees (or radians with --radians).
+# Observations of a tracklet must be on consecutive lines.
+# Blank lines and lines starting with '#' are ignored.
+#
+# Command line use:
+#   mpcfit-gcmscreen obs.txt --max-rms 0.5 > screened.txt
+#
+# --------------------------------------------------------------
+"""
+
+
+# Import third-party packages
+# --------------------------------------------------------------
+import argparse
+import collections
+import itertools
+import math
+import os
+import sys
+from concurrent import futures
+
+import numpy as np
+
+# Import neighboring packages
+# --------------------------------------------------------------
+from mpcfit import gcm
+
+
+# Screening functions
+# --------------------------------------------------------------
+
+Fit = collections.namedtuple('Fit', ['r0', 'rr', 'd0', 'dr', 'ra0', 't0'])
+'''GCM fit parameters of a single tracklet.'''
+
+Screened = collections.namedtuple(
+    'Screened', ['trkId', 'fit', 'rms', 'passed'])
+'''Result of screening one tracklet. fit is None if it could not be fit.'''
+
+
+def readTracklets(lines, degrees=True):
+    '''Group lines of observations into tracklets, lazily.
+
+    Parameters
+    ----------
+    lines : iterable of str
+        E.g. an open file. Each line holds trkId, date, RA, Dec.
+    degrees : bool
+        Whether RA & Dec are in degrees (else radians).
+
+    Returns
+    -------
+    generator of (trkId, date, RA, DEC) tuples
+        date, RA & DEC are ndarrays; RA & DEC in radians.
+    '''
+    def fields(lines):
+        for line in lines:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line.split()
+
+    scale = math.pi / 180 if degrees else 1.
+    for trkId, rows in itertools.groupby(fields(lines), lambda f: f[0]):
+        obs = np.array([r[1:4] for r in rows], dtype=float)
+        yield trkId, obs[:, 0], obs[:, 1] * scale, obs[:, 2] * scale
+
+
+def _fittable(date, RA, DEC):
+    '''Whether GCM can fit a tracklet (see the checks in gcm.GCM).'''
+    return (len(date) >= 2 and date[0] < date[-1] and
+            (RA[0] != RA[-1] or DEC[0] != DEC[-1]))
+
+
+def _screenChunk(chunk, maxRMS, nWorkers, executor=None):
+    '''Fit one chunk of tracklets together and yield their results.'''
+    ok = [_fittable(*t[1:]) for t in chunk]
+    good = [t for t, k in zip(chunk, ok) if k]
+    results = iter(())
+    if good:
+        b = gcm.GCMBATCH(
+            np.concatenate([t[1] for t in good]),
+            np.concatenate([t[2] for t in good]),
+            np.concatenate([t[3] for t in good]),
+            np.cumsum([0] + [len(t[1]) for t in good]),
+            nWorkers=nWorkers, executor=executor)
+        results = zip(
+            b.r0.tolist(), b.rr.tolist(), b.d0.tolist(), b.dr.tolist(),
+            b.ra0.tolist(), b.t0.tolist(), b.rms().tolist())
+    for t, k in zip(chunk, ok):
+        if k:
+            r = next(results)
+            yield Screened(t[0], Fit(*r[:6]), r[6], r[6] <= maxRMS)
+        else:
+            yield Screened(t[0], None, math.nan, False)
+
+
+def screen(tracklets, maxRMS=1., chunkSize=10000, nWorkers=1):
+    '''Fit tracklets to great circle motion and flag those that fit well.
+
+    Parameters
+    ----------
+    tracklets : iterable of (trkId, date, RA, DEC)
+        E.g. from readTracklets. RA & DEC in radians.
+    maxRMS : float
+        Tracklets with an RMS no larger than this (arc seconds) pass.
+    chunkSize : int
+        Number of tracklets fit together in one vectorized call.
+        Memory use is proportional to this, not to the input size.
+    nWorkers : int or None
+        Processes used to fit each chunk (see gcm.GCMBATCH). With more
+        than one, a single pool is started and used for every chunk.
+
+    Returns
+    -------
+    generator of Screened
+        One per input tracklet, in input order. Tracklets that cannot be
+        fit (fewer than two positions, no elapsed time or no motion)
+        are returned with fit None, rms nan and passed False.
+    '''
+    if nWorkers is None:
+        nWorkers = os.cpu_count() or 1
+    if nWorkers < 1:
+        raise ValueError('nWorkers must be at least one')
+    tracklets = iter(tracklets)
+    executor = None
+    try:
+        while True:
+            chunk = list(itertools.islice(tracklets, chunkSize))
+            if not chunk:
+                return
+            if executor is None and nWorkers > 1:
+                executor = futures.ProcessPoolExecutor(max_workers=nWorkers)
+            for s in _screenChunk(chunk, maxRMS, nWorkers, executor):
+                yield s
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def main(argv=None):
+    '''Command line entry point: screen tracklets from a file.
+
+    Writes one line per tracklet: trkId, RMS (arc seconds) and PASS/FAIL.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Screen tracklets for great circle motion.')
+    parser.add_argument(
+        'input', nargs='?', default='-',
+        help='observation file (default: stdin)')
+    parser.add_argument(
+        '--max-rms', type=float, default=1.,
+        help='RMS threshold in arc seconds (default: 1.0)')
+    parser.add_argument(
+        '--chunk-size', type=int, default=10000,
+        help='tracklets fit together per vectorized call')
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='processes used to fit each chunk (default: 1)')
+    parser.add_argument(
+        '--radians', action='store_true',
+        help='RA and Dec are in radians (default: degrees)')
+    parser.add_argument(
+        '--failed-only', action='store_true',
+        help='only write tracklets that fail')
+    args = parser.parse_args(argv)
+
+    f = sys.stdin if args.input == '-' else open(args.input)
+    try:
+        screened = screen(readTracklets(f, degrees=not args.radians),
+                          maxRMS=args.max_rms, chunkSize=args.chunk_size,
+                          nWorkers=args.workers)
+        for s in screened:
+            if args.failed_only and s.passed:
+                continue
+            sys.stdout.write('{} {:.4f} {}\n'.format(
+                s.trkId, s.rms, 'PASS' if s.passed else 'FAIL'))
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
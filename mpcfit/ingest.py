@@ -0,0 +1,715 @@
+# /mpcfit/mpcfit/ingest.py
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Read observations into OBSERVATIONS (& so into FIT & gcm).
+#
+# Formats:
+# - mpc80 : MPC 80-column optical records
+# - psv   : ADES pipe-separated values
+# - xml   : ADES XML
+#
+# The text formats are decoded column-wise: all the lines of a
+# chunk are packed into one (width, nLines) array of characters,
+# & each field is converted for every line at once with numpy,
+# rather than by slicing & converting each line in python.
+# Files are read in chunks (iterChunks), so that files larger
+# than memory can be streamed.
+#
+# The formats give times in UTC; they are converted to TT (the
+# time of the ephemerides & the fits) with the table of leap
+# seconds, LEAP_SECONDS.
+#
+# --------------------------------------------------------------
+"""
+
+
+# Import third-party packages
+# --------------------------------------------------------------
+import io
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+# Import neighboring packages
+# --------------------------------------------------------------
+from mpcfit import observatories
+from mpcfit.observations import OBSERVATIONS
+
+
+# Constants
+# --------------------------------------------------------------
+
+FORMATS = ('mpc80', 'psv', 'xml')
+
+CHUNK_SIZE = 1 << 24
+'''Bytes read at a time by iterChunks.'''
+
+TRACKLET_GAP = 0.5
+'''Days between consecutive observations of an object, from one
+site, that start a new tracklet, where the file gives no tracklet
+ids.'''
+
+ADES_FIELDS = ('permID', 'provID', 'trkSub', 'trkID', 'stn', 'obsTime',
+               'ra', 'dec', 'rmsRA', 'rmsDec')
+'''The ADES fields that are read; others are ignored.'''
+
+LEAP_SECONDS = np.array([
+    (41317, 10), (41499, 11), (41683, 12), (42048, 13), (42413, 14),
+    (42778, 15), (43144, 16), (43509, 17), (43874, 18), (44239, 19),
+    (44786, 20), (45151, 21), (45516, 22), (46247, 23), (47161, 24),
+    (47892, 25), (48257, 26), (48804, 27), (49169, 28), (49534, 29),
+    (50083, 30), (50630, 31), (51179, 32), (53736, 33), (54832, 34),
+    (56109, 35), (57204, 36), (57754, 37)], dtype=float)
+'''MJD (UTC) from which TAI - UTC is each number of seconds, from
+1972 (when UTC took whole leap seconds) to the last leap second,
+at the start of 2017. Earlier times are taken as 10 s: UTC's
+offsets before 1972 were a few seconds less.'''
+
+TT_TAI = 32.184
+'''TT - TAI, seconds.'''
+
+_SECOND_LINES = np.frombuffer(b'svrR', dtype=np.uint8)
+'''MPC80 note 2 of lines without an optical position: the second
+lines of satellite, roving & radar observations, & radar.'''
+
+_PAIRS = {ord('S'): ord('s'), ord('V'): ord('v')}
+'''MPC80 note 2 of the first lines of satellite & roving observations,
+& of the second lines that give the observer's position.'''
+
+_POWERS = 10. ** np.arange(23)
+
+_XML_RECORD_BYTES = 400
+'''Rough size of an ADES XML <optical> record, for chunking.'''
+
+
+# Column-wise decoding of text
+# --------------------------------------------------------------
+#
+# Text is held as uint8 arrays of shape (width, n): row j holds
+# the j-th character of each of n strings, so that each character
+# position is contiguous. Short strings are padded with spaces.
+
+def _transpose(a, block=4096):
+    '''Contiguous transpose of a 2-d array, a block of rows at a time
+    (several times faster than numpy's for uint8).'''
+    out = np.empty(a.shape[::-1], dtype=a.dtype)
+    for i in range(0, len(a), block):
+        out[:, i:i + block] = a[i:i + block].T
+    return out
+
+
+def _chars(strings, width=None):
+    '''(width, n) characters of a sequence of byte strings.'''
+    arr = np.asarray(strings, dtype='S{}'.format(width) if width else 'S')
+    chars = _transpose(arr.view(np.uint8).reshape(len(arr), arr.itemsize))
+    chars[chars == 0] = 32
+    return chars
+
+
+def _lines(data, width):
+    '''
+    (width, n) characters of the lines of a buffer. Lines that are
+    all the same length (e.g. 80-column records) are used in place,
+    without splitting the buffer.
+    '''
+    stride = data.find(b'\n') + 1
+    if stride > width and len(data) % stride == 0:
+        rows = np.frombuffer(data, dtype=np.uint8).reshape(-1, stride)
+        if np.all(rows[:, -1] == 10):
+            return _transpose(rows[:, :width])
+    return _chars(data.splitlines(), width)
+
+
+def _number(field, blank=np.nan):
+    '''
+    Decimal numbers (e.g. '-12.345', ' 7', '+0.5Z'), one per column
+    of a (width, n) text field. Characters other than digits, '.'
+    and '-' are ignored. Fields without digits give blank.
+    '''
+    n = field.shape[1]
+    value = np.zeros(n)
+    decimals = np.zeros(n, dtype=np.int64)
+    seenPoint = np.zeros(n, dtype=bool)
+    negative = np.zeros(n, dtype=bool)
+    anyDigit = np.zeros(n, dtype=bool)
+    for c in field:
+        d = c - np.uint8(48)
+        digit = d <= 9
+        # fixed-format fields have character positions that are
+        # digits in every line, which need no masking
+        if digit.all():
+            value *= 10
+            value += d
+            decimals += seenPoint
+            anyDigit[:] = True
+            continue
+        if digit.any():
+            value = np.where(digit, value * 10 + d, value)
+            decimals += digit & seenPoint
+            anyDigit |= digit
+        seenPoint |= c == 46
+        negative |= c == 45
+    value /= _POWERS[np.minimum(decimals, len(_POWERS) - 1)]
+    value[negative] *= -1
+    value[~anyDigit] = blank
+    return value
+
+
+def _strip(field):
+    '''Left-justify each string of a (width, n) text field.'''
+    w = field.shape[0]
+    if w == 0:
+        return field
+    lead = np.argmax(field != 32, axis=0)
+    if not lead.any():
+        return field
+    idx = lead + np.arange(w)[:, None]
+    out = np.take_along_axis(field, np.minimum(idx, w - 1), axis=0)
+    out[idx >= w] = 32
+    return out
+
+
+def _text(field):
+    '''Byte strings, without trailing spaces, of a (width, n) field.'''
+    w, n = field.shape
+    if w == 0:
+        return np.zeros(n, dtype='S1')
+    out = np.empty((n, w), dtype=np.uint8)
+    keep = np.zeros(n, dtype=bool)
+    for j in range(w - 1, -1, -1):
+        keep |= field[j] != 32
+        out[:, j] = np.where(keep, field[j], 0)
+    return out.view('S{}'.format(w)).ravel()
+
+
+def _gather(buf, start, end):
+    '''
+    (n, width) characters buf[start:end] of n fields of a buffer,
+    which must extend at least width past the last start.
+    '''
+    w = int((end - start).max()) if len(start) else 0
+    if not w:
+        return np.empty((len(start), 0), dtype=np.uint8)
+    rows = np.lib.stride_tricks.sliding_window_view(buf, w)[start]
+    rows[np.arange(w) >= (end - start)[:, None]] = 32
+    return rows
+
+
+def _field(buf, start, end, strip=False):
+    '''(width, n) characters buf[start:end], optionally left-justified,
+    of n fields of a buffer.'''
+    rows = _gather(buf, start, end)
+    if strip and rows.size:
+        lead = np.argmax(rows != 32, axis=1)
+        if lead.any():
+            rows = _gather(buf, start + lead, end)
+    return _transpose(rows)
+
+
+def _mjd(year, month, day):
+    '''MJD of (Gregorian) calendar dates; day may have a fraction.'''
+    valid = np.isfinite(year) & np.isfinite(month) & np.isfinite(day)
+    y = np.where(valid, year, 2000).astype(np.int64)
+    m = np.where(valid, month, 1).astype(np.int64)
+    a = (14 - m) // 12
+    y = y + 4800 - a
+    m = m + 12 * a - 3
+    jdn = ((153 * m + 2) // 5 + 365 * y + y // 4 - y // 100 + y // 400 -
+           32045)
+    mjd = jdn - 2400001 + day
+    mjd[~valid] = np.nan
+    return mjd
+
+
+def _isoTime(field):
+    '''MJD of left-justified ISO 8601 times, YYYY-MM-DDThh:mm:ss.sssZ'''
+    hours = (_number(field[11:13], 0.) + _number(field[14:16], 0.) / 60 +
+             _number(field[17:], 0.) / 3600)
+    return _mjd(_number(field[0:4]), _number(field[5:7]),
+                _number(field[8:10]) + hours / 24)
+
+
+def _utcToTT(mjd):
+    '''MJD (TT) of MJDs (UTC), with LEAP_SECONDS.'''
+    k = np.searchsorted(LEAP_SECONDS[:, 0], mjd, side='right')
+    taiUtc = LEAP_SECONDS[np.maximum(k - 1, 0), 1]
+    return mjd + (taiUtc + TT_TAI) / 86400
+
+
+def _digits(values, k):
+    '''(k, n) characters of non-negative integers, zero padded.'''
+    powers = 10 ** np.arange(k - 1, -1, -1, dtype=np.int64)
+    return (values // powers[:, None] % 10 + 48).astype(np.uint8)
+
+
+def _trackletIds(objId, obsCode, time, gap):
+    '''
+    Ids for tracklets, where the file has none: each run of
+    observations of one object from one site, without gaps of more
+    than gap days, is named by the site & the time (to 1e-5 day) of
+    its first observation.
+    '''
+    n = len(time)
+    new = np.ones(n, dtype=bool)
+    if n > 1:
+        dt = np.diff(time)
+        new[1:] = ((objId[1:] != objId[:-1]) |
+                   (obsCode[1:] != obsCode[:-1]) | (dt > gap) | (dt < 0))
+    starts = np.flatnonzero(new)
+    stamp = np.round(np.maximum(time[starts], 0.) * 1e5).astype(np.int64)
+    chars = np.empty((14, len(starts)), dtype=np.uint8)
+    chars[:3] = _chars(obsCode[starts], 3)
+    chars[3] = ord('-')
+    chars[4:] = _digits(stamp, 10)
+    return _text(chars)[np.cumsum(new) - 1]
+
+
+# MPC 80-column format
+# --------------------------------------------------------------
+
+def _mpc80Ids(chars):
+    '''Packed number, else provisional designation, of each record.'''
+    numbered = (chars[0:5] != 32).any(axis=0)
+    ident = np.where(numbered, np.concatenate(
+        (chars[0:5], np.full((2, chars.shape[1]), 32, np.uint8))),
+        chars[5:12])
+    return _text(_strip(ident))
+
+
+def splitMPC80(data):
+    '''
+    The objects of MPC 80-column records, without decoding them
+
+    Only the designations are read, so that e.g. a cache can tell
+    which objects' records have changed, & parse only those.
+
+    Parameters
+    ----------
+    data : bytes
+        Whole lines of the file.
+
+    Returns
+    -------
+    objId : ndarray, shape (M,)
+        Object of each run of consecutive records of one object.
+    offsets : ndarray, shape (M + 1,)
+        The records of the i-th are lines[offsets[i]:offsets[i+1]].
+    lines : list of bytes
+        The non-blank lines, without line ends.
+    '''
+    lines = data.splitlines()
+    chars = _chars(lines, 80)
+    blank = (chars == 32).all(axis=0)
+    if blank.any():
+        lines = [line for line, b in zip(lines, blank) if not b]
+        chars = chars[:, ~blank]
+    ids = _mpc80Ids(chars)
+    new = np.ones(len(ids), dtype=bool)
+    new[1:] = ids[1:] != ids[:-1]
+    starts = np.flatnonzero(new)
+    return ids[starts], np.append(starts, len(ids)), lines
+
+
+def _observerPositions(chars, time):
+    '''
+    Geocentric positions (n, 3) of the observer, from the second lines
+    (80, n) of satellite ('s': x, y, z in km or au) & roving ('v': east
+    longitude, latitude, altitude) observations at times time (n,).
+    TT - UT1 is neglected for roving observers (~ 30 m).
+    '''
+    position = np.column_stack([_number(chars[lo:lo + 11])
+                                for lo in (34, 46, 58)])
+    position[chars[32] == ord('1')] /= observatories.AU_KM
+    roving = chars[14] == ord('v')
+    if roving.any():
+        c = chars[:, roving]
+        rhoCos, rhoSin = observatories.parallaxConstants(
+            _number(c[45:55]), _number(c[56:61], 0.))
+        position[roving] = observatories.sitePositions(
+            np.radians(_number(c[34:44])), rhoCos, rhoSin, time[roving])
+    return position
+
+
+def parseMPC80(data, gap=TRACKLET_GAP):
+    '''
+    Observations from MPC 80-column optical records
+
+    Objects are identified by their packed number if they have one,
+    else by their packed provisional designation. The second lines
+    of satellite & roving observations give the observer's position
+    (obsPosition) of the line before; observations without one, and
+    lines that are not optical positions (radar), are skipped. The
+    format has no uncertainties, so sigmaRA & sigmaDec are 1". Nor
+    has it tracklet ids: each run of observations of one object from
+    one site, without gaps of more than gap days, is a tracklet,
+    named by the site & the MJD (UTC) of its first observation.
+    The times of the records, UTC, are converted to TT.
+
+    Parameters
+    ----------
+    data : bytes
+        Whole lines of the file.
+    gap : float
+        Days between observations that start a new tracklet.
+
+    Returns
+    -------
+    OBSERVATIONS
+        In the order of the file; time is MJD (TT).
+    '''
+    chars = _lines(data, 80)
+    time = _mjd(_number(chars[15:19]), _number(chars[20:22]),
+                _number(chars[23:32]))
+
+    # the observer's position, from the line after
+    note2 = chars[14]
+    optical = ~np.isin(note2, _SECOND_LINES)
+    position = np.full((len(time), 3), np.nan)
+    paired = np.isin(note2, list(_PAIRS))
+    if paired.any():
+        first = np.flatnonzero(paired[:-1])
+        second = first + 1
+        match = np.zeros(len(first), dtype=bool)
+        for a, b in _PAIRS.items():
+            match |= (note2[first] == a) & (note2[second] == b)
+        first, second = first[match], second[match]
+        position[first] = _observerPositions(chars[:, second],
+                                             _utcToTT(time[first]))
+        optical &= ~paired | np.isfinite(position).all(axis=1)
+    if not optical.all():
+        chars, time = chars[:, optical], time[optical]
+        position = position[optical]
+
+    ra = (_number(chars[32:34]) + _number(chars[35:37], 0.) / 60 +
+          _number(chars[38:44], 0.) / 3600) * (np.pi / 12)
+    dec = (_number(chars[45:47]) + _number(chars[48:50], 0.) / 60 +
+           _number(chars[51:56], 0.) / 3600) * (np.pi / 180)
+    dec[chars[44] == 45] *= -1
+
+    good = np.isfinite(time) & np.isfinite(ra) & np.isfinite(dec)
+    if not good.all():
+        chars = chars[:, good]
+        time, ra, dec, position = time[good], ra[good], dec[good], \
+            position[good]
+
+    objId = _mpc80Ids(chars)
+    obsCode = _text(chars[77:80])
+    return OBSERVATIONS(_utcToTT(time), ra, dec, obsCode=obsCode,
+                        objId=objId,
+                        trkId=_trackletIds(objId, obsCode, time, gap),
+                        obsPosition=position)
+
+
+# ADES formats
+# --------------------------------------------------------------
+
+def _first(field, names, n):
+    '''Per observation, the first non-blank of the named fields.'''
+    out = np.zeros(n, dtype='S1')
+    for name in reversed(names):
+        if name in field:
+            text = _text(field[name])
+            out = np.where(text != b'', text, out)
+    return out
+
+
+def _adesObservations(field, n, gap):
+    '''
+    OBSERVATIONS from (width, n) text fields, keyed by ADES name.
+    The text fields (not ra, dec, rmsRA, rmsDec) are left-justified.
+    obsTime (UTC) is converted to TT.
+    '''
+    missing = [name for name in ('obsTime', 'ra', 'dec', 'stn')
+               if name not in field]
+    if missing:
+        raise ValueError('ades observations lack ' + ', '.join(missing))
+    time = _isoTime(field['obsTime'])
+    ra = np.radians(_number(field['ra']))
+    dec = np.radians(_number(field['dec']))
+    sigma = [_number(field[name]) if name in field else np.full(n, np.nan)
+             for name in ('rmsRA', 'rmsDec')]
+    obsCode = _text(field['stn'])
+    objId = _first(field, ('permID', 'provID', 'trkSub'), n)
+    trkId = _first(field, ('trkID', 'trkSub'), n)
+
+    good = np.isfinite(time) & np.isfinite(ra) & np.isfinite(dec)
+    time, ra, dec = time[good], ra[good], dec[good]
+    obsCode, objId, trkId = obsCode[good], objId[good], trkId[good]
+    sigmaRA, sigmaDec = [np.where(np.isfinite(s), s, 1.)[good]
+                         for s in sigma]
+    trkId = np.where(trkId != b'', trkId,
+                     _trackletIds(objId, obsCode, time, gap))
+    return OBSERVATIONS(_utcToTT(time), ra, dec, sigmaRA, sigmaDec,
+                        obsCode, objId, trkId)
+
+
+def _psvBlock(buf, start, end, pipes, names, gap):
+    '''
+    OBSERVATIONS from the data lines [start:end] of a buffer under
+    one PSV header, given the (n, nFields - 1) positions of the pipes
+    in the lines.
+    '''
+    n, k = len(start), len(names)
+    field = {}
+    for j, name in enumerate(names):
+        if name in ADES_FIELDS:
+            field[name] = _field(
+                buf, start if j == 0 else pipes[:, j - 1] + 1,
+                end if j == k - 1 else pipes[:, j],
+                strip=name not in ('ra', 'dec', 'rmsRA', 'rmsDec'))
+    return _adesObservations(field, n, gap)
+
+
+def _parsePSV(data, state, gap):
+    '''
+    parsePSV, carrying (header names, previous line was a comment)
+    from one chunk of a file to the next.
+    '''
+    names, afterComment = state
+    buf = np.frombuffer(data, dtype=np.uint8)
+    end = np.flatnonzero(buf == 10)
+    if len(buf) and buf[-1] != 10:
+        end = np.append(end, len(buf))
+    start = np.concatenate(([0], end[:-1] + 1))
+    end = end - (buf[np.maximum(end - 1, 0)] == 13) * (end > start)
+    nonblank = end > start
+    start, end = start[nonblank], end[nonblank]
+    if not len(start):
+        return OBSERVATIONS([], [], []), state
+
+    # pad, so that fields can be gathered without bounds checks
+    buf = np.concatenate((buf, np.full(int((end - start).max()), 32,
+                                       dtype=np.uint8)))
+    comment = (buf[start] == ord('#')) | (buf[start] == ord('!'))
+    header = ~comment
+    header[1:] &= comment[:-1]
+    header[0] &= afterComment or names is None
+
+    # the pipes, & the first & number of them in each line
+    pipes = np.flatnonzero(buf == 124)
+    firstPipe = np.searchsorted(pipes, start)
+    nPipes = np.diff(np.append(firstPipe, len(pipes)))
+
+    blocks, pos = [], 0
+    for h in np.flatnonzero(header):
+        blocks.append((names, pos, h))
+        names = [f.strip() for f in
+                 data[start[h]:end[h]].decode().split('|')]
+        pos = h + 1
+    blocks.append((names, pos, len(start)))
+
+    obs = []
+    for blockNames, lo, hi in blocks:
+        rows = lo + np.flatnonzero(~comment[lo:hi])
+        if not len(rows):
+            continue
+        if blockNames is None:
+            raise ValueError('psv data before a header line')
+        k = len(blockNames)
+        if np.any(nPipes[rows] != k - 1):
+            raise ValueError('psv line without the {} fields of its '
+                             'header'.format(k))
+        cols = pipes[firstPipe[rows][:, None] + np.arange(k - 1)]
+        obs.append(_psvBlock(buf, start[rows], end[rows], cols, blockNames,
+                             gap))
+    state = (names, bool(comment[-1]))
+    if not obs:
+        return OBSERVATIONS([], [], []), state
+    return OBSERVATIONS.concatenate(obs), state
+
+
+def parsePSV(data, gap=TRACKLET_GAP):
+    '''
+    Observations from ADES PSV
+
+    Objects are identified by permID, else provID, else trkSub;
+    tracklets by trkID, else trkSub, else as for parseMPC80.
+    Missing rmsRA / rmsDec are taken as 1". obsTime, UTC, is
+    converted to TT.
+
+    Parameters
+    ----------
+    data : bytes
+        Whole lines of the file.
+    gap : float
+        Days between observations that start a new tracklet.
+
+    Returns
+    -------
+    OBSERVATIONS
+        In the order of the file; time is MJD (TT).
+    '''
+    return _parsePSV(data, (None, False), gap)[0]
+
+
+def _iterXML(source, nRecords, gap):
+    '''OBSERVATIONS of each nRecords <optical> records of ADES XML.'''
+    values = {name: [] for name in ADES_FIELDS}
+
+    def flush():
+        n = len(values['obsTime'])
+        field = {name: _chars(v) for name, v in values.items()}
+        for v in values.values():
+            v.clear()
+        return _adesObservations(field, n, gap)
+
+    for event, elem in ET.iterparse(source):
+        tag = elem.tag.rpartition('}')[2]
+        if tag == 'optical':
+            record = {child.tag.rpartition('}')[2]: child.text
+                      for child in elem}
+            for name, v in values.items():
+                v.append((record.get(name) or '').strip())
+            elem.clear()
+            if len(values['obsTime']) >= nRecords:
+                yield flush()
+        elif tag == 'obsData':
+            elem.clear()
+    if values['obsTime']:
+        yield flush()
+
+
+def parseXML(data, gap=TRACKLET_GAP):
+    '''
+    Observations from ADES XML, as for parsePSV
+
+    The XML is parsed by a streaming (C) parser, collecting the
+    fields of all <optical> records, which are then decoded
+    column-wise as for the text formats.
+
+    Parameters
+    ----------
+    data : bytes
+    gap : float
+        Days between observations that start a new tracklet.
+
+    Returns
+    -------
+    OBSERVATIONS
+    '''
+    obs = list(_iterXML(io.BytesIO(data), np.inf, gap))
+    return OBSERVATIONS.concatenate(obs) if obs else \
+        OBSERVATIONS([], [], [])
+
+
+# Files
+# --------------------------------------------------------------
+
+def _blocks(f, size):
+    '''Generator of about size bytes of whole lines of a file.'''
+    rest = b''
+    while True:
+        data = f.read(size)
+        if not data:
+            if rest:
+                yield rest
+            return
+        data = rest + data
+        cut = data.rfind(b'\n') + 1
+        rest = data[cut:]
+        if cut:
+            yield data[:cut]
+
+
+def guessFormat(path):
+    '''One of FORMATS, from the file extension or else its start.'''
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.xml', '.psv'):
+        return ext[1:]
+    with open(path, 'rb') as f:
+        head = f.read(4096).lstrip()
+    if head.startswith(b'<'):
+        return 'xml'
+    first = head.split(b'\n', 1)[0]
+    if first.startswith((b'#', b'!')) or b'|' in first:
+        return 'psv'
+    return 'mpc80'
+
+
+def iterChunks(path, format=None, chunkSize=CHUNK_SIZE, gap=TRACKLET_GAP):
+    '''
+    Stream a file of observations, a chunk at a time
+
+    Only one chunk is in memory at a time. Each chunk's
+    OBSERVATIONS can be fitted (FIT), passed to gcm (gcmInputs) or
+    written to an archive. A tracklet without ids in the file that
+    straddles two chunks is split in two.
+
+    Parameters
+    ----------
+    path : str
+    format : str or None
+        One of FORMATS; None to guess it (guessFormat).
+    chunkSize : int
+        Bytes of the file per chunk (approximately, for xml).
+    gap : float
+        Days between observations that start a new tracklet.
+
+    Returns
+    -------
+    generator of OBSERVATIONS
+    '''
+    format = guessFormat(path) if format is None else format
+    if format not in FORMATS:
+        raise ValueError('format must be one of ' + ', '.join(FORMATS))
+    if format == 'xml':
+        yield from _iterXML(path, max(1, chunkSize // _XML_RECORD_BYTES),
+                            gap)
+        return
+    state, rest = (None, False), b''
+    with open(path, 'rb') as f:
+        for data in _blocks(f, chunkSize):
+            if format == 'mpc80':
+                # keep a first line with its second, in the next chunk
+                data = rest + data
+                cut = data.rfind(b'\n', 0, len(data) - 1) + 1
+                paired = len(data) - cut > 14 and data[cut + 14] in _PAIRS
+                data, rest = (data[:cut], data[cut:]) if paired else \
+                    (data, b'')
+                yield parseMPC80(data, gap)
+            else:
+                obs, state = _parsePSV(data, state, gap)
+                yield obs
+    if rest:
+        yield parseMPC80(rest, gap)
+
+
+def iterRecords(path, chunkSize=CHUNK_SIZE):
+    '''
+    The records of each object of an MPC 80-column file, read a chunk
+    at a time but without decoding them (see splitMPC80)
+
+    Returns
+    -------
+    generator of (objId, records)
+        objId is a str; records the bytes of the object's consecutive
+        lines, each ending in a newline, as parseMPC80 takes.
+    '''
+    pending = None
+    with open(path, 'rb') as f:
+        for data in _blocks(f, chunkSize):
+            ids, offsets, lines = splitMPC80(data)
+            for i, objId in enumerate(ids.tolist()):
+                lo, hi = offsets[i], offsets[i + 1]
+                records = b'\n'.join(lines[lo:hi]) + b'\n'
+                if pending is not None and pending[0] == objId:
+                    # an object straddling two chunks
+                    pending = (objId, pending[1] + records)
+                    continue
+                if pending is not None:
+                    yield pending[0].decode(), pending[1]
+                pending = (objId, records)
+    if pending is not None:
+        yield pending[0].decode(), pending[1]
+
+
+def read(path, format=None, gap=TRACKLET_GAP):
+    '''All the observations of a file, as for iterChunks; the
+    times, UTC in all the formats, are converted to MJD (TT).'''
+    obs = [o for o in iterChunks(path, format, gap=gap) if len(o)]
+    return OBSERVATIONS.concatenate(obs) if obs else \
+        OBSERVATIONS([], [], [])
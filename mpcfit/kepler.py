@@ -0,0 +1,296 @@
+# /mpcfit/mpcfit/kepler.py
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Two-body (Keplerian) propagation in universal variables.
+#
+# Following Danby (Fundamentals of Celestial Mechanics, ch. 6.9):
+# the state at t is f & g (Lagrange) times the state at epoch,
+# where f, g depend on the universal anomaly s, the root of
+#   r0 s + eta G2(s) + zeta G3(s) = t - epoch,
+# with G_k the Stumpff-series functions. The same equations hold
+# for elliptic, parabolic & hyperbolic orbits.
+#
+# Kepler's equation is solved for all (object, time) pairs at
+# once, by Laguerre-Conway iteration; each iteration updates only
+# the pairs that haven't converged yet. The state transition
+# matrix follows analytically from the same quantities.
+#
+# --------------------------------------------------------------
+"""
+
+
+# Import third-party packages
+# --------------------------------------------------------------
+import numpy as np
+
+# Import neighboring packages
+# --------------------------------------------------------------
+from mpcfit import transformations
+
+
+# Constants
+# --------------------------------------------------------------
+
+MAX_ITER = 30
+'''Most Laguerre-Conway iterations before giving up.'''
+
+TOL = 1e-14
+'''Relative change in s at which an iteration has converged.'''
+
+_SERIES = 1.
+'''|beta s^2| below which the Stumpff functions are summed as series.'''
+
+
+# Universal-variable functions
+# --------------------------------------------------------------
+
+def _stumpff(x, n=6):
+    '''
+    Stumpff functions c0 ... c(n-1) (n = 4 or 6) of x = beta s^2,
+    each an ndarray shaped as x. Summed as series for small |x|,
+    where the closed forms lose precision.
+    '''
+    x = np.asarray(x, dtype=float)
+    regimes = ((np.abs(x) < _SERIES, _stumpffSeries),
+               (x >= _SERIES, _stumpffCircular),
+               (x <= -_SERIES, _stumpffHyperbolic))
+    c = None
+    for mask, func in regimes:
+        # usually all of x is in one regime: no need to scatter
+        if mask.all():
+            return func(x, n)
+        if mask.any():
+            if c is None:
+                c = [np.empty_like(x) for k in range(n)]
+            for ck, value in zip(c, func(x[mask], n)):
+                ck[mask] = value
+    return c
+
+
+def _stumpffSeries(x, n):
+    '''c_k(x) = sum_j (-x)^j / (k + 2j)!, to j = 8, for |x| < 1.'''
+    c = [None, None]
+    for k in range(2, n):
+        term = np.full_like(x, 1 / _factorial(k))
+        total = term.copy()
+        for j in range(1, 9):
+            term *= -x / ((k + 2 * j - 1) * (k + 2 * j))
+            total += term
+        c.append(total)
+    c[0], c[1] = 1 - x * c[2], 1 - x * c[3]
+    return c
+
+
+def _stumpffClosed(x, n, c0, c1):
+    '''c0 ... c(n-1) from c0 & c1, by c_k = (1 / k! - c_(k+2)) / x.'''
+    c = [c0, c1, (1 - c0) / x, (1 - c1) / x]
+    if n > 4:
+        c += [(0.5 - c[2]) / x, (1 / 6 - c[3]) / x]
+    return c
+
+
+def _stumpffCircular(x, n):
+    z = np.sqrt(x)
+    return _stumpffClosed(x, n, np.cos(z), np.sin(z) / z)
+
+
+def _stumpffHyperbolic(x, n):
+    z = np.sqrt(-x)
+    return _stumpffClosed(x, n, np.cosh(z), np.sinh(z) / z)
+
+
+def _factorial(k):
+    return float(np.prod(np.arange(1, k + 1)))
+
+
+def gFunctions(s, beta, n=6):
+    '''
+    G_k(s, beta) = s^k c_k(beta s^2), k = 0 ... n - 1 (n = 4 or 6)
+
+    Parameters
+    ----------
+    s, beta : ndarray, shape (N,)
+
+    Returns
+    -------
+    list of n ndarrays, shape (N,)
+    '''
+    c = _stumpff(beta * s * s, n)
+    G, sk = [c[0]], s
+    for k in range(1, n):
+        G.append(sk * c[k])
+        sk = sk * s
+    return G
+
+
+def _solve(r0, eta, zeta, beta, dt, mu):
+    '''
+    The universal anomaly s of each pair: the root of
+        r0 s + eta G2 + zeta G3 - dt = 0,
+    by Laguerre-Conway iteration, from Danby's starting values.
+
+    Returns
+    -------
+    s : ndarray, shape (N,)
+    nIter : int
+        Iterations taken by the slowest pair.
+    '''
+    # bound orbits: solve for dt less whole periods, which give s
+    # exactly 2 pi / sqrt(beta) each
+    bound = beta > 0
+    sqb = np.sqrt(np.where(bound, beta, 1.))
+    period = 2 * np.pi * mu / sqb**3
+    turns = np.where(bound, np.round(dt / period), 0.)
+    dtr = dt - turns * period
+
+    # start bound orbits from Danby's eccentric anomaly, E = M +
+    # 0.85 e sign(sin M), as sqrt(beta) s = E - E0; others from the
+    # mean rate, bounded to where cosh stays moderate
+    ecosE0, esinE0 = 1 - r0 * beta / mu, eta * sqb / mu
+    E0 = np.arctan2(esinE0, ecosE0)
+    M = E0 - esinE0 + sqb**3 / mu * dtr
+    E = M + 0.85 * np.hypot(ecosE0, esinE0) * np.sign(np.sin(M))
+    limit = 20. / np.sqrt(np.maximum(-beta, 1e-300))
+    s = np.where(bound, (E - E0) / sqb, np.clip(dtr / r0, -limit, limit))
+
+    active = np.flatnonzero(dtr != 0)
+    s[dtr == 0] = 0.
+    nIter = 0
+    while len(active):
+        if nIter == MAX_ITER:
+            raise ValueError('kepler: universal anomaly did not converge')
+        nIter += 1
+        sa, ba = s[active], beta[active]
+        G = gFunctions(sa, ba, 4)
+        ea, za = eta[active], zeta[active]
+        F = r0[active] * sa + ea * G[2] + za * G[3] - dtr[active]
+        dF = r0[active] + ea * G[1] + za * G[2]
+        ddF = ea * G[0] + za * G[1]
+        root = np.sqrt(np.abs(16 * dF * dF - 20 * F * ddF))
+        ds = -5 * F / (dF + np.copysign(root, dF))
+        s[active] = sa + ds
+        done = (np.abs(ds) <= TOL * np.abs(sa)) | (F == 0)
+        active = active[~done]
+    return s + turns * 2 * np.pi / sqb, nIter
+
+
+# Propagation
+# --------------------------------------------------------------
+
+def propagate(x_Vec, dt, stm=False, mu=transformations.GM_SUN):
+    '''
+    Advance states on two-body orbits, each by its own time
+
+    Parameters
+    ----------
+    x_Vec       :   ndarray, shape (N, 6)
+        Cartesian states
+    dt          :   ndarray, shape (N,)
+        Time to advance each by (may be negative)
+    stm         :   bool
+        Whether to return the state transition matrices too
+    mu          :   float
+
+    Returns
+    -------
+    states      :   ndarray, shape (N, 6)
+    stms        :   ndarray, shape (N, 6, 6)
+        d(states) / d(x_Vec); only if stm is True
+    '''
+    x_Vec = np.asarray(x_Vec, dtype=float)
+    dt = np.asarray(dt, dtype=float)
+    rv0, vv0 = x_Vec[:, :3], x_Vec[:, 3:]
+    r0 = np.sqrt(np.einsum('ij,ij->i', rv0, rv0))
+    eta = np.einsum('ij,ij->i', rv0, vv0)
+    beta = 2 * mu / r0 - np.einsum('ij,ij->i', vv0, vv0)
+    zeta = mu - beta * r0
+
+    s = _solve(r0, eta, zeta, beta, dt, mu)[0]
+    G = gFunctions(s, beta)
+    r = r0 + eta * G[1] + zeta * G[2]
+    f = 1 - mu * G[2] / r0
+    g = dt - mu * G[3]
+    fd = -mu * G[1] / (r0 * r)
+    gd = 1 - mu * G[2] / r
+
+    states = np.empty_like(x_Vec)
+    states[:, :3] = f[:, None] * rv0 + g[:, None] * vv0
+    states[:, 3:] = fd[:, None] * rv0 + gd[:, None] * vv0
+    if not stm:
+        return states
+
+    # f, g, fd & gd depend on x_Vec through q = (r0, eta, beta), both
+    # directly & through s(q), from Kepler's equation F(s; q) = 0
+    dG = np.array([(k * G[k + 2] - s * G[k + 1]) / 2 for k in (1, 2, 3)])
+    dFdq = np.stack((s - beta * G[3], G[2],
+                     eta * dG[1] + zeta * dG[2] - r0 * G[3]), axis=1)
+    dsdq = -dFdq / r[:, None]
+    # total derivatives of G1, G2 & G3, shape (N, 3)
+    dG1, dG2, dG3 = (G[k - 1][:, None] * dsdq for k in (1, 2, 3))
+    for k, d in ((1, dG1), (2, dG2), (3, dG3)):
+        d[:, 2] += dG[k - 1]
+
+    one = np.zeros((len(s), 3))
+    one[:, 0] = 1.
+    dr = (one + eta[:, None] * dG1 + zeta[:, None] * dG2 +
+          np.stack((-beta * G[2], G[1], -r0 * G[2]), axis=1))
+    df = -mu * (dG2 / r0[:, None] - one * (G[2] / r0**2)[:, None])
+    dg = -mu * dG3
+    dfd = -mu * (dG1 / (r0 * r)[:, None] - (G[1] / (r0 * r)**2)[:, None] *
+                 (one * r[:, None] + r0[:, None] * dr))
+    dgd = -mu * (dG2 / r[:, None] - (G[2] / r**2)[:, None] * dr)
+
+    # dq / d(x_Vec), shape (N, 3, 6)
+    dq = np.zeros((len(s), 3, 6))
+    dq[:, 0, :3] = rv0 / r0[:, None]
+    dq[:, 1, :3], dq[:, 1, 3:] = vv0, rv0
+    dq[:, 2, :3] = -2 * mu * rv0 / r0[:, None]**3
+    dq[:, 2, 3:] = -2 * vv0
+
+    coef = np.einsum('nmk,nkj->nmj', np.stack((df, dg, dfd, dgd), axis=1),
+                     dq)
+    stms = np.zeros((len(s), 6, 6))
+    eye = np.eye(3)
+    stms[:, :3, :3] = f[:, None, None] * eye
+    stms[:, :3, 3:] = g[:, None, None] * eye
+    stms[:, 3:, :3] = fd[:, None, None] * eye
+    stms[:, 3:, 3:] = gd[:, None, None] * eye
+    stms[:, :3] += (rv0[:, :, None] * coef[:, None, 0] +
+                    vv0[:, :, None] * coef[:, None, 1])
+    stms[:, 3:] += (rv0[:, :, None] * coef[:, None, 2] +
+                    vv0[:, :, None] * coef[:, None, 3])
+    return states, stms
+
+
+def advance(x_Vec, epoch, t_Vec, stm=False, mu=transformations.GM_SUN,
+            index=None):
+    '''
+    Advance states to many times at once: FIT's default advance
+    function (see the notes on advance functions in mpcfit.mpcfit)
+
+    Parameters
+    ----------
+    x_Vec       :   ndarray, shape (6,) or (M, 6)
+        Cartesian state(s) at epoch
+    epoch       :   float or ndarray, shape (M,)
+    t_Vec       :   ndarray, shape (N,)
+    stm         :   bool
+        Whether to return the state transition matrices too
+    mu          :   float
+    index       :   ndarray of int, shape (N,), optional
+        For M states: which one to advance to each time
+
+    Returns
+    -------
+    states      :   ndarray, shape (N, 6)
+    stms        :   ndarray, shape (N, 6, 6)
+        Only if stm is True
+    '''
+    t_Vec = np.asarray(t_Vec, dtype=float)
+    if index is None:
+        index = np.zeros(len(t_Vec), dtype=int)
+    x0 = np.reshape(np.asarray(x_Vec, dtype=float), (-1, 6))[index]
+    return propagate(x0, t_Vec - np.reshape(epoch, -1)[index], stm, mu)
@@ -0,0 +1,128 @@
+# /mpcfit/mpcfit/lighttime.py
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Light-time & aberration corrections for topocentric positions.
+#
+# An observation at t sees the object where it was at t - tau,
+# tau = |r(t - tau) - observer(t)| / c. tau is found by fixed-point
+# iteration, for all of the observations at once: each iteration
+# advances only those whose tau changed by more than the tolerance
+# in the one before, in a single call of the advance function.
+# The state transition matrices, when wanted, are taken in one
+# more call, at the converged times.
+#
+# With the observer's velocity, stellar aberration is applied too,
+# to first order in v / c.
+#
+# --------------------------------------------------------------
+"""
+
+
+# Import third-party packages
+# --------------------------------------------------------------
+import numpy as np
+
+
+# Constants
+# --------------------------------------------------------------
+
+C_AU_PER_DAY = 299792.458 * 86400. / 149597870.7
+'''Speed of light (au / day).'''
+
+TOL = 1e-12
+'''Change in tau (days) at which an observation has converged.'''
+
+MAX_ITER = 10
+'''Most light-time iterations before giving up.'''
+
+
+# Corrections
+# --------------------------------------------------------------
+
+def correct(advance, x_Vec, epoch, t_Vec, observer=0., stm=False,
+            index=None, observerVelocity=None, tol=TOL, maxIter=MAX_ITER):
+    '''
+    Topocentric positions of an object, corrected for light time
+    (and aberration)
+
+    Parameters
+    ----------
+    advance     :   callable
+        Advance function (see the notes in mpcfit.mpcfit)
+    x_Vec, epoch :
+        State(s) & epoch(s), as for the advance function
+    t_Vec       :   ndarray, shape (N,)
+        Times of observation
+    observer    :   ndarray, shape (N, 3) or (3,)
+        Heliocentric equatorial positions of the observer (au)
+    stm         :   bool
+        Whether to return d(rho) / d(x_Vec) too
+    index       :   ndarray of int, shape (N,), optional
+        Passed on to the advance function (for M states)
+    observerVelocity : ndarray, shape (N, 3) or (3,), optional
+        Observer's velocity (au / day); if given, stellar aberration
+        is applied as well
+    tol, maxIter :
+        Convergence tolerance (days) & most iterations
+
+    Returns
+    -------
+    rho         :   ndarray, shape (N, 3)
+        Apparent topocentric positions
+    drho        :   ndarray, shape (N, 3, 6)
+        d(rho) / d(x_Vec), allowing for the change in light time;
+        only if stm is True
+    counters    :   dict
+        nIter (iterations), nCalls (calls of advance) & nProp (states
+        advanced, over all calls)
+    '''
+    t_Vec = np.asarray(t_Vec, dtype=float)
+    n = len(t_Vec)
+    observer = np.broadcast_to(np.asarray(observer, dtype=float), (n, 3))
+    counters = dict(nIter=0, nCalls=0, nProp=0)
+
+    def positions(active, tau, withStm=False):
+        kwargs = {} if index is None else {'index': index[active]}
+        counters['nCalls'] += 1
+        counters['nProp'] += len(active)
+        return advance(x_Vec, epoch, t_Vec[active] - tau[active],
+                       stm=withStm, **kwargs)
+
+    tau = np.zeros(n)
+    states = np.empty((n, 6))
+    active = np.arange(n)
+    while len(active):
+        if counters['nIter'] == maxIter:
+            raise ValueError('light time did not converge')
+        counters['nIter'] += 1
+        s = positions(active, tau)
+        states[active] = s
+        tauNew = np.linalg.norm(s[:, :3] - observer[active], axis=1) / \
+            C_AU_PER_DAY
+        done = np.abs(tauNew - tau[active]) <= tol
+        tau[active] = tauNew
+        active = active[~done]
+
+    if stm:
+        states, phi = positions(np.arange(n), tau, True)
+    rho = states[:, :3] - observer
+    if observerVelocity is not None:
+        velocity = np.broadcast_to(observerVelocity, (n, 3))
+        rho = rho + tau[:, None] * velocity
+    if not stm:
+        return rho, counters
+
+    # tau depends on x_Vec through rho: with u = rho / |rho| and v the
+    # object's velocity, d(tau) = u . PHI_r dx / (c + u . v)
+    u = states[:, :3] - observer
+    u /= np.linalg.norm(u, axis=1)[:, None]
+    v = states[:, 3:]
+    dtau = np.einsum('ni,nij->nj', u, phi[:, :3]) / \
+        (C_AU_PER_DAY + np.einsum('ni,ni->n', u, v))[:, None]
+    drho = phi[:, :3] - v[:, :, None] * dtau[:, None]
+    if observerVelocity is not None:
+        drho += velocity[:, :, None] * dtau[:, None]
+    return rho, drho, counters
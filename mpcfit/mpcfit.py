@@ -23,10 +23,516 @@
 # --------------------------------------------------------------
 import numpy as np
 import collections
+import importlib
+import time
 
 # Import neighboring packages
 # --------------------------------------------------------------
 #import mpcutilities.phys_const as PHYS
+from mpcfit import kepler
+from mpcfit import lighttime
+from mpcfit import transformations
+from mpcfit.observations import OBSERVATIONS
+
+
+# Constants
+# --------------------------------------------------------------
+
+RAD_TO_ARCSEC = 180. * 3600. / np.pi
+'''Residuals are returned in arc seconds.'''
+
+COST_RTOL = 1e-10
+'''Relative rise in the cost that a step may make & still be taken:
+the rounding error of the cost, near a solution with large residuals.'''
+
+
+# Orbit advance
+# --------------------------------------------------------------
+#
+# FIT gets the states it needs from an "advance" function,
+# passed in params['advance'], with the signature
+#   advance(x_Vec, epoch, t_Vec, stm=False)
+# x_Vec   : ndarray, shape (6,): heliocentric equatorial Cartesian
+#           state (au, au/day) at time epoch
+# t_Vec   : ndarray, shape (N,): times to advance to
+# returns : states, ndarray shape (N, 6); and if stm is True also
+#           the state transition matrices d(state) / d(x_Vec),
+#           ndarray shape (N, 6, 6)
+# For fits of many objects at once (FIT.get_best_fit_BATCH) it is
+# called with x_Vec of shape (M, 6), epoch of shape (M,) and a keyword
+#   index   : ndarray, shape (N,): the object each time belongs to
+# kepler.advance is the default, and handles both: it advances
+# two-body orbits of any eccentricity in universal variables, with
+# analytic STMs (twoBodyAdvance is the same, under its old name).
+# nbody.NBODY(ephemeris).advance integrates the n-body problem with
+# its variational equations, once for all the times.
+
+def twoBodyAdvance(x_Vec, epoch, t_Vec, stm=False, mu=transformations.GM_SUN,
+                   index=None):
+    '''
+    Advance a state on a two-body (Keplerian) orbit to many times at once
+
+    The same as kepler.advance, which see.
+
+    Parameters
+    ----------
+    x_Vec       :   ndarray, shape (6,) or (M, 6)
+        Cartesian state(s) at epoch
+    epoch       :   float or ndarray, shape (M,)
+    t_Vec       :   ndarray, shape (N,)
+    stm         :   bool
+        Whether to return the state transition matrices too
+    mu          :   float
+    index       :   ndarray of int, shape (N,), optional
+        For M states: which one to advance to each time
+
+    Returns
+    -------
+    states      :   ndarray, shape (N, 6)
+    stms        :   ndarray, shape (N, 6, 6)
+        Only if stm is True
+    '''
+    return kepler.advance(x_Vec, epoch, t_Vec, stm, mu, index)
+
+
+# Normal equations
+# --------------------------------------------------------------
+#
+# C = B^T W B is solved by Cholesky factorisation, C = L L^T, and
+# forward & back substitution: no explicit inverse is formed except
+# for the covariance. All of these work on one matrix or on stacks of
+# them, so that many small fits can be solved together.
+
+def cholesky(C_Mat):
+    '''
+    Lower triangular Cholesky factor L of C (C = L L^T)
+
+    Parameters
+    ----------
+    C_Mat       :   ndarray, shape (..., k, k)
+        Symmetric positive definite
+
+    Returns
+    -------
+    L_Mat       :   ndarray, shape (..., k, k)
+    '''
+    return np.linalg.cholesky(C_Mat)
+
+
+def choleskySolve(L_Mat, b):
+    '''
+    Solve L L^T x = b by forward & back substitution
+
+    Parameters
+    ----------
+    L_Mat       :   ndarray, shape (..., k, k)
+        Lower triangular Cholesky factor
+    b           :   ndarray, shape (..., k) or (..., k, m)
+        With the same leading dimensions as L_Mat
+
+    Returns
+    -------
+    x           :   ndarray, same shape as b
+    '''
+    vector = b.ndim == L_Mat.ndim - 1
+    y = _forwardSolve(L_Mat, b[..., None] if vector else b)
+    k = L_Mat.shape[-1]
+    # L^T x = y
+    for i in range(k - 1, -1, -1):
+        y[..., i, :] -= np.einsum('...j,...jm->...m',
+                                  L_Mat[..., i + 1:, i], y[..., i + 1:, :])
+        y[..., i, :] /= L_Mat[..., i, i, None]
+    return y[..., 0] if vector else y
+
+
+def _forwardSolve(L_Mat, b):
+    '''Solve L y = b for lower triangular L, b of shape (..., k, m).'''
+    y = np.array(b, dtype=float)
+    for i in range(L_Mat.shape[-1]):
+        y[..., i, :] -= np.einsum('...j,...jm->...m',
+                                  L_Mat[..., i, :i], y[..., :i, :])
+        y[..., i, :] /= L_Mat[..., i, i, None]
+    return y
+
+
+def choleskyUpdate(L_Mat, V, sign=1):
+    '''
+    Cholesky factor of C + sign V V^T, from the factor L of C
+
+    A rank-m update (sign=1) or downdate (sign=-1), done as m rank-one
+    modifications, each O(k^2): much cheaper than forming & factoring
+    the modified matrix when m is small.
+
+    Parameters
+    ----------
+    L_Mat       :   ndarray, shape (k, k)
+        Lower triangular Cholesky factor of C
+    V           :   ndarray, shape (k, m)
+    sign        :   1 or -1
+
+    Returns
+    -------
+    L_Mat       :   ndarray, shape (k, k)
+        A new array
+
+    Raises
+    ------
+    np.linalg.LinAlgError
+        If a downdate leaves a matrix that is not positive definite
+    '''
+    L = np.array(L_Mat, dtype=float)
+    V = np.array(V, dtype=float)
+    k = len(L)
+    for v in V.T:
+        for i in range(k):
+            r2 = L[i, i]**2 + sign * v[i]**2
+            if r2 <= 0:
+                raise np.linalg.LinAlgError(
+                    'downdate is not positive definite')
+            r = np.sqrt(r2)
+            c, s = r / L[i, i], v[i] / L[i, i]
+            L[i, i] = r
+            L[i + 1:, i] = (L[i + 1:, i] + sign * s * v[i + 1:]) / c
+            v[i + 1:] = c * v[i + 1:] - s * L[i + 1:, i]
+    return L
+
+
+# Weights
+# --------------------------------------------------------------
+#
+# The weight matrix W of the residuals is never held as a dense
+# 2N x 2N matrix. It is one of:
+#  - diagonal            : ndarray (N, 2), the inverse variances
+#  - 2 x 2 blocks        : ndarray (N, 2, 2), RA/Dec correlated within
+#                          each observation
+#  - BLOCK_WEIGHTS       : correlated blocks of several observations,
+#                          e.g. one per night
+# All are used through whiten(W, x) = U x, where W = U^T U, so that
+# Q = |U nu|^2 and C = (U B)^T (U B), at O(N) cost.
+
+class BLOCK_WEIGHTS:
+    '''
+    Block diagonal weight matrix, for groups of consecutive
+    observations whose errors are correlated (e.g. those of one night)
+
+    Blocks of the same size are whitened together, so the cost is one
+    vectorized operation per distinct block size.
+    '''
+
+    __slots__ = ('offsets', 'n', 'blocks', '_groups', '_obsCov')
+
+    def __init__(self, offsets, blocks):
+        '''
+        Parameters
+        ----------
+        offsets     :   ndarray of int, shape (K + 1,)
+            Block k covers observations offsets[k]:offsets[k+1]
+        blocks      :   sequence of K ndarrays, shapes (2 n_k, 2 n_k)
+            Weight (inverse covariance) matrices of the residuals of
+            each block, ordered RA_0, Dec_0, RA_1, Dec_1, ...
+        '''
+        self.offsets = np.asarray(offsets)
+        self.n = int(self.offsets[-1])
+        self.blocks = [np.asarray(b, dtype=float) for b in blocks]
+        counts = np.diff(self.offsets)
+        if (self.offsets[0] != 0 or np.any(counts < 1) or
+                len(self.blocks) != len(counts)):
+            raise ValueError('offsets must increase from 0, one block each')
+        if any(b.shape != (2 * c, 2 * c) for b, c in zip(self.blocks, counts)):
+            raise ValueError('block k must have shape (2 n_k, 2 n_k)')
+
+        # Group by size: observation indices (K_s, n) & factors U = L^T
+        self._groups = []
+        self._obsCov = np.empty((self.n, 2, 2))
+        for c in np.unique(counts):
+            ks = np.flatnonzero(counts == c)
+            W = np.array([self.blocks[k] for k in ks])
+            rows = self.offsets[ks][:, None] + np.arange(c)
+            self._groups.append((rows, np.swapaxes(cholesky(W), -1, -2)))
+            cov = np.linalg.inv(W).reshape(len(ks), c, 2, c, 2)
+            self._obsCov[rows] = np.einsum('kiaib->kiab', cov)
+
+    @classmethod
+    def fromCovariance(cls, offsets, covariances):
+        '''BLOCK_WEIGHTS from the covariance matrices of the blocks.'''
+        return cls(offsets, [np.linalg.inv(c) for c in covariances])
+
+    def whiten(self, x):
+        '''U x for x of shape (N, 2) or (N, 2, k).'''
+        out = np.empty(np.shape(x))
+        for rows, U in self._groups:
+            xs = x[rows].reshape(rows.shape[0], 2 * rows.shape[1], -1)
+            out[rows] = np.matmul(U, xs).reshape(out[rows].shape)
+        return out
+
+    def obsCovariance(self):
+        '''(N, 2, 2): the covariance of each observation's residual.'''
+        return self._obsCov
+
+
+def whiten(W_Mat, x):
+    '''
+    U x, where W = U^T U, for any of the weight representations
+
+    Parameters
+    ----------
+    W_Mat       :   ndarray, shape (N, 2) or (N, 2, 2), or BLOCK_WEIGHTS
+    x           :   ndarray, shape (N, 2) or (N, 2, k)
+        Residuals or design matrix
+
+    Returns
+    -------
+    ndarray, same shape as x
+    '''
+    if isinstance(W_Mat, BLOCK_WEIGHTS):
+        return W_Mat.whiten(x)
+    extra = (None,) * (x.ndim - 2)
+    if W_Mat.ndim == 2:
+        return np.sqrt(W_Mat)[(Ellipsis,) + extra] * x
+    # 2 x 2 Cholesky factor written out: U = [[l11, l21], [0, l22]];
+    # zero for observations of zero weight
+    l11 = np.sqrt(W_Mat[:, 0, 0])
+    l21 = W_Mat[:, 1, 0] / np.where(l11 > 0, l11, 1.)
+    l22 = np.sqrt(np.maximum(W_Mat[:, 1, 1] - l21 * l21, 0.))
+    out = np.empty(x.shape)
+    out[:, 0] = l11[(Ellipsis,) + extra] * x[:, 0] + \
+        l21[(Ellipsis,) + extra] * x[:, 1]
+    out[:, 1] = l22[(Ellipsis,) + extra] * x[:, 1]
+    return out
+
+
+def weightedCost(nu_Vec, W_Mat, perObs=False):
+    '''
+    Q = nu^T W nu, or (perObs) each observation's contribution to it,
+    for diagonal or 2 x 2 block weights
+    '''
+    if not isinstance(W_Mat, BLOCK_WEIGHTS) and W_Mat.ndim == 2:
+        q = W_Mat * nu_Vec * nu_Vec
+    else:
+        q = whiten(W_Mat, nu_Vec)**2
+    return np.sum(q, axis=-1) if perObs else np.sum(q)
+
+
+def _obsCovariance(W_Mat):
+    '''(N, 2, 2) covariance of each observation's residual.'''
+    if isinstance(W_Mat, BLOCK_WEIGHTS):
+        return W_Mat.obsCovariance()
+    if W_Mat.ndim == 2:
+        cov = np.zeros(W_Mat.shape + (2,))
+        cov[:, 0, 0], cov[:, 1, 1] = 1 / W_Mat[:, 0], 1 / W_Mat[:, 1]
+        return cov
+    return np.linalg.inv(W_Mat)
+
+
+def _selectWeights(W_Mat, selected):
+    '''W with the observations not selected given zero weight.'''
+    if isinstance(W_Mat, BLOCK_WEIGHTS):
+        raise ValueError('rejection needs weights of single observations')
+    return W_Mat * selected.reshape((-1,) + (1,) * (W_Mat.ndim - 1))
+
+
+# Normal matrix assembly
+# --------------------------------------------------------------
+
+def normalEquations(B_Mat, W_Mat, nu_Vec, offsets=None):
+    '''
+    Normal matrix C = B^T W B and right-hand side B^T W nu
+
+    Parameters
+    ----------
+    B_Mat       :   ndarray, shape (..., N, 2, k)
+    W_Mat       :   ndarray, shape (..., N, 2), or (N, 2, 2), or
+                    BLOCK_WEIGHTS
+        Weights of the residuals (see the notes on weights): leading
+        dimensions are only allowed for diagonal weights
+    nu_Vec      :   ndarray, shape (..., N, 2)
+    offsets     :   ndarray of int, shape (M + 1,), optional
+        For the observations of M objects concatenated (B_Mat etc.
+        then have no leading dimensions): those of object i are
+        offsets[i]:offsets[i+1], and each must have at least one.
+        Not with BLOCK_WEIGHTS.
+
+    Returns
+    -------
+    C_Mat       :   ndarray, shape (..., k, k) or (M, k, k)
+    g_Vec       :   ndarray, shape (..., k) or (M, k)
+    '''
+    diagonal = not isinstance(W_Mat, BLOCK_WEIGHTS) and \
+        W_Mat.ndim == nu_Vec.ndim
+    if offsets is not None:
+        if isinstance(W_Mat, BLOCK_WEIGHTS):
+            raise ValueError('offsets need weights of single observations')
+        if diagonal:
+            WB, B = B_Mat * W_Mat[..., None], B_Mat
+            nu = nu_Vec
+        else:
+            WB = B = whiten(W_Mat, B_Mat)
+            nu = whiten(W_Mat, nu_Vec)
+        starts = offsets[:-1]
+        C_Mat = np.add.reduceat(np.einsum('nik,nil->nkl', WB, B),
+                                starts, axis=0)
+        g_Vec = np.add.reduceat(np.einsum('nik,ni->nk', WB, nu),
+                                starts, axis=0)
+        return C_Mat, g_Vec
+
+    lead, k = B_Mat.shape[:-3], B_Mat.shape[-1]
+    if diagonal:
+        B = B_Mat.reshape(lead + (-1, k))
+        WB = (B_Mat * W_Mat[..., None]).reshape(lead + (-1, k))
+        nu = nu_Vec.reshape(lead + (-1,))
+    else:
+        WB = B = whiten(W_Mat, B_Mat).reshape(-1, k)
+        nu = whiten(W_Mat, nu_Vec).ravel()
+    C_Mat = np.matmul(np.swapaxes(WB, -1, -2), B)
+    g_Vec = np.einsum('...nk,...n->...k', WB, nu)
+    return C_Mat, g_Vec
+
+
+def _choleskyStack(C_Mat):
+    '''
+    Cholesky factors of a stack of matrices, (M, k, k), tolerating
+    failures: returns L & a mask of those that are positive definite.
+    The factors of the others are set to the identity.
+    '''
+    try:
+        return cholesky(C_Mat), np.ones(len(C_Mat), dtype=bool)
+    except np.linalg.LinAlgError:
+        L = np.empty_like(C_Mat)
+        ok = np.ones(len(C_Mat), dtype=bool)
+        for i, C in enumerate(C_Mat):
+            try:
+                L[i] = cholesky(C)
+            except np.linalg.LinAlgError:
+                L[i], ok[i] = np.eye(C.shape[-1]), False
+        return L, ok
+
+
+def _chi2(nu_Vec, B_Mat, W_Mat, L_Mat, selected):
+    '''
+    Chi-squared of each observation's residual against its covariance,
+    Cov - B G B^T for those selected (used in the fit) and
+    Cov + B G B^T for the others, with G = (L L^T)^-1 and Cov the
+    covariance of the observation given by the weights.
+    '''
+    n = len(nu_Vec)
+    # B G B^T = Y^T Y, with L Y = B^T
+    Y = _forwardSolve(L_Mat, B_Mat.reshape(-1, 6).T).reshape(6, n, 2)
+    H = np.einsum('kni,knj->nij', Y, Y)
+    H *= np.where(selected, -1., 1.)[:, None, None]
+    H += _obsCovariance(W_Mat)
+
+    # nu^T H^-1 nu, with the 2 x 2 inverse written out
+    det = H[:, 0, 0] * H[:, 1, 1] - H[:, 0, 1] * H[:, 1, 0]
+    a, b = nu_Vec[:, 0], nu_Vec[:, 1]
+    q = (H[:, 1, 1] * a * a - (H[:, 0, 1] + H[:, 1, 0]) * a * b +
+         H[:, 0, 0] * b * b)
+    # An observation the fit depends on entirely can't be judged
+    return np.where(det > 0, q / np.where(det > 0, det, 1.), 0.)
+
+
+def _weights(params, n):
+    '''
+    Weights from params['weights'] (see the notes on weights), or else
+    diagonal weights (N, 2) from params['sigma'] (arc seconds)
+    '''
+    if 'weights' in params:
+        W = params['weights']
+        size = W.n if isinstance(W, BLOCK_WEIGHTS) else len(W)
+        if size != n or (not isinstance(W, BLOCK_WEIGHTS) and
+                         W.shape not in ((n, 2), (n, 2, 2))):
+            raise ValueError('weights must be for {} observations'.format(n))
+        return W
+    sigma = np.asarray(params.get('sigma', 1.), dtype=float)
+    if sigma.ndim == 1:
+        sigma = sigma[:, None]
+    return np.broadcast_to(sigma**-2, (n, 2))
+
+
+def _skyPartials(rho, out):
+    '''
+    d(RA, Dec) / d(rho) for topocentric vectors rho, (N, 3) -> (N, 2, 3)
+    '''
+    x, y, z = rho[:, 0], rho[:, 1], rho[:, 2]
+    rxy2 = x * x + y * y
+    rxy = np.sqrt(rxy2)
+    r2 = rxy2 + z * z
+    out[:, 0, 0] = -y / rxy2
+    out[:, 0, 1] = x / rxy2
+    out[:, 0, 2] = 0.
+    out[:, 1, 0] = -x * z / (r2 * rxy)
+    out[:, 1, 1] = -y * z / (r2 * rxy)
+    out[:, 1, 2] = rxy / r2
+    return out
+
+
+# Least-squares backends for FIT.get_best_fit_LAZY
+# --------------------------------------------------------------
+#
+# Each minimises sum(fun(x)**2) and has the signature
+#   backend(fun, jac, x0, bounds, maxIter, tol)
+# fun     : x -> residuals, ndarray shape (n,)
+# jac     : x -> d(fun) / dx, ndarray shape (n, 6)
+# bounds  : (lower, upper), ndarrays shape (6,), possibly infinite
+# returns : dict with x, nIter & converged, & optionally nFev & nJev,
+#           the solver's own counts of calls of fun & jac. nIter is
+#           None if the solver doesn't count iterations
+
+def _haveScipy():
+    return importlib.util.find_spec('scipy') is not None
+
+
+def lsqScipy(fun, jac, x0, bounds, maxIter, tol):
+    '''scipy.optimize.least_squares, trust region reflective.
+    It doesn't count iterations: nIter is None, & nFev & nJev are
+    its counts of evaluations.'''
+    from scipy.optimize import least_squares
+    res = least_squares(fun, x0, jac=jac, bounds=bounds, method='trf',
+                        x_scale='jac', xtol=tol, ftol=tol, gtol=tol,
+                        max_nfev=maxIter)
+    return dict(x=res.x, nIter=None, nFev=res.nfev, nJev=res.njev,
+                converged=res.status > 0)
+
+
+def lsqLM(fun, jac, x0, bounds, maxIter, tol):
+    '''
+    Levenberg-Marquardt, with Marquardt's diagonal scaling and
+    Nielsen's update of the damping. Steps are truncated to stay
+    inside the bounds.
+    '''
+    lower, upper = bounds
+    x = np.clip(x0, lower, upper)
+    r, J = fun(x), jac(x)
+    F = r.dot(r)
+    A, g = J.T.dot(J), J.T.dot(r)
+    damping, factor = 1e-3, 2.
+    converged = False
+    for nIter in range(1, maxIter + 1):
+        D = np.diag(np.maximum(np.diag(A), 1e-300))
+        step = -choleskySolve(cholesky(A + damping * D), g)
+        step = np.clip(x + step, lower, upper) - x
+        if np.linalg.norm(step) <= tol * (np.linalg.norm(x) + tol):
+            converged = True
+            break
+
+        rNew = fun(x + step)
+        FNew = rNew.dot(rNew)
+        # actual / predicted reduction of the cost
+        predicted = -step.dot(2 * g + A.dot(step))
+        rho = (F - FNew) / predicted if predicted > 0 else -1.
+        if rho > 0:
+            x, r, F = x + step, rNew, FNew
+            J = jac(x)
+            A, g = J.T.dot(J), J.T.dot(r)
+            damping *= max(1 / 3., 1 - (2 * rho - 1)**3)
+            factor = 2.
+        else:
+            damping *= factor
+            factor *= 2
+    return dict(x=x, nIter=nIter, converged=converged)
+
+
+LSQ_BACKENDS = {'scipy': lsqScipy, 'lm': lsqLM}
+'''Solvers for FIT.get_best_fit_LAZY, by name.'''
 
 
 # Fitting functions & classes
@@ -52,11 +558,15 @@ class ORBIT_FIT:
         self.x_Vec      = ...       # Vector of orbital parameters
         self.xBest_Vec  = ...       # Vector of best-fit orbital parameters (nominal soln)
         self.nu_Vec     = ...       # Vector of residuals (O-C)
-        self.W_Mat      = ...       # Weight matrix (from observational uncertainties)
+        self.W_Mat      = ...       # Weight matrix (from observational uncertainties): diagonal (N, 2), 2x2 blocks (N, 2, 2) or BLOCK_WEIGHTS
         self.Q_Mat      = ...       # Cost function (Q = \nu^T W \nu ) <<-- This is chiSq
         self.B_Mat      = ...       # Design matrix (B = \partial \nu / \partial x
         self.C_Mat      = ...       # Normal Matrix (C = B^T W B )
         self.G_Mat      = ...       # Covariance matrix, \Gamma = C^{-1}
+        self.L_Mat      = ...       # Cholesky factor of C (C = L L^T)
+        self.nIter      = 0         # Number of iterations done
+        self.converged  = False     # Whether the last correction was small
+        self.counters   = {}        # Cost of the fit: iterations, evaluations, time
 
 
 class FIT:
@@ -74,7 +584,7 @@ class FIT:
     '''
 
 
-    def __init__(self, observations):
+    def __init__(self, observations=None):
         '''
         Must initialize with a valid OBSERVATIONS object
         
@@ -86,89 +596,320 @@ class FIT:
         
         # Add assertions to assure contents
         #  - after development-phase, could disable assertions
-        # assert hasattr(observations, '???')
+        assert observations is None or \
+            isinstance(observations, OBSERVATIONS)
+        self.observations = observations
+
+        # Scratch space for get_residuals, reused between calls
+        self._work = {}
 
+        # Cost of light-time corrections, over all calls of get_residuals
+        self.lightTimeCounters = collections.Counter()
 
 
 
 
 
-    def get_residuals(x_Vec , t_Vec, d_Vec, params):
+
+    def get_residuals(self, x_Vec, t_Vec, d_Vec, params, out=None,
+                      partials=False):
         '''
         Calculation of residual vector:
             (Observed Data) - (Calculated Values)
             
         This is *NOT* iterated.
-        Will call MPCAdvancer function to get heliocentric
-        Will call MPCSky function to get sky-plane
-        
-        *** This needs to be generalized to allow for calculation and return of derivatives ***
-        
+        All observations are evaluated at once: the orbit is advanced
+        to every time in one call, and the sky-plane positions and O-C
+        are computed without any per-observation loop.
+        Repeated calls with the same number of observations reuse
+        internal scratch arrays, and write into out if given.
+
         Parameters
         ----------
-        x_Vec       :       ndarray
-            Vector of function parameters (orbit spec)
-        t_Vec       :       ndarray
+        x_Vec       :       ndarray, shape (6,)
+            Vector of function parameters (orbit spec):
+            heliocentric equatorial Cartesian state (au, au/day) at
+            params['epoch']
+        t_Vec       :       ndarray, shape (N,)
             Vector of times of observations
             Independent variable
-        d_Vec       :       ndarray
-            Vector of observations
+        d_Vec       :       ndarray, shape (N, 2)
+            Vector of observations: RA, Dec in radians
             Dependent variable(s)
         params      :       dict
             A means to pass various specifiction parameters. 
             E.g. 
-             - The method of orbital advance/evaluation
-             - ...
+             - 'epoch'    : time of x_Vec (required)
+             - 'advance'  : the method of orbital advance (see the notes
+                            on advance functions; default
+                            kepler.advance)
+             - 'observer' : ndarray, shape (N, 3) or (3,): heliocentric
+                            equatorial positions of the observer (au);
+                            default the origin, or with 'ephemeris'
+                            the geocentre
+             - 'ephemeris': ephemeris.EPHEMERIS with a body 'earth',
+                            evaluated at t_Vec for the observer when
+                            there is no 'observer' (and kept while
+                            t_Vec is the same)
+             - 'observatories' : observatories.OBSCODES; with
+                            'ephemeris', the observer is then at the
+                            observatory of each observation
+             - 'obsCode'  : ndarray, shape (N,): each observation's
+                            observatory code, or its index in
+                            'observatories'
+             - 'deltaT'   : TT - UT1 (days) for the Earth's rotation;
+                            default 0
+             - 'obsPosition' : ndarray, shape (N, 3): with 'ephemeris',
+                            the observer's geocentric position where
+                            it is finite (satellites, roving observers;
+                            see OBSERVATIONS.obsPosition), in place of
+                            the observatory's
+             - 'index'    : for x_Vec of shape (M, 6) & M epochs, the
+                            object each observation belongs to
+             - 'lightTime': whether to correct for light time (see
+                            lighttime.correct); default False
+             - 'observerVelocity' : ndarray, shape (N, 3) or (3,):
+                            with lightTime, also correct for stellar
+                            aberration
+        out         :       ndarray, shape (N, 2), optional
+            Buffer for the result
+        partials    :       bool
+            Whether to return the design matrix too, from the state
+            transition matrices of the advance function
         
         Returns
         -------
-        nu_Vec      :       ndarray
-            Vector of residuals (O-C)
+        nu_Vec      :       ndarray, shape (N, 2)
+            Vector of residuals (O-C): RA * cos(Dec), Dec in arc seconds
+        B_Mat       :       ndarray, shape (N, 2, 6)
+            Design matrix, d(nu_Vec) / d(x_Vec); only if partials
+        
+        With lightTime, the cost of the correction is added up in
+        self.lightTimeCounters.
         
         Examples
         --------
-        >>> ...
+        >>> nu = FIT().get_residuals(x, t, d, {'epoch': t[0]})
         
         '''
-    
+        n = len(t_Vec)
+        assert d_Vec.shape == (n, 2)
+        w = self._workspace(n)
+        nu_Vec = np.empty((n, 2)) if out is None else out
+
         # Use MPCAdvancer to get heliocentric cartesian positions at times t_Vec
-        
+        advance = params.get('advance', kepler.advance)
+        kwargs = {'index': params['index']} if 'index' in params else {}
+        observer = self._observer(t_Vec, params, w)
+        if params.get('lightTime'):
+            # topocentric positions at the times the light left
+            result = lighttime.correct(
+                advance, x_Vec, params['epoch'], t_Vec,
+                observer, partials,
+                observerVelocity=params.get('observerVelocity'), **kwargs)
+            for key, value in result[-1].items():
+                self.lightTimeCounters[key] += value
+            rho = w['rho']
+            rho[:] = result[0]
+            if partials:
+                drho = result[1]
+        else:
+            if partials:
+                states, stm = advance(x_Vec, params['epoch'], t_Vec,
+                                      stm=True, **kwargs)
+                drho = stm[:, :3, :]
+            else:
+                states = advance(x_Vec, params['epoch'], t_Vec, **kwargs)
+            rho = np.subtract(states[:, :3], observer,
+                              out=w['rho'])
+
         # Convert heliocentric cartesians to topocentric RA,Dec
-        
-        # Return vector of residuals
-        pass
+        ra, dec, tmp = w['ra'], w['dec'], w['tmp']
+        np.arctan2(rho[:, 1], rho[:, 0], out=ra)
+        np.hypot(rho[:, 0], rho[:, 1], out=tmp)
+        np.arctan2(rho[:, 2], tmp, out=dec)
+
+        # Return vector of residuals,
+        # with the RA difference wrapped into [-pi, pi)
+        dRA, dDec = nu_Vec[:, 0], nu_Vec[:, 1]
+        np.subtract(d_Vec[:, 0], ra, out=dRA)
+        dRA += np.pi
+        np.remainder(dRA, 2 * np.pi, out=dRA)
+        dRA -= np.pi
+        np.cos(d_Vec[:, 1], out=tmp)
+        dRA *= tmp
+        np.subtract(d_Vec[:, 1], dec, out=dDec)
+        nu_Vec *= RAD_TO_ARCSEC
+        if not partials:
+            return nu_Vec
+
+        # Design matrix: B = - d(RA cos(Dec_obs), Dec) / d(rho) . d(rho) / dx
+        dsky = _skyPartials(rho, w['dsky'])
+        dsky[:, 0] *= tmp[:, None]
+        dsky *= -RAD_TO_ARCSEC
+        return nu_Vec, np.matmul(dsky, drho)
+
+    def _countLightTime(self, orbit, params, before):
+        '''Add the light-time cost since before to orbit.counters.'''
+        if params.get('lightTime'):
+            orbit.counters['lightTime'] = {
+                key: value - before[key]
+                for key, value in self.lightTimeCounters.items()}
+
+    def _observer(self, t_Vec, params, w):
+        '''
+        params['observer'], or else the position of ephemeris body
+        'earth' at t_Vec (plus the observers' geocentric positions, as
+        given or of the observatories), kept in w while t_Vec & the
+        observers stay the same.
+        '''
+        if 'observer' in params:
+            return params['observer']
+        if 'ephemeris' not in params:
+            if 'observatories' in params or 'obsPosition' in params:
+                raise ValueError('observatories need an ephemeris')
+            return 0.
+        ephem, table = params['ephemeris'], params.get('observatories')
+        codes = params.get('obsCode') if table is not None else None
+        position = params.get('obsPosition')
+        deltaT = params.get('deltaT', 0.)
+        last = w.get('observerFor')
+        if last is None or last[0] is not ephem or last[1] is not table \
+                or not np.array_equal(last[2], deltaT) \
+                or not np.array_equal(w['observerTimes'], t_Vec) \
+                or not np.array_equal(w['observerCodes'], codes) \
+                or not np.array_equal(w['observerPositions'], position,
+                                      equal_nan=position is not None):
+            observer = ephem.evaluate(t_Vec, ['earth'])[0]
+            given = np.zeros(len(t_Vec), dtype=bool)
+            if position is not None:
+                given = np.isfinite(position).all(axis=1)
+                observer[given] += position[given]
+            if table is not None and not given.all():
+                index = np.asarray(codes)
+                if index.dtype.kind not in 'iu':
+                    index = table.index(index)
+                rest = ~given
+                observer[rest] += table.geocentric(
+                    index[rest], np.asarray(t_Vec)[rest],
+                    deltaT=np.broadcast_to(deltaT, given.shape)[rest])
+            w['observer'] = observer
+            w['observerFor'] = (ephem, table, np.array(deltaT))
+            w['observerTimes'] = np.array(t_Vec)
+            w['observerCodes'] = None if codes is None else np.array(codes)
+            w['observerPositions'] = None if position is None else \
+                np.array(position)
+        return w['observer']
+
+    def _workspace(self, n):
+        '''Scratch arrays for n observations, allocated once.'''
+        if self._work.get('n') != n:
+            self._work = dict(n=n, rho=np.empty((n, 3)), ra=np.empty(n),
+                              dec=np.empty(n), tmp=np.empty(n),
+                              dsky=np.empty((n, 2, 3)))
+        return self._work
         
 
-    def get_best_fit_LAZY():
+    def get_best_fit_LAZY(self, x_Vec, t_Vec, d_Vec, params, backend=None,
+                          bounds=None, maxIter=100, tol=1e-10):
         '''
         Iterative method to find best-fit orbit parameters 
         for a set of observations
         
-        I think that a lazy / black-box approach is to use 
-        scipy.optimize.least_squares /
-        scipy.optimize.minimize / 
-        scipy.optimize.curve_fit
+        A lazy / black-box approach: the weighted residuals are handed
+        to a general least-squares solver, such as
+        scipy.optimize.least_squares, together with their analytic
+        Jacobian (the design matrix from get_residuals).
          - Experimentation & preparation is in the notebook experimentation_with_leastsquares.ipynb
         
         Parameters
         ----------
+        x_Vec, t_Vec, d_Vec, params :
+            As for get_best_fit_EXPLICIT
+        backend     :       str or callable, optional
+            A name in LSQ_BACKENDS ('scipy' or 'lm'), or a function
+            with the same signature as those. Default 'scipy' if SciPy
+            is installed, else the built-in Levenberg-Marquardt, 'lm'.
+        bounds      :       (ndarray, ndarray), optional
+            Lower & upper bounds on x_Vec; steps are kept inside them
+        maxIter     :       int
+            Maximum number of iterations
+        tol         :       float
+            Converged when the relative change in x_Vec is below tol
         
         Returns
         -------
+        ORBIT_FIT
+            As from get_best_fit_EXPLICIT. counters holds the backend
+            name, nIter (None if the backend doesn't count them, as
+            scipy's doesn't), nFev (residual evaluations), nJev (design
+            matrix evaluations) & seconds (wall clock); with
+            params['lightTime'], also lightTime: the light-time
+            nIter, nCalls & nProp (see lighttime.correct)
         
         Examples
         --------
-        >>> ...
+        >>> fit = FIT().get_best_fit_LAZY(x, t, d, {'epoch': t[0]})
+        >>> fit.counters
         
         '''
-        # Conceptually we could get a lest-squares fit as follows ...
-        # (this is not yet using jacobian approach) 
-        # res_lsq = least_squares(get_residuals, x_VecInit, args=(t_Vec, d_Vec, params))
-        
-        pass
+        start = time.perf_counter()
+        lightTime = self.lightTimeCounters.copy()
+        if backend is None:
+            backend = 'scipy' if _haveScipy() else 'lm'
+        if isinstance(backend, str):
+            if backend not in LSQ_BACKENDS:
+                raise ValueError('unknown backend {}'.format(backend))
+            name, solver = backend, LSQ_BACKENDS[backend]
+        else:
+            name, solver = backend.__name__, backend
+
+        W_Mat = _weights(params, len(t_Vec))
+        x0 = np.array(x_Vec, dtype=float)
+        if bounds is None:
+            bounds = (np.full(6, -np.inf), np.full(6, np.inf))
+
+        # Residuals & Jacobian come from one call of get_residuals:
+        # keep the last one, as solvers usually ask for both at each x
+        last = {}
+        count = dict(nFev=0, nJev=0)
+
+        def evaluate(x):
+            if last.get('x') is None or not np.array_equal(last['x'], x):
+                nu, B = self.get_residuals(x, t_Vec, d_Vec, params,
+                                           partials=True)
+                last.update(x=np.array(x), nu=nu, B=B)
+            return last['nu'], last['B']
+
+        def fun(x):
+            count['nFev'] += 1
+            return whiten(W_Mat, evaluate(x)[0]).ravel()
+
+        def jac(x):
+            count['nJev'] += 1
+            return whiten(W_Mat, evaluate(x)[1]).reshape(-1, 6)
 
+        res = solver(fun, jac, x0, bounds, maxIter, tol)
 
-    def get_best_fit_EXPLICIT():
+        orbit = ORBIT_FIT()
+        orbit.x_Vec, orbit.xBest_Vec = x0, res['x']
+        orbit.nIter, orbit.converged = res.get('nIter'), res['converged']
+        nu, B = evaluate(res['x'])
+        orbit.nu_Vec, orbit.B_Mat = nu, B
+        orbit.W_Mat, orbit.Q_Mat = W_Mat, weightedCost(nu, W_Mat)
+        orbit.C_Mat = normalEquations(B, W_Mat, nu)[0]
+        orbit.L_Mat = cholesky(orbit.C_Mat)
+        orbit.G_Mat = choleskySolve(orbit.L_Mat, np.eye(6))
+        # the backend's own counts, if it keeps them, else ours
+        count.update((k, res[k]) for k in count if k in res)
+        orbit.counters = dict(method='LAZY', backend=name, nIter=orbit.nIter,
+                              seconds=time.perf_counter() - start, **count)
+        self._countLightTime(orbit, params, lightTime)
+        return orbit
+
+
+    def get_best_fit_EXPLICIT(self, x_Vec, t_Vec, d_Vec, params,
+                              maxIter=20, tol=1e-6):
         '''
         Iterative method to find best-fit orbit parameters 
         for a set of observations
@@ -176,56 +917,361 @@ class FIT:
         Explicit evaluation of design matrix, 
         application of differential correction, etc,
         following Milani / Farnocchia / Bernstein / etc
+
+        Each iteration is one Gauss-Newton step: the residuals & the
+        design matrix come from a single call of the advance function
+        (with state transition matrices, so no finite differences), and
+        the normal equations C dx = -B^T W nu are solved by Cholesky
+        factorisation. A step that increases the cost is halved.
         
         Parameters
         ----------
+        x_Vec       :       ndarray, shape (6,)
+            Starting orbit (see get_residuals)
+        t_Vec, d_Vec, params :
+            As for get_residuals. In addition params may hold
+             - 'sigma'   : uncertainty of the observations (arc seconds),
+                           float or ndarray, shape (N,) or (N, 2);
+                           default 1
+             - 'weights' : instead of sigma, the weight matrix: diagonal
+                           (N, 2), 2 x 2 blocks (N, 2, 2) or BLOCK_WEIGHTS
+                           (see the notes on weights)
+        maxIter     :       int
+            Maximum number of iterations
+        tol         :       float
+            Converged when the correction dx is this small in the metric
+            of the normal matrix, i.e. sqrt(dx^T C dx / 6) < tol
         
         Returns
         -------
+        ORBIT_FIT
+            With xBest_Vec, nu_Vec, W_Mat (the weights),
+            Q_Mat (chi-squared), B_Mat, C_Mat, L_Mat, G_Mat evaluated at
+            the solution, & nIter, converged, counters (as for
+            get_best_fit_LAZY; each evaluation gives residuals & B_Mat).
+            The fit stops, not converged, when no halving of a step
+            lowers the cost, or when the normal matrix is not positive
+            definite (too few observations), when G_Mat is nan too.
         
         Examples
         --------
-        >>> ...
+        >>> fit = FIT().get_best_fit_EXPLICIT(x, t, d, {'epoch': t[0]})
+        >>> fit.xBest_Vec, fit.G_Mat
         
         '''
-        pass
-        #
+        start = time.perf_counter()
+        lightTime = self.lightTimeCounters.copy()
+        orbit = ORBIT_FIT()
+        orbit.x_Vec = np.array(x_Vec, dtype=float)
+        W_Mat = _weights(params, len(t_Vec))
+
+        x = orbit.x_Vec.copy()
+        nu, B = self.get_residuals(x, t_Vec, d_Vec, params, partials=True)
+        nFev = 1
+        Q = weightedCost(nu, W_Mat)
+        for orbit.nIter in range(1, maxIter + 1):
+            C, g = normalEquations(B, W_Mat, nu)
+            try:
+                L = cholesky(C)
+            except np.linalg.LinAlgError:
+                # too few observations to determine the orbit
+                break
+            dx = -choleskySolve(L, g)
+            small = np.sqrt(dx.dot(C).dot(dx) / 6) < tol
+
+            # Step-halving if the linear approximation overshoots
+            step = dx
+            for _ in range(10):
+                xNew = x + step
+                nuNew, BNew = self.get_residuals(xNew, t_Vec, d_Vec, params,
+                                                 partials=True)
+                nFev += 1
+                QNew = weightedCost(nuNew, W_Mat)
+                if QNew <= Q * (1 + COST_RTOL):
+                    break
+                step = step * 0.5
+            else:
+                # no step lowers the cost: x stays, converged only if
+                # the full correction was already small
+                orbit.converged = small
+                break
+            x, nu, B, Q = xNew, nuNew, BNew, QNew
+
+            if small:
+                orbit.converged = True
+                break
+
+        orbit.xBest_Vec, orbit.nu_Vec, orbit.B_Mat = x, nu, B
+        orbit.W_Mat, orbit.Q_Mat = W_Mat, Q
+        orbit.C_Mat = normalEquations(B, W_Mat, nu)[0]
+        L, ok = _choleskyStack(orbit.C_Mat[None])
+        orbit.L_Mat = L[0]
+        orbit.G_Mat = choleskySolve(orbit.L_Mat, np.eye(6))
+        if not ok[0]:
+            orbit.G_Mat[:] = np.nan
+            orbit.converged = False
+        orbit.counters = dict(method='EXPLICIT', nIter=orbit.nIter,
+                              nFev=nFev, nJev=nFev,
+                              seconds=time.perf_counter() - start)
+        self._countLightTime(orbit, params, lightTime)
+        return orbit
     
 
 
-    def function_to_do_outlier_rejection_and-or_deal_with_non_convergence_and_hence_do_multiple_iterations_of_get_best_fit_XXX():
+    def get_best_fit_BATCH(self, x_Vec, t_Vec, d_Vec, offsets, params,
+                           maxIter=20, tol=1e-6):
         '''
-        Obviously the name will change
-        
+        get_best_fit_EXPLICIT for many objects at once
+
+        The observations of all objects are concatenated, and each
+        iteration evaluates the residuals & design matrices of all of
+        them in one call, and solves the stack of 6 x 6 normal equations
+        together. Objects stop being corrected once they converge.
+
         Parameters
         ----------
-        
+        x_Vec       :       ndarray, shape (M, 6)
+            Starting orbits
+        t_Vec       :       ndarray, shape (N,)
+        d_Vec       :       ndarray, shape (N, 2)
+        offsets     :       ndarray of int, shape (M + 1,)
+            The observations of object i are offsets[i]:offsets[i+1]
+        params      :       dict
+            As for get_best_fit_EXPLICIT, with 'epoch' a float or
+            ndarray, shape (M,). An 'advance' function must accept
+            M states (see the notes on advance functions). Weights
+            must be per observation (not BLOCK_WEIGHTS).
+        maxIter, tol :
+            As for get_best_fit_EXPLICIT, applied to each object
+
         Returns
         -------
-        
-        Examples
-        --------
-        >>> ...
-        
+        ORBIT_FIT
+            Holding stacked arrays: xBest_Vec (M, 6), Q_Mat (M,),
+            C_Mat, L_Mat, G_Mat (M, 6, 6), nIter (M,), converged (M,);
+            and nu_Vec (N, 2), W_Mat (N, 2), B_Mat (N, 2, 6) & offsets.
+            Objects whose normal matrix is not positive definite (too
+            few observations) stop being corrected, and are returned
+            with converged False and G_Mat nan, as are objects for
+            which no halving of a step lowers the cost. counters is as
+            for get_best_fit_EXPLICIT, counting iterations & evaluations
+            of all the objects together.
         '''
-        pass
-
-
-
+        start = time.perf_counter()
+        lightTime = self.lightTimeCounters.copy()
+        x = np.array(x_Vec, dtype=float)
+        M, N = len(x), len(t_Vec)
+        offsets = np.asarray(offsets)
+        counts = np.diff(offsets)
+        if x.shape != (M, 6):
+            raise ValueError('x_Vec must have shape (M, 6)')
+        if len(offsets) != M + 1 or offsets[0] != 0 or offsets[-1] != N:
+            raise ValueError('offsets must run from 0 to len(t_Vec)')
+        if np.any(counts < 1):
+            raise ValueError('every object needs observations')
 
+        index = np.repeat(np.arange(M), counts)
+        params = dict(params, index=index,
+                      epoch=np.broadcast_to(params['epoch'], (M,)))
+        W_Mat = _weights(params, N)
+        if isinstance(W_Mat, BLOCK_WEIGHTS):
+            raise ValueError('batch fits need weights of single observations')
 
+        def evaluate(x):
+            nu, B = self.get_residuals(x, t_Vec, d_Vec, params,
+                                       partials=True)
+            return nu, B, np.add.reduceat(
+                weightedCost(nu, W_Mat, perObs=True), offsets[:-1])
 
+        orbit = ORBIT_FIT()
+        orbit.x_Vec, orbit.offsets = x.copy(), offsets
+        orbit.nIter = np.zeros(M, dtype=int)
+        orbit.converged = np.zeros(M, dtype=bool)
+        active = np.ones(M, dtype=bool)
 
+        nu, B, Q = evaluate(x)
+        nIter, nFev = 0, 1
+        for nIter in range(1, maxIter + 1):
+            C, g = normalEquations(B, W_Mat, nu, offsets)
+            L, ok = _choleskyStack(C)
+            active &= ok
+            if not active.any():
+                break
+            dx = -choleskySolve(L, g)
+            dx[~active] = 0.
+            orbit.nIter[active] += 1
+            small = active & (np.sqrt(np.einsum('mk,mkl,ml->m',
+                                                dx, C, dx) / 6) < tol)
 
+            # Step-halving for objects whose cost went up
+            for _ in range(10):
+                nuNew, BNew, QNew = evaluate(x + dx)
+                nFev += 1
+                worse = active & (QNew > Q * (1 + COST_RTOL))
+                if not worse.any():
+                    break
+                dx[worse] *= 0.5
+            else:
+                # no step lowers their cost: they stay, & stop (as in
+                # get_best_fit_EXPLICIT)
+                dx[worse] = 0.
+                rows = worse[index]
+                nuNew[rows], BNew[rows] = nu[rows], B[rows]
+                QNew[worse] = Q[worse]
+                orbit.converged |= worse & small
+                active &= ~worse
+            x += dx
+            nu, B, Q = nuNew, BNew, QNew
 
+            done = active & small
+            orbit.converged |= done
+            active &= ~done
+            if not active.any():
+                break
 
+        orbit.xBest_Vec, orbit.nu_Vec, orbit.B_Mat = x, nu, B
+        orbit.W_Mat, orbit.Q_Mat = W_Mat, Q
+        orbit.C_Mat = normalEquations(B, W_Mat, nu, offsets)[0]
+        orbit.L_Mat, ok = _choleskyStack(orbit.C_Mat)
+        orbit.G_Mat = choleskySolve(orbit.L_Mat,
+                                    np.broadcast_to(np.eye(6), (M, 6, 6)))
+        orbit.G_Mat[~ok] = np.nan
+        orbit.converged &= ok
+        orbit.counters = dict(method='BATCH', nIter=nIter, nFev=nFev,
+                              nJev=nFev, seconds=time.perf_counter() - start)
+        self._countLightTime(orbit, params, lightTime)
+        return orbit
 
 
+    def get_best_fit_REJECT(self, x_Vec, t_Vec, d_Vec, params,
+                            chiReject=8., chiRecover=7., maxRounds=10,
+                            maxIter=20, tol=1e-6):
+        '''
+        Best-fit orbit with iterative rejection (& recovery) of outlying
+        observations, following Carpino, Milani & Chesley (2003)
 
+        Starts from get_best_fit_EXPLICIT with all the observations.
+        Then in each round, every observation's chi-squared is
+        evaluated against its residual covariance (smaller than its
+        own for observations used in the fit, larger for those not):
+        used observations above chiReject are rejected, and rejected
+        ones below chiRecover are restored.
 
+        Changing k observations changes the normal matrix C by rank 2k,
+        so its Cholesky factor is updated / downdated, rather than
+        being rebuilt from all the observations & refactored. The
+        updated factor is then reused for all the corrections of the
+        round, which only need the residuals & B^T W nu. C is rebuilt
+        & factored once, at the final solution.
 
+        Parameters
+        ----------
+        x_Vec, t_Vec, d_Vec, params :
+            As for get_best_fit_EXPLICIT
+            Weights must be per observation (not BLOCK_WEIGHTS)
+        chiReject   :       float
+            Chi-squared (2 degrees of freedom) above which to reject
+        chiRecover  :       float
+            Chi-squared below which to recover
+        maxRounds   :       int
+            Maximum number of rounds of rejection
+        maxIter, tol :
+            As for get_best_fit_EXPLICIT, for each round
 
+        Returns
+        -------
+        ORBIT_FIT
+            As from get_best_fit_EXPLICIT, with residuals & B_Mat for
+            all observations, but W_Mat zero for rejected ones; and also
+            selected (bool, (N,)): observations used in the fit,
+            chi2_Vec ((N,)): their chi-squared, & nRounds. converged is
+            that of the last round's corrections (or of the first fit,
+            if nothing was rejected), which stop as those of
+            get_best_fit_EXPLICIT do. If the first fit has no covariance
+            it is returned, with chi2_Vec nan.
+        
+        Examples
+        --------
+        >>> fit = FIT().get_best_fit_REJECT(x, t, d, {'epoch': t[0]})
+        >>> d[~fit.selected]     # the outliers
+        
+        '''
+        if isinstance(params.get('weights'), BLOCK_WEIGHTS):
+            raise ValueError('rejection needs weights of single observations')
+        orbit = self.get_best_fit_EXPLICIT(x_Vec, t_Vec, d_Vec, params,
+                                           maxIter, tol)
+        W_Mat = orbit.W_Mat
+        selected = np.ones(len(t_Vec), dtype=bool)
+        x, nu, B, L = orbit.xBest_Vec, orbit.nu_Vec, orbit.B_Mat, orbit.L_Mat
+        orbit.nRounds = 0
+        if np.isnan(orbit.G_Mat).any():
+            # no orbit to judge the observations by
+            orbit.selected = selected
+            orbit.chi2_Vec = np.full(len(t_Vec), np.nan)
+            return orbit
 
+        for orbit.nRounds in range(1, maxRounds + 1):
+            chi2 = _chi2(nu, B, W_Mat, L, selected)
+            reject = selected & (chi2 > chiReject)
+            recover = ~selected & (chi2 < chiRecover)
+            # Keep enough observations to determine an orbit
+            nKeep = selected.sum() + recover.sum() - 3
+            if reject.sum() > nKeep:
+                worst = np.argsort(np.where(reject, -chi2, 0))[:max(nKeep, 0)]
+                reject[:] = False
+                reject[worst] = True
+            if not reject.any() and not recover.any():
+                break
 
+            # Rank-2k modification of the factor of C
+            def rows(mask):
+                return whiten(W_Mat[mask], B[mask]).reshape(-1, 6).T
+            L = choleskyUpdate(L, rows(recover), 1)
+            try:
+                L = choleskyUpdate(L, rows(reject), -1)
+            except np.linalg.LinAlgError:
+                W = _selectWeights(W_Mat, selected & ~reject | recover)
+                L = cholesky(normalEquations(B, W, nu)[0])
+            selected = selected & ~reject | recover
 
+            # Corrections with the factor held fixed, & steps halved
+            # as in get_best_fit_EXPLICIT
+            W = _selectWeights(W_Mat, selected)
+            Q = weightedCost(nu, W)
+            orbit.converged = False
+            for _ in range(maxIter):
+                orbit.nIter += 1
+                g = normalEquations(B, W, nu)[1]
+                dx = -choleskySolve(L, g)
+                small = np.sqrt(np.sum(np.dot(L.T, dx)**2) / 6) < tol
+                step = dx
+                for _ in range(10):
+                    nuNew, BNew = self.get_residuals(x + step, t_Vec, d_Vec,
+                                                     params, partials=True)
+                    QNew = weightedCost(nuNew, W)
+                    if QNew <= Q * (1 + COST_RTOL):
+                        break
+                    step = step * 0.5
+                else:
+                    orbit.converged = small
+                    break
+                x, nu, B, Q = x + step, nuNew, BNew, QNew
+                if small:
+                    orbit.converged = True
+                    break
 
+        # The factor refactored from C at the solution, for the
+        # covariance & the chi-squared of each observation
+        W = _selectWeights(W_Mat, selected)
+        orbit.xBest_Vec, orbit.nu_Vec, orbit.B_Mat = x, nu, B
+        orbit.W_Mat, orbit.Q_Mat = W, weightedCost(nu, W)
+        orbit.C_Mat = normalEquations(B, W, nu)[0]
+        L, ok = _choleskyStack(orbit.C_Mat[None])
+        orbit.L_Mat = L[0]
+        orbit.G_Mat = choleskySolve(orbit.L_Mat, np.eye(6))
+        if not ok[0]:
+            orbit.G_Mat[:] = np.nan
+            orbit.converged = False
+        orbit.selected = selected
+        orbit.chi2_Vec = _chi2(nu, B, W_Mat, orbit.L_Mat, selected)
+        return orbit
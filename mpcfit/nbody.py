@@ -0,0 +1,414 @@
+# /mpcfit/mpcfit/nbody.py
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# N-body orbit advance, with variational equations, for fitting.
+#
+# The heliocentric motion of an object under the Sun & perturbing
+# bodies (their positions from an ephemeris.EPHEMERIS) is
+# integrated together with the 6 x 6 variational equations,
+# d^2(dr)/dt^2 = A(t) dr, A = d(acceleration) / d(r), by a
+# Gauss-Radau integrator (Everhart's RA15, as in IAS15): in each
+# step the acceleration is a polynomial of degree 7 in the fraction
+# of the step, fitted at 7 Gauss-Radau spacings by predictor-
+# corrector iteration. The step is controlled as in IAS15, by the
+# size of the polynomial's last coefficient: steps shrink near
+# perihelion & grow (up to a largest step) away from it. The
+# perturbers' positions at a step's substeps are taken from the
+# ephemeris in one call per step.
+#
+# The polynomials of all the steps are kept, which gives dense
+# output: one integration, forward & back from the epoch, serves
+# every observation time, with no restarts.
+#
+# --------------------------------------------------------------
+"""
+
+
+# Import third-party packages
+# --------------------------------------------------------------
+from math import comb
+
+import numpy as np
+
+# Import neighboring packages
+# --------------------------------------------------------------
+from mpcfit import transformations
+
+
+# Constants
+# --------------------------------------------------------------
+
+GM = {name: transformations.GM_SUN / ratio for name, ratio in (
+    ('mercury', 6023600.), ('venus', 408523.71), ('earth', 328900.56),
+    ('mars', 3098708.), ('jupiter', 1047.3486), ('saturn', 3497.898),
+    ('uranus', 22902.98), ('neptune', 19412.24))}
+'''GM of the planets (au^3 / day^2); 'earth' is the Earth & Moon.'''
+
+STEP = 8.
+'''Default largest step (days).'''
+
+EPSILON = 1e-9
+'''Step control: the size of the last coefficient of a step's
+acceleration polynomial, relative to the acceleration, that steps
+are chosen for (IAS15's epsilon).'''
+
+SAFETY = 0.25
+'''A step is taken again, shorter, when the step control asks for
+less than SAFETY of it; steps grow by at most 1 / SAFETY.'''
+
+MIN_STEP = 1e-8
+'''Shortest step (days) before giving up.'''
+
+MARGIN = 1.
+'''Days integrated beyond the times asked for, so that the times of
+light-time iterations are served by the same integration.'''
+
+MAX_ITER = 12
+'''Most predictor-corrector iterations in a step.'''
+
+CACHE = 16
+'''Integrations kept, for the (state, epoch) pairs last used: at
+least those of all the objects of the last call.'''
+
+TOL = 1e-16
+'''Relative change in the last coefficient at which a step's
+predictor-corrector iteration has converged.'''
+
+_H = np.array([0., 0.0562625605369221464656521910318,
+               0.180240691736892364987579942780,
+               0.352624717113169637373907769648,
+               0.547153626330555383001448554766,
+               0.734210177215410531523210605558,
+               0.885320946839095768090359771030,
+               0.977520613561287501891174488626])
+'''Gauss-Radau spacings of the substeps (fractions of a step).'''
+
+
+def _conversions():
+    '''
+    C, C^-1 & S: the acceleration a(h) = a0 + sum_k b_k h^(k+1)
+    = a0 + sum_j g_j h (h - h_1) ... (h - h_j), so b = C g; & the
+    shift of the b to the next step, b_next = S b.
+    '''
+    C = np.zeros((7, 7))
+    for j in range(7):
+        poly = np.polynomial.polynomial.polyfromroots(_H[:j + 1])
+        C[:j + 1, j] = poly[1:]
+    S = np.array([[comb(j + 1, k + 1) if j >= k else 0. for j in range(7)]
+                  for k in range(7)])
+    return C, np.linalg.inv(C), S
+
+
+_C, _C_INV, _SHIFT = _conversions()
+
+# Coefficients of b_k in the position & velocity series
+_X_COEF = 1. / ((np.arange(7) + 2) * (np.arange(7) + 3))
+_V_COEF = 1. / (np.arange(7) + 2)
+# ... & of the position at each substep
+_XH = _X_COEF * _H[:, None]**np.arange(1, 8)
+
+
+# Integrator
+# --------------------------------------------------------------
+
+class NBODY:
+    '''
+    N-body advance functions, with the perturbers of an ephemeris
+
+    Use as an advance function for FIT (see the notes in mpcfit):
+    >>> params['advance'] = NBODY(ephemeris.load(path)).advance
+
+    The integrations of the last CACHE (state, epoch) pairs are kept,
+    and used again while the times are within them: with M states,
+    each is integrated once for all the iterations of
+    lighttime.correct. Integrations always include the variational
+    equations, so one serves calls with & without STMs. counters
+    holds the number of integrations, steps (& steps taken again)
+    & evaluations of the accelerations.
+    '''
+
+    def __init__(self, ephem=None, bodies=None, step=STEP,
+                 mu=transformations.GM_SUN, gm=GM):
+        '''
+        Parameters
+        ----------
+        ephem       :   ephemeris.EPHEMERIS or None
+            Heliocentric equatorial positions of the perturbers
+            (au); None for two-body motion
+        bodies      :   sequence of str, optional
+            The perturbers; default the bodies of ephem in gm
+        step        :   float
+            Largest step (days)
+        mu          :   float
+            GM of the Sun
+        gm          :   dict
+            GM of the perturbers
+        '''
+        if bodies is None:
+            bodies = [] if ephem is None else \
+                [b for b in ephem.names.tolist() if b in gm]
+        if bodies and ephem is None:
+            raise ValueError('perturbers need an ephemeris')
+        self.ephem, self.bodies = ephem, list(bodies)
+        self.gm = np.array([gm[b] for b in self.bodies])
+        self._gm = np.concatenate(([mu], self.gm))
+        self.step, self.mu = float(step), mu
+        self.counters = dict(nIntegrations=0, nSteps=0, nRejected=0,
+                             nEval=0)
+        self._cache = {}
+
+    def advance(self, x_Vec, epoch, t_Vec, stm=False, index=None):
+        '''
+        Advance states to many times at once (see kepler.advance)
+
+        Parameters
+        ----------
+        x_Vec       :   ndarray, shape (6,) or (M, 6)
+            Heliocentric equatorial Cartesian state(s) at epoch
+        epoch       :   float or ndarray, shape (M,)
+        t_Vec       :   ndarray, shape (N,)
+        stm         :   bool
+            Whether to return the state transition matrices too
+        index       :   ndarray of int, shape (N,), optional
+            For M states: which one to advance to each time (each
+            is integrated in turn)
+
+        Returns
+        -------
+        states      :   ndarray, shape (N, 6)
+        stms        :   ndarray, shape (N, 6, 6)
+            Only if stm is True
+        '''
+        x_Vec = np.reshape(np.asarray(x_Vec, dtype=float), (-1, 6))
+        epoch = np.broadcast_to(np.asarray(epoch, dtype=float),
+                                (len(x_Vec),))
+        t_Vec = np.asarray(t_Vec, dtype=float)
+        if index is None:
+            index = np.zeros(len(t_Vec), dtype=int)
+        states = np.empty((len(t_Vec), 6))
+        stms = np.empty((len(t_Vec), 6, 6)) if stm else None
+        for m in np.unique(index):
+            mine = np.flatnonzero(index == m)
+            dense = self._integration(x_Vec[m], epoch[m], t_Vec[mine])
+            result = dense.evaluate(t_Vec[mine], stm)
+            if stm:
+                states[mine], stms[mine] = result
+            else:
+                states[mine] = result
+        # the oldest go, but not those of this call
+        while len(self._cache) > max(CACHE, len(np.unique(index))):
+            del self._cache[next(iter(self._cache))]
+        return (states, stms) if stm else states
+
+    def _integration(self, x, epoch, t):
+        '''The kept integration of x & epoch, if it will do, or a new one.'''
+        key = (x.tobytes(), float(epoch))
+        dense = self._cache.pop(key, None)
+        if dense is not None and dense.covers(t):
+            self._cache[key] = dense
+            return dense
+        lo = min(epoch, t.min() - MARGIN) if len(t) else epoch
+        hi = max(epoch, t.max() + MARGIN) if len(t) else epoch
+        # always with the variational equations (a small part of the
+        # cost), so that one integration serves calls with & without
+        dense = DENSE(epoch, *[self._integrate(x, epoch, end - epoch, True)
+                               for end in (hi, lo)])
+        self._cache[key] = dense
+        self.counters['nIntegrations'] += 1
+        return dense
+
+    def _accelerations(self, X, P, indirect):
+        '''
+        Accelerations of the object & of its variations
+
+        Parameters
+        ----------
+        X        :   ndarray, shape (1 + K, 3)
+            Position, then K variations
+        P        :   ndarray, shape (1 + B, 3)
+            Positions of the Sun (the origin) & the perturbers
+        indirect :   ndarray, shape (3,)
+            Acceleration of the Sun by the perturbers
+
+        Returns
+        -------
+        ndarray, shape (1 + K, 3)
+        '''
+        self.counters['nEval'] += 1
+        d = X[0] - P
+        d2 = np.einsum('bi,bi->b', d, d)
+        w = self._gm / (d2 * np.sqrt(d2))
+        A = np.empty_like(X)
+        A[0] = -w.dot(d) - indirect
+        if len(X) > 1:
+            # A(t) dr = -sum w (dr - 3 d (d . dr) / |d|^2)
+            dr = X[1:]
+            proj = d.dot(dr.T) * (3 * w / d2)[:, None]
+            A[1:] = proj.T.dot(d) - w.sum() * dr
+        return A
+
+    def _perturbers(self, times):
+        '''
+        Positions of the Sun & the perturbers, shape (T, 1 + B, 3), &
+        the acceleration of the Sun by the perturbers, (T, 3)
+        '''
+        P = np.zeros((len(times), 1 + len(self.bodies), 3))
+        indirect = np.zeros((len(times), 3))
+        if len(self.bodies):
+            P[:, 1:] = self.ephem.evaluate(times, self.bodies).transpose(
+                1, 0, 2)
+            r3 = np.linalg.norm(P[:, 1:], axis=2)**3
+            indirect = np.einsum('b,tbi->ti', self.gm,
+                                 P[:, 1:] / r3[..., None])
+        return P, indirect
+
+    def _integrate(self, x, epoch, span, stm):
+        '''
+        Integrate from epoch over span (days, either sign)
+
+        Returns
+        -------
+        dict of per-step arrays: t0 (S,), the start (days from epoch),
+        dt (S,), x0, v0, a0 (S, 1 + K, 3) & b (S, 7, 1 + K, 3); K = 6
+        with stm, else 0; & span
+        '''
+        K = 6 if stm else 0
+        X, V = np.zeros((1 + K, 3)), np.zeros((1 + K, 3))
+        X[0], V[0] = x[:3], x[3:]
+        if stm:
+            X[1:4], V[4:7] = np.eye(3), np.eye(3)
+        steps = dict(t0=[], dt=[], x0=[], v0=[], a0=[], b=[])
+
+        t, dt = 0., np.copysign(self.step, span)
+        P, indirect = self._perturbers(np.array([epoch]))
+        a0 = self._accelerations(X, P[0], indirect[0])
+        b = np.zeros((7,) + X.shape)
+        g = np.zeros_like(b)
+        while abs(span - t) > 0:
+            last = abs(dt) >= abs(span - t)
+            if last:
+                b *= ((span - t) / dt)**np.arange(1, 8)[:, None, None]
+                dt = span - t
+            P, indirect = self._perturbers(epoch + t + dt * np.append(
+                _H, 1.))
+            g[:] = np.dot(_C_INV, b.reshape(7, -1)).reshape(b.shape)
+            for _ in range(MAX_ITER):
+                previous = b[6, 0].copy()
+                for i in range(1, 8):
+                    h = _H[i]
+                    Xi = X + dt * h * V + (dt * h)**2 * (
+                        a0 / 2 + np.dot(_XH[i], b.reshape(7, -1)).reshape(
+                            X.shape))
+                    ai = self._accelerations(Xi, P[i], indirect[i])
+                    # divided differences: g_(i-1) from a_0 ... a_i
+                    gi = (ai - a0) / h
+                    for j in range(i - 1):
+                        gi = (gi - g[j]) / (h - _H[j + 1])
+                    g[i - 1] = gi
+                    b = np.dot(_C, g.reshape(7, -1)).reshape(g.shape)
+                if np.max(np.abs(b[6, 0] - previous)) <= \
+                        TOL * np.max(np.abs(ai[0])):
+                    break
+
+            # step control (IAS15): the step for which b_7 of the
+            # object's acceleration would be EPSILON of it
+            error = np.max(np.abs(b[6, 0])) / np.max(np.abs(ai[0]))
+            ratio = (EPSILON / error)**(1. / 7) if error > 0 else 1 / SAFETY
+            if not ratio >= SAFETY:
+                # taken again, shorter, from the same start
+                ratio = ratio if ratio > 0 else SAFETY
+                if abs(dt * ratio) < MIN_STEP:
+                    raise ValueError('step too short at {}'.format(
+                        epoch + t))
+                b *= ratio**np.arange(1, 8)[:, None, None]
+                dt *= ratio
+                self.counters['nRejected'] += 1
+                continue
+
+            for key, value in zip(('t0', 'dt', 'x0', 'v0', 'a0', 'b'),
+                                  (t, dt, X, V, a0, b)):
+                steps[key].append(value)
+            flat = b.reshape(7, -1)
+            X = X + dt * V + dt * dt * (
+                a0 / 2 + _X_COEF.dot(flat).reshape(X.shape))
+            V = V + dt * (a0 + _V_COEF.dot(flat).reshape(V.shape))
+            a0 = self._accelerations(X, P[8], indirect[8])
+            t = span if last else t + dt
+
+            # start the next step from this step's polynomial
+            new = np.copysign(min(abs(dt) * min(ratio, 1 / SAFETY),
+                                  self.step), span)
+            b = ((new / dt)**np.arange(1, 8)[:, None] *
+                 np.dot(_SHIFT, flat)).reshape(b.shape)
+            dt = new
+        self.counters['nSteps'] += len(steps['b'])
+        shapes = dict(t0=(), dt=(), x0=X.shape, v0=X.shape, a0=X.shape,
+                      b=(7,) + X.shape)
+        steps = {key: np.reshape(value, (-1,) + shapes[key])
+                 for key, value in steps.items()}
+        steps['span'] = span
+        return steps
+
+
+def _position(x0, v0, a0, b, dt, h):
+    '''Positions at fractions h (N,) of steps (x0, dt etc. per h).'''
+    series = np.einsum('nk,nkij->nij', h[:, None]**np.arange(1, 8) *
+                       _X_COEF, b)
+    h = h[:, None, None]
+    return x0 + dt * h * v0 + (dt * h)**2 * (a0 / 2 + series)
+
+
+def _velocity(v0, a0, b, dt, h):
+    '''Velocities at fractions h (N,) of steps (v0, dt etc. per h).'''
+    series = np.einsum('nk,nkij->nij', h[:, None]**np.arange(1, 8) *
+                       _V_COEF, b)
+    return v0 + dt * h[:, None, None] * (a0 + series)
+
+
+class DENSE:
+    '''
+    The steps of an integration, forward & back from epoch, which
+    give the state (& STM) at any time within them.
+    '''
+
+    def __init__(self, epoch, forward, backward):
+        self.epoch = epoch
+        self.forward, self.backward = forward, backward
+        self.start = epoch + backward['span']
+        self.end = epoch + forward['span']
+
+    def covers(self, t):
+        return len(t) == 0 or (t.min() >= self.start and
+                               t.max() <= self.end)
+
+    def evaluate(self, t, stm=False):
+        '''States (N, 6) [& STMs (N, 6, 6)] at times t.'''
+        if not self.covers(t):
+            raise ValueError('times outside the integration')
+        X = np.empty((len(t),) + self.forward['x0'].shape[1:])
+        V = np.empty_like(X)
+        back = t < self.epoch
+        for steps, mine, sign in ((self.forward, ~back, 1.),
+                                  (self.backward, back, -1.)):
+            if not mine.any():
+                continue
+            # the step of each time: the last to start before it
+            u = t[mine] - self.epoch
+            k = np.clip(np.searchsorted(sign * steps['t0'], sign * u,
+                                        side='right') - 1,
+                        0, len(steps['b']) - 1)
+            dt = steps['dt'][k][:, None, None]
+            h = (u - steps['t0'][k]) / steps['dt'][k]
+            b = steps['b'][k]
+            X[mine] = _position(steps['x0'][k], steps['v0'][k],
+                                steps['a0'][k], b, dt, h)
+            V[mine] = _velocity(steps['v0'][k], steps['a0'][k], b, dt, h)
+        states = np.concatenate((X[:, 0], V[:, 0]), axis=1)
+        if not stm:
+            return states
+        # column j of the STM is variation j: (dr, dv)
+        return states, np.concatenate((X[:, 1:], V[:, 1:]),
+                                      axis=2).transpose(0, 2, 1)
@@ -0,0 +1,236 @@
+# /mpcfit/mpcfit/observations.py
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Container for observations, as used by the fitting code.
+#
+# Observations are held column-wise (struct-of-arrays): one
+# contiguous numpy array per quantity. Archives on disk are
+# directories of one .npy file per column, which are opened with
+# memory mapping, so that archives larger than memory can be used
+# & only the pages touched are read.
+#
+# Observations of an object (and of a tracklet) are expected to
+# be consecutive, so that they can be sliced out without copying.
+#
+# --------------------------------------------------------------
+"""
+
+
+# Import third-party packages
+# --------------------------------------------------------------
+import numbers
+import os
+
+import numpy as np
+
+
+# Observation container
+# --------------------------------------------------------------
+
+class OBSERVATIONS:
+    '''
+    Columns of observations
+
+    time        :   float64, e.g. MJD (TT, as from ingest)
+    ra, dec     :   float64, radians
+    sigmaRA     :   float64, arc seconds (of RA * cos(Dec))
+    sigmaDec    :   float64, arc seconds
+    obsCode     :   S3, observatory code
+    objId       :   S16, object designation
+    trkId       :   S16, tracklet identifier
+    obsX, obsY, obsZ : float64, au, the observer's geocentric
+                    equatorial (J2000) position, where the record gives
+                    it (satellites, roving observers); else NaN
+
+    Slicing (obs[i:j]) gives a view of the same columns, without
+    copying, as do object(), iterObjects() & iterTracklets().
+    '''
+
+    COLUMNS = ('time', 'ra', 'dec', 'sigmaRA', 'sigmaDec', 'obsCode',
+               'objId', 'trkId', 'obsX', 'obsY', 'obsZ')
+    DTYPES = dict(time='f8', ra='f8', dec='f8', sigmaRA='f8',
+                  sigmaDec='f8', obsCode='S3', objId='S16', trkId='S16',
+                  obsX='f8', obsY='f8', obsZ='f8')
+
+    __slots__ = COLUMNS + ('_index',)
+
+    def __init__(self, time, ra, dec, sigmaRA=1., sigmaDec=1., obsCode='500',
+                 objId='', trkId='', obsPosition=np.nan):
+        '''
+        Parameters
+        ----------
+        time, ra, dec : array-like, shape (N,)
+        sigmaRA, sigmaDec, obsCode, objId, trkId : array-like, shape (N,)
+            Or a single value for all observations
+        obsPosition : array-like, shape (N, 3)
+            Or a single value; see obsX, obsY, obsZ
+        '''
+        n = len(time)
+        position = np.asarray(obsPosition, dtype=float)
+        if position.ndim == 0:
+            position = np.full((n, 3), position)
+        if position.shape != (n, 3):
+            raise ValueError('obsPosition must have shape ({}, 3)'.format(n))
+        for name, value in zip(self.COLUMNS, (time, ra, dec, sigmaRA,
+                                              sigmaDec, obsCode, objId,
+                                              trkId, *position.T.copy())):
+            col = np.asarray(value, dtype=self.DTYPES[name])
+            if col.ndim == 0:
+                col = np.full(n, col)
+            if col.shape != (n,):
+                raise ValueError('{} must have length {}'.format(name, n))
+            setattr(self, name, col)
+        self._index = {}
+
+    @classmethod
+    def _fromColumns(cls, columns):
+        '''Wrap existing arrays (e.g. memory maps), without copying.'''
+        obs = cls.__new__(cls)
+        for name in cls.COLUMNS:
+            setattr(obs, name, columns[name])
+        obs._index = {}
+        return obs
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, item):
+        '''A view of a slice (an integer is a slice of one), or a copy
+        for an index array or mask.'''
+        if isinstance(item, numbers.Integral):
+            item = int(item)
+            if not -len(self) <= item < len(self):
+                raise IndexError('observation index out of range')
+            item = slice(item, item + 1 if item != -1 else None)
+        return self._fromColumns({c: getattr(self, c)[item]
+                                  for c in self.COLUMNS})
+
+    def __repr__(self):
+        return 'OBSERVATIONS({} observations)'.format(len(self))
+
+    @classmethod
+    def concatenate(cls, observations):
+        '''One OBSERVATIONS holding all of a sequence of them.'''
+        return cls._fromColumns({c: np.concatenate(
+            [getattr(o, c) for o in observations]) for c in cls.COLUMNS})
+
+    def sort(self):
+        '''Copy ordered by object, tracklet & time.'''
+        return self[np.lexsort((self.time, self.trkId, self.objId))]
+
+    # Data in the forms used by FIT & gcm
+    # ----------------------------------------------------------
+
+    @property
+    def d_Vec(self):
+        '''(N, 2) RA, Dec, as taken by FIT.'''
+        return np.column_stack((self.ra, self.dec))
+
+    @property
+    def obsPosition(self):
+        '''(N, 3) geocentric positions of the observer (NaN where the
+        site's are), as taken by FIT in params['obsPosition'].'''
+        return np.column_stack((self.obsX, self.obsY, self.obsZ))
+
+    @property
+    def sigma(self):
+        '''(N, 2) uncertainties, as taken by FIT in params['sigma'].'''
+        return np.column_stack((self.sigmaRA, self.sigmaDec))
+
+    def gcmInputs(self):
+        '''date, RA, DEC, offsets of the tracklets, for gcm.GCMBATCH.'''
+        return self.time, self.ra, self.dec, self.tracklets()[1]
+
+    # Grouping by object & tracklet
+    # ----------------------------------------------------------
+
+    def _runs(self, column):
+        '''Ids & offsets of the runs of equal values of a column.'''
+        if column not in self._index:
+            ids = getattr(self, column)
+            if column == 'trkId':
+                # a tracklet id may be reused by different objects
+                change = ((ids[1:] != ids[:-1]) |
+                          (self.objId[1:] != self.objId[:-1]))
+            else:
+                change = ids[1:] != ids[:-1]
+            new = np.ones(len(ids), dtype=bool)
+            new[1:] = change
+            starts = np.flatnonzero(new)
+            offsets = np.append(starts, len(ids))
+            self._index[column] = (np.asarray(ids[starts]), offsets)
+        return self._index[column]
+
+    def objects(self):
+        '''
+        Object ids & offsets: the observations of the i-th object are
+        [offsets[i]:offsets[i+1]]. Each run of consecutive observations
+        of an object counts as one (see sort).
+        '''
+        return self._runs('objId')
+
+    def tracklets(self):
+        '''Tracklet ids & offsets, as for objects.'''
+        return self._runs('trkId')
+
+    def object(self, objId):
+        '''View of the observations of one object.'''
+        ids, offsets = self.objects()
+        i = np.flatnonzero(ids == np.asarray(objId, dtype='S16'))
+        if len(i) != 1:
+            raise KeyError(objId)
+        return self[offsets[i[0]]:offsets[i[0] + 1]]
+
+    def iterObjects(self):
+        '''Generator of (objId, view of its observations).'''
+        ids, offsets = self.objects()
+        for i, objId in enumerate(ids):
+            yield objId.decode(), self[offsets[i]:offsets[i + 1]]
+
+    def iterTracklets(self):
+        '''Generator of (trkId, view of its observations).'''
+        ids, offsets = self.tracklets()
+        for i, trkId in enumerate(ids):
+            yield trkId.decode(), self[offsets[i]:offsets[i + 1]]
+
+    # Archives on disk
+    # ----------------------------------------------------------
+
+    def save(self, path):
+        '''
+        Write an archive: a directory holding one .npy file per column,
+        and the object index.
+        '''
+        os.makedirs(path, exist_ok=True)
+        for c in self.COLUMNS:
+            np.save(os.path.join(path, c + '.npy'),
+                    np.ascontiguousarray(getattr(self, c)))
+        ids, offsets = self.objects()
+        np.save(os.path.join(path, 'index.objId.npy'), ids)
+        np.save(os.path.join(path, 'index.offsets.npy'), offsets)
+
+    @classmethod
+    def open(cls, path, mmap=True):
+        '''
+        Open an archive written by save
+
+        Parameters
+        ----------
+        path : str
+        mmap : bool
+            Memory map the columns (read-only), rather than reading
+            them into memory.
+        '''
+        mode = 'r' if mmap else None
+        obs = cls._fromColumns({c: np.load(os.path.join(path, c + '.npy'),
+                                           mmap_mode=mode)
+                                for c in cls.COLUMNS})
+        index = os.path.join(path, 'index.objId.npy')
+        if os.path.exists(index):
+            obs._index['objId'] = (
+                np.load(index),
+                np.load(os.path.join(path, 'index.offsets.npy')))
+        return obs
@@ -0,0 +1,263 @@
+# /mpcfit/mpcfit/observatories.py
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Observatory codes & the geocentric positions of observatories.
+#
+# The MPC's ObsCodes file gives, for each 3-character code, the
+# longitude & parallax constants (rho cos phi', rho sin phi', in
+# Earth radii) of the site. OBSCODES holds these as arrays, sorted
+# by code: codes become integer indices (by a binary search of all
+# of them at once), and the positions of any number of (index,
+# time) pairs are computed together. Sites not in the table (e.g.
+# roving observers) are placed by sitePositions, from their
+# geodetic coordinates (parallaxConstants).
+#
+# A site is rotated from the terrestrial frame by the Earth rotation
+# angle (IAU 2000) into the celestial intermediate frame, & from
+# there to the equator & equinox of J2000 by the CIP's X, Y: the
+# IAU 2006 precession to T^2, & the two largest terms of the
+# nutation (IAU 2000: 18.6 years, 17" in longitude, & half a year,
+# 1.3"). The nutation left out (~ 0.2", & < 1" at most) & polar
+# motion (< 0.6") move a site by up to ~ 50 m (3e-10 au).
+#
+# --------------------------------------------------------------
+"""
+
+
+# Import third-party packages
+# --------------------------------------------------------------
+import os
+
+import numpy as np
+
+
+# Constants
+# --------------------------------------------------------------
+
+AU_KM = 149597870.7
+'''The astronomical unit (km).'''
+
+EARTH_RADIUS_AU = 6378.137 / AU_KM
+'''Equatorial radius of the Earth (au).'''
+
+FLATTENING = 1 / 298.257223563
+'''Flattening of the Earth (WGS84).'''
+
+ERA_RATE = 1.00273781191135448
+'''Turns of the Earth per UT1 day.'''
+
+_MJD_J2000 = 51544.5
+_ARCSEC = np.pi / (180. * 3600.)
+_SIN_OBLIQUITY = np.sin(84381.406 * _ARCSEC)
+
+
+# Observatory table
+# --------------------------------------------------------------
+
+class OBSCODES:
+    '''
+    Observatory codes, sorted, with each site's constants
+
+    codes       :   ndarray of S3, shape (K,)
+    longitude   :   ndarray, shape (K,), radians east
+    rhoCos      :   ndarray, shape (K,), rho cos(phi'), Earth radii
+    rhoSin      :   ndarray, shape (K,), rho sin(phi'), Earth radii
+    names       :   list of str
+
+    Sites without constants (spacecraft, roving observers) have NaN.
+    '''
+
+    def __init__(self, codes, longitude, rhoCos, rhoSin, names=None):
+        codes = np.asarray(codes, dtype='S3')
+        order = np.argsort(codes, kind='stable')
+        self.codes = codes[order]
+        if len(np.unique(self.codes)) != len(self.codes):
+            raise ValueError('observatory codes must be unique')
+        self.longitude = np.radians(np.asarray(longitude, float)[order])
+        self.rhoCos = np.asarray(rhoCos, dtype=float)[order]
+        self.rhoSin = np.asarray(rhoSin, dtype=float)[order]
+        self.names = [''] * len(order) if names is None else \
+            [names[i] for i in order]
+
+    def __len__(self):
+        return len(self.codes)
+
+    @classmethod
+    def parse(cls, text):
+        '''
+        The table of an ObsCodes file's text (str or bytes): lines of
+        code, longitude (degrees), rho cos, rho sin & name, in
+        columns 1-3, 5-13, 14-21, 22-30 & 31-
+        '''
+        if isinstance(text, bytes):
+            text = text.decode('utf-8', 'replace')
+        rows = []
+        for line in text.splitlines():
+            code = line[:3]
+            if len(code) != 3 or code == 'Cod' or line.startswith('<') \
+                    or not code.strip():
+                continue
+            rows.append((code, _float(line[4:13]), _float(line[13:21]),
+                         _float(line[21:30]), line[30:].strip()))
+        if not rows:
+            raise ValueError('no observatory codes found')
+        codes, longitude, rhoCos, rhoSin, names = zip(*rows)
+        return cls(codes, longitude, rhoCos, rhoSin, names)
+
+    @classmethod
+    def fromFile(cls, path):
+        '''The table of an ObsCodes file (see also load).'''
+        with open(path, 'rb') as f:
+            return cls.parse(f.read())
+
+    def index(self, codes):
+        '''
+        Integer indices of observatory codes
+
+        Parameters
+        ----------
+        codes : array-like of str or bytes, shape (N,)
+
+        Returns
+        -------
+        ndarray of int, shape (N,)
+        '''
+        codes = np.asarray(codes).astype('S3')
+        i = np.minimum(np.searchsorted(self.codes, codes), len(self) - 1)
+        unknown = self.codes[i] != codes
+        if np.any(unknown):
+            raise ValueError('unknown observatory code(s): {}'.format(
+                b', '.join(np.unique(codes[unknown])).decode()))
+        return i
+
+    def geocentric(self, index, t_Vec, velocity=False, deltaT=0.):
+        '''
+        Geocentric positions of observatories at many times at once
+
+        Parameters
+        ----------
+        index       :   ndarray of int, shape (N,)
+            The observatory of each time (see index)
+        t_Vec       :   ndarray, shape (N,)
+            Times, MJD (TT)
+        velocity    :   bool
+            Whether to return velocities (au / day) too
+        deltaT      :   float or ndarray, shape (N,)
+            TT - UT1 (days), for the rotation of the Earth
+
+        Returns
+        -------
+        positions   :   ndarray, shape (N, 3)
+            Equatorial (J2000) positions relative to the geocentre (au)
+        velocities  :   ndarray, shape (N, 3); only if velocity
+        '''
+        index = np.asarray(index)
+        rhoCos, rhoSin = self.rhoCos[index], self.rhoSin[index]
+        if np.any(np.isnan(rhoCos)):
+            raise ValueError('no parallax constants for {}'.format(
+                b', '.join(np.unique(self.codes[index][np.isnan(rhoCos)]))
+                .decode()))
+        return sitePositions(self.longitude[index], rhoCos, rhoSin, t_Vec,
+                             velocity, deltaT)
+
+
+# Sites
+# --------------------------------------------------------------
+
+def parallaxConstants(latitude, altitude=0.):
+    '''
+    rho cos(phi') & rho sin(phi') (Earth radii) of geodetic
+    latitudes (degrees) & altitudes (m), on the WGS84 ellipsoid
+    '''
+    phi = np.radians(latitude)
+    c, s = np.cos(phi), np.sin(phi)
+    b2 = (1 - FLATTENING) ** 2
+    C = 1 / np.sqrt(c * c + b2 * s * s)
+    h = np.asarray(altitude, dtype=float) / (EARTH_RADIUS_AU * AU_KM * 1e3)
+    return (C + h) * c, (b2 * C + h) * s
+
+
+def sitePositions(longitude, rhoCos, rhoSin, t_Vec, velocity=False,
+                  deltaT=0.):
+    '''
+    Geocentric positions of sites on the Earth, each at its own time
+    (see OBSCODES.geocentric)
+
+    Parameters
+    ----------
+    longitude   :   ndarray, shape (N,), radians east
+    rhoCos, rhoSin : ndarray, shape (N,), Earth radii
+    t_Vec, velocity, deltaT :
+        As for OBSCODES.geocentric
+    '''
+    t_Vec = np.asarray(t_Vec, dtype=float)
+
+    # Earth rotation angle + longitude: the site's angle from the
+    # celestial intermediate origin
+    ut1 = t_Vec - deltaT - _MJD_J2000
+    angle = 2 * np.pi * np.remainder(
+        0.7790572732640 + 0.00273781191135448 * ut1 + ut1, 1.) + longitude
+    c, s = np.cos(angle), np.sin(angle)
+    radius = EARTH_RADIUS_AU * rhoCos
+    cirs = np.column_stack((radius * c, radius * s,
+                            EARTH_RADIUS_AU * rhoSin))
+    Q = _precessionNutation(t_Vec)
+    positions = np.einsum('nij,nj->ni', Q, cirs)
+    if not velocity:
+        return positions
+    omega = 2 * np.pi * ERA_RATE
+    dcirs = np.column_stack((-omega * radius * s, omega * radius * c,
+                             np.zeros(len(t_Vec))))
+    return positions, np.einsum('nij,nj->ni', Q, dcirs)
+
+
+def _float(field):
+    '''A number, or NaN for a blank field.'''
+    field = field.strip()
+    return float(field) if field else np.nan
+
+
+def _precessionNutation(t_Vec):
+    '''
+    Matrices from the celestial intermediate frame to J2000, shape
+    (N, 3, 3), from the CIP's X & Y (IAU 2006 precession to T^2, &
+    the leading terms of the IAU 2000 nutation)
+    '''
+    T = (t_Vec - _MJD_J2000) / 36525.
+    X = -0.016617 + T * (2004.191898 - 0.4297829 * T)
+    Y = -0.006951 + T * (-0.025896 - 22.4072747 * T)
+
+    # nutation in longitude & obliquity, from the Moon's node (Omega)
+    # & twice the Sun's mean longitude (2 (F - D + Omega))
+    node = (450160.398036 - 6962890.5431 * T) * _ARCSEC
+    sun = 2 * node + 2 * (-736481.177460 + 136565661.6388 * T) * _ARCSEC
+    dPsi = -17.2064161 * np.sin(node) - 1.3170906 * np.sin(sun)
+    dEps = 9.2052331 * np.cos(node) + 0.5730336 * np.cos(sun)
+    X = (X + dPsi * _SIN_OBLIQUITY) * _ARCSEC
+    Y = (Y + dEps) * _ARCSEC
+    a = 0.5 + (X * X + Y * Y) / 8
+    Q = np.empty((len(T), 3, 3))
+    Q[:, 0, 0], Q[:, 0, 1], Q[:, 0, 2] = 1 - a * X * X, -a * X * Y, X
+    Q[:, 1, 0], Q[:, 1, 1], Q[:, 1, 2] = -a * X * Y, 1 - a * Y * Y, Y
+    Q[:, 2, 0], Q[:, 2, 1], Q[:, 2, 2] = -X, -Y, 1 - a * (X * X + Y * Y)
+    return Q
+
+
+# Open tables
+# --------------------------------------------------------------
+
+_OPEN = {}
+
+
+def load(path):
+    '''
+    The OBSCODES of the ObsCodes file path, read on the first call
+    only: later calls return the same table.
+    '''
+    key = os.path.realpath(path)
+    if key not in _OPEN:
+        _OPEN[key] = OBSCODES.fromFile(path)
+    return _OPEN[key]
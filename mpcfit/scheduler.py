@@ -0,0 +1,154 @@
+# /mpcfit/mpcfit/scheduler.py
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Run many orbit fits (mpcfit.FIT) across a pool of processes.
+#
+# Fit times vary by orders of magnitude between objects, so:
+# - jobs are started longest-first, using the number of
+#   observations as the cost estimate, so that the slowest
+#   objects don't start last & leave the other workers idle;
+# - workers take the next job as soon as they are free;
+# - each fit has a wall-clock time limit;
+# - results are yielded as soon as each fit finishes.
+#
+# --------------------------------------------------------------
+"""
+
+
+# Import third-party packages
+# --------------------------------------------------------------
+import collections
+import concurrent.futures
+import contextlib
+import os
+import signal
+import threading
+import time
+import traceback
+
+# Import neighboring packages
+# --------------------------------------------------------------
+from mpcfit import mpcfit
+
+
+# Scheduling functions
+# --------------------------------------------------------------
+
+Job = collections.namedtuple(
+    'Job', ['objId', 'x_Vec', 't_Vec', 'd_Vec', 'params'])
+'''One object to fit: an identifier & the arguments of FIT's fitters.
+params (including any advance function) must be picklable to be
+sent to other processes.'''
+
+Result = collections.namedtuple(
+    'Result', ['objId', 'fit', 'status', 'seconds'])
+'''Outcome of one Job. status is 'ok', 'timeout' or 'error: ...';
+fit is the ORBIT_FIT if status is 'ok', else None.'''
+
+
+class Timeout(Exception):
+    '''Raised inside a fit that runs past its time limit.'''
+
+
+@contextlib.contextmanager
+def _timeLimit(seconds):
+    '''Raise Timeout in the block after seconds of wall-clock time.
+
+    Uses SIGALRM, so is only enforced on platforms that have it, and in
+    a process's main thread (where pool workers run their jobs).
+    '''
+    if (not seconds or not hasattr(signal, 'SIGALRM') or
+            threading.current_thread() is not threading.main_thread()):
+        yield
+        return
+
+    def handler(signum, frame):
+        raise Timeout()
+    previous = signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _fitOne(job, method, timeout, fitKwargs):
+    '''Fit one Job, catching timeouts & errors. Runs in the workers.'''
+    start = time.perf_counter()
+    try:
+        with _timeLimit(timeout):
+            fitter = getattr(mpcfit.FIT(), 'get_best_fit_' + method)
+            fit = fitter(job.x_Vec, job.t_Vec, job.d_Vec, job.params,
+                         **fitKwargs)
+        status = 'ok'
+    except Timeout:
+        fit, status = None, 'timeout'
+    except Exception as e:
+        fit = None
+        status = 'error: ' + (traceback.format_exception_only(
+            type(e), e)[-1].strip())
+    return Result(job.objId, fit, status, time.perf_counter() - start)
+
+
+def cost(job):
+    '''Estimated cost of a Job: its number of observations.'''
+    return len(job.t_Vec)
+
+
+def refit(jobs, nWorkers=None, timeout=None, method='EXPLICIT', **fitKwargs):
+    '''Fit many objects, longest first, yielding results as they finish.
+
+    Parameters
+    ----------
+    jobs : iterable of Job
+    nWorkers : int or None
+        Number of processes; None for one per CPU. With 1 the fits run
+        in this process, one after another.
+    timeout : float or None
+        Wall-clock limit (seconds) for each fit. Fits that exceed it
+        are abandoned and reported with status 'timeout'.
+    method : str
+        Which fitter of FIT to use: 'EXPLICIT' for get_best_fit_EXPLICIT,
+        etc.
+    **fitKwargs
+        Passed to the fitter, e.g. maxIter, tol.
+
+    Returns
+    -------
+    generator of Result
+        One per job, in the order they finish.
+    '''
+    jobs = sorted(jobs, key=cost, reverse=True)
+    nWorkers = os.cpu_count() if nWorkers is None else nWorkers
+    if nWorkers < 1:
+        raise ValueError('nWorkers must be at least one')
+
+    if nWorkers == 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield _fitOne(job, method, timeout, fitKwargs)
+        return
+
+    # Keep a few jobs per worker queued, so that a free worker never
+    # waits, while jobs (& their arrays) aren't all pickled up front.
+    pending = iter(jobs)
+    with concurrent.futures.ProcessPoolExecutor(nWorkers) as pool:
+        running = set()
+        for job in pending:
+            running.add(pool.submit(_fitOne, job, method, timeout,
+                                    fitKwargs))
+            if len(running) >= 2 * nWorkers:
+                break
+        while running:
+            done, running = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for job in pending:
+                running.add(pool.submit(_fitOne, job, method, timeout,
+                                        fitKwargs))
+                if len(running) >= 2 * nWorkers:
+                    break
+            for f in done:
+                yield f.result()
@@ -29,6 +29,241 @@ import collections
 #import mpcutilities.phys_const as PHYS
 
 
+#Constants
+#--------------------------------------------------------------
+
+GM_SUN = 0.01720209895 ** 2
+'''Heliocentric gravitational constant, k^2, in au^3 / day^2.'''
+
+OBLIQUITY = np.radians(84381.448 / 3600.)
+'''Obliquity of the ecliptic at J2000 (IAU 1976), in radians.'''
+
+SINGULAR = 1e-10
+'''e or sin(i) below which the angles of an orbit are undefined.'''
+
+
+#Element & frame transformations
+#--------------------------------------------------------------
+#
+# Elements are handled as rows of 6 numbers, for N objects at once:
+#  Keplerian : a, e, i, Omega, omega, M
+#  Cometary  : q, e, i, Omega, omega, tp
+# Angles are in radians, a & q in au, tp in days.
+# Hyperbolic orbits (e > 1) have a < 0, and M is then the hyperbolic
+# mean anomaly, e sinh(H) - H. Exactly parabolic orbits aren't handled.
+#
+# Jacobians are analytic: that of elements -> Cartesian is written out
+# below, and the inverse transform's is its matrix inverse. That is
+# singular where angles are undefined (circular or equatorial orbits):
+# those objects get NaN Jacobians, and the others are still inverted.
+
+def _rows(x, k):
+    '''x as a 2D (N, k) float array, and the leading shape of x.'''
+    x = np.asarray(x, dtype=float)
+    if x.shape[-1:] != (k,):
+        raise ValueError('last dimension must have length {}'.format(k))
+    return x.reshape(-1, k), x.shape[:-1]
+
+
+def _kepler(e, M):
+    '''
+    Solve Kepler's equation by Newton's method, for all objects at once.
+
+    Returns the eccentric anomaly E (e < 1, from E - e sin E = M),
+    or the hyperbolic anomaly H (e > 1, from e sinh H - H = M).
+    '''
+    E = np.empty_like(M)
+    ell = e < 1
+
+    # Elliptic: M reduced to [-pi, pi); start near pi for high e
+    m, ee = np.remainder(M[ell] + np.pi, 2 * np.pi) - np.pi, e[ell]
+    x = np.where(ee < 0.8, m, m + 0.85 * ee * np.sign(np.sin(m)))
+    for _ in range(50):
+        dx = (x - ee * np.sin(x) - m) / (1 - ee * np.cos(x))
+        x -= dx
+        if np.all(np.abs(dx) <= 1e-14):
+            break
+    E[ell] = x
+
+    # Hyperbolic
+    m, ee = M[~ell], e[~ell]
+    x = np.sign(m) * np.log(2 * np.abs(m) / ee + 1.8)
+    for _ in range(100):
+        dx = (ee * np.sinh(x) - x - m) / (ee * np.cosh(x) - 1)
+        x -= dx
+        if np.all(np.abs(dx) <= 1e-14 * np.maximum(1, np.abs(x))):
+            break
+    E[~ell] = x
+    return E
+
+
+def _orientation(inc, node, peri):
+    '''
+    Unit vectors P (to perihelion) & Q (90 degrees ahead of it, in the
+    orbital plane), and their derivatives w.r.t. (i, Omega, omega).
+
+    Returns
+    -------
+    P, Q : ndarrays, shape (N, 3)
+    dP, dQ : ndarrays, shape (3, N, 3)
+    '''
+    ci, si = np.cos(inc), np.sin(inc)
+    cn, sn = np.cos(node), np.sin(node)
+    cp, sp = np.cos(peri), np.sin(peri)
+    zero = np.zeros_like(inc)
+    P = np.stack((cn * cp - sn * sp * ci, sn * cp + cn * sp * ci, sp * si), -1)
+    Q = np.stack((-cn * sp - sn * cp * ci, -sn * sp + cn * cp * ci, cp * si),
+                 -1)
+    dP = np.stack((
+        np.stack((sn * sp * si, -cn * sp * si, sp * ci), -1),
+        np.stack((-P[:, 1], P[:, 0], zero), -1),
+        Q))
+    dQ = np.stack((
+        np.stack((sn * cp * si, -cn * cp * si, cp * ci), -1),
+        np.stack((-Q[:, 1], Q[:, 0], zero), -1),
+        -P))
+    return P, Q, dP, dQ
+
+
+def _keplerianToCartesian(el, mu, jacobian=True):
+    '''Cartesian states (N, 6) & Jacobians (N, 6, 6), or None if not
+    jacobian, from Keplerian elements (N, 6).
+    See TRANSFORMS.keplerianToCartesian.'''
+    a, e, inc, node, peri, M = el.T
+    if np.any(e < 0) or np.any(e == 1):
+        raise ValueError('eccentricity must be >= 0 and not 1')
+    if np.any((a > 0) != (e < 1)):
+        raise ValueError('need a > 0 for e < 1 and a < 0 for e > 1')
+
+    # Position & velocity in the orbital plane. sg switches between the
+    # elliptic (cos, sin of E) and hyperbolic (cosh, sinh of H) forms.
+    ell = e < 1
+    sg = np.where(ell, 1., -1.)
+    E = _kepler(e, M)
+    c = np.where(ell, np.cos(E), np.cosh(E))
+    s = np.where(ell, np.sin(E), np.sinh(E))
+    b = np.sqrt(np.abs(1 - e * e))
+    D = sg * (1 - e * c)            # dM/dE
+    k = np.sqrt(mu / np.abs(a))     # n |a|
+    x, y = a * (c - e), sg * a * b * s
+    vx, vy = -k * s / D, k * b * c / D
+
+    P, Q, dP, dQ = _orientation(inc, node, peri)
+    state = np.empty((len(a), 6))
+    state[:, :3] = x[:, None] * P + y[:, None] * Q
+    state[:, 3:] = vx[:, None] * P + vy[:, None] * Q
+    if not jacobian:
+        return state, None
+
+    # Partial derivatives at fixed anomaly ...
+    dx = dict(a=c - e, e=-a, E=-sg * a * s)
+    dy = dict(a=sg * b * s, e=-a * e * s / b, E=sg * a * b * c)
+    dvx = dict(a=-vx / (2 * a), e=-sg * k * s * c / D**2,
+               E=-sg * k * (c - e) / D**2)
+    dvy = dict(a=-vy / (2 * a), e=sg * k * c * (b * c / D**2 - e / (b * D)),
+               E=-k * b * s / D**2)
+    # ... & with the anomaly's dependence on e and M
+    dEde, dEdM = sg * s / D, 1 / D
+    for d in (dx, dy, dvx, dvy):
+        d['e'] = d['e'] + d['E'] * dEde
+        d['M'] = d['E'] * dEdM
+
+    jac = np.empty((len(a), 6, 6))
+    for j, p in ((0, 'a'), (1, 'e'), (5, 'M')):
+        jac[:, :3, j] = dx[p][:, None] * P + dy[p][:, None] * Q
+        jac[:, 3:, j] = dvx[p][:, None] * P + dvy[p][:, None] * Q
+    for j in range(3):
+        jac[:, :3, 2 + j] = x[:, None] * dP[j] + y[:, None] * dQ[j]
+        jac[:, 3:, 2 + j] = vx[:, None] * dP[j] + vy[:, None] * dQ[j]
+    return state, jac
+
+
+def _cartesianToKeplerian(state, mu):
+    '''Keplerian elements (N, 6) from Cartesian states (N, 6).'''
+    r, v = state[:, :3], state[:, 3:]
+    rn = np.linalg.norm(r, axis=1)
+    h = np.cross(r, v)
+    hn = np.linalg.norm(h, axis=1)
+    hxy = np.hypot(h[:, 0], h[:, 1])
+
+    inc = np.arctan2(hxy, h[:, 2])
+    # The node is undefined for equatorial orbits: take Omega = 0
+    node = np.where(hxy > 0, np.arctan2(h[:, 0], -h[:, 1]), 0.)
+    nhat = np.stack((np.cos(node), np.sin(node), np.zeros_like(node)), -1)
+    mhat = np.cross(h / hn[:, None], nhat)
+
+    evec = np.cross(v, h) / mu - r / rn[:, None]
+    e = np.linalg.norm(evec, axis=1)
+    a = 1 / (2 / rn - np.einsum('ij,ij->i', v, v) / mu)
+    if np.any(e == 1):
+        raise ValueError('parabolic orbits (e = 1) are not supported')
+
+    # Perihelion (taken at the node for circular orbits) & true anomaly
+    peri = np.arctan2(np.einsum('ij,ij->i', evec, mhat),
+                      np.einsum('ij,ij->i', evec, nhat))
+    u = np.arctan2(np.einsum('ij,ij->i', r, mhat),
+                   np.einsum('ij,ij->i', r, nhat))
+    nu = u - peri
+    cnu, snu = np.cos(nu), np.sin(nu)
+
+    b = np.sqrt(np.abs(1 - e * e))
+    E = np.where(e < 1, np.arctan2(b * snu, e + cnu),
+                 np.arcsinh(b * snu / (1 + e * cnu)))
+    M = np.where(e < 1, E - e * np.sin(E), e * np.sinh(E) - E)
+
+    twopi = 2 * np.pi
+    return np.stack((a, e, inc, np.remainder(node, twopi),
+                     np.remainder(peri, twopi),
+                     np.where(e < 1, np.remainder(M, twopi), M)), -1)
+
+
+def _cometaryToKeplerian(el, epoch, mu):
+    '''Keplerian elements (N, 6) & the Jacobian d(Keplerian) / d(cometary)
+    (N, 6, 6) from cometary elements (N, 6) at epoch(s) epoch.'''
+    q, e, tp = el[:, 0], el[:, 1], el[:, 5]
+    if np.any(e == 1):
+        raise ValueError('parabolic orbits (e = 1) are not supported')
+    a = q / (1 - e)
+    n = np.sqrt(mu / np.abs(a)**3)
+    M = n * (epoch - tp)
+
+    kep = el.copy()
+    kep[:, 0], kep[:, 5] = a, M
+    jac = np.zeros((len(q), 6, 6))
+    jac[:, range(6), range(6)] = 1.
+    jac[:, 0, 0], jac[:, 0, 1] = 1 / (1 - e), a / (1 - e)
+    jac[:, 5, 0] = -1.5 * M / a * jac[:, 0, 0]
+    jac[:, 5, 1] = -1.5 * M / a * jac[:, 0, 1]
+    jac[:, 5, 5] = -n
+    return kep, jac
+
+
+def _inverse(jac, el):
+    '''Inverses of Jacobians (N, 6, 6) d(state) / d(elements), NaN for
+    the objects whose elements el (N, 6) are singular.'''
+    out = np.full_like(jac, np.nan)
+    ok = np.flatnonzero((el[:, 1] >= SINGULAR) &
+                        (np.abs(np.sin(el[:, 2])) >= SINGULAR))
+    try:
+        out[ok] = np.linalg.inv(jac[ok])
+    except np.linalg.LinAlgError:
+        # one at a time, to find those that are singular numerically
+        for i in ok:
+            try:
+                out[i] = np.linalg.inv(jac[i])
+            except np.linalg.LinAlgError:
+                pass
+    return out
+
+
+def _eclipticRotation(k, sign):
+    '''(k, k) rotation from equatorial to ecliptic (sign=1) or back
+    (sign=-1), for k = 3 (positions) or 6 (states).'''
+    c, s = np.cos(OBLIQUITY), sign * np.sin(OBLIQUITY)
+    R = np.array([[1, 0, 0], [0, c, s], [0, -s, c]])
+    return R if k == 3 else np.kron(np.eye(2), R)
+
+
 #Fitting functions & classes
 #--------------------------------------------------------------
 
@@ -47,7 +282,7 @@ class TRANSFORMS:
         self.inputCov =np.array( [ [1,2,3,4], [5,6,7,8], [9,10,11,12] ,[13,14,15,16] ])
         self.partial  =np.array( [ [1,2,], [3,4], [5,6] , [7,8]])
 
-    def covarianceRemap(self, inputCov, partial):
+    def covarianceRemap(self, inputCov, partial, out=None):
         '''
         Remap covariance matrix from one basis to another, using
         the partial deriv matrix 
@@ -59,27 +294,38 @@ class TRANSFORMS:
         Compare to Bernstein orbit/orbfit1.c/covar_map
         
         kin = dimension on input, kout = dimension on output.
-                
+
+        Stacks of matrices are remapped in one pass: leading dimensions
+        broadcast, so e.g. N covariances can share one partial matrix.
+        The result is symmetrised, so round-off can't make it asymmetric.
+
+        Parameters
+        ----------
+        inputCov    :   ndarray, shape (kin, kin) or (N, kin, kin)
+        partial     :   ndarray, shape (kout, kin) or (N, kout, kin)
+        out         :   ndarray, shape (kout, kout) or (N, kout, kout), optional
+            Buffer for the result.
+
+        Returns
+        -------
+        outputCov   :   ndarray, shape (kout, kout) or (N, kout, kout)
         '''
 
         # Need to have numpy arrays / matricees
         assert isinstance(inputCov, np.ndarray)
         assert isinstance(partial, np.ndarray)
-        
+        assert inputCov.shape[-1] == inputCov.shape[-2] == partial.shape[-1]
+
         # Do the matrix multiplication in the correct order
-        print("inputCov", inputCov)
-        print("partial", partial)
-        pT = np.transpose(partial)
-        print("pT",pT )
-        tmp = np.matmul(inputCov, pT)
-        print("tmp", tmp)
-        outputCov = np.matmul(partial, tmp)
-        print("outputCov", outputCov)
-        
-        
+        tmp = np.matmul(inputCov, np.swapaxes(partial, -1, -2))
+        outputCov = np.matmul(partial, tmp, out=out)
+
+        # Symmetrise: (G + G^T) / 2
+        outputCov += np.swapaxes(outputCov, -1, -2)
+        outputCov *= 0.5
+
         # Check on mat-mult calc:
         '''
-        for i in range(
         for (i=1; i<=kout; i++)
         for (j=1; j<=kout; j++) {
                 sum = 0.;
@@ -90,7 +336,136 @@ class TRANSFORMS:
                 }
         '''
 
-        
         return outputCov
 
+    def keplerianToCartesian(self, elements, mu=GM_SUN):
+        '''
+        Cartesian states from Keplerian elements, for many objects at once
+
+        Parameters
+        ----------
+        elements    :   ndarray, shape (6,) or (N, 6)
+            a, e, i, Omega, omega, M (see module notes for hyperbolic orbits)
+        mu          :   float
+            Gravitational parameter, in units consistent with a & time
+            (default GM_SUN: au & days)
+
+        Returns
+        -------
+        state       :   ndarray, shape (6,) or (N, 6)
+            x, y, z, vx, vy, vz, in the frame the angles refer to
+        jacobian    :   ndarray, shape (6, 6) or (N, 6, 6)
+            d(state) / d(elements)
+        '''
+        el, shape = _rows(elements, 6)
+        state, jac = _keplerianToCartesian(el, mu)
+        return state.reshape(shape + (6,)), jac.reshape(shape + (6, 6))
+
+    def cartesianToKeplerian(self, state, mu=GM_SUN):
+        '''
+        Keplerian elements from Cartesian states, for many objects at once
+
+        The Jacobian is NaN for the objects whose elements are
+        undefined (circular or equatorial orbits; see SINGULAR).
+
+        Parameters
+        ----------
+        state       :   ndarray, shape (6,) or (N, 6)
+        mu          :   float
+
+        Returns
+        -------
+        elements    :   ndarray, shape (6,) or (N, 6)
+            Angles in [0, 2 pi), except the hyperbolic mean anomaly
+        jacobian    :   ndarray, shape (6, 6) or (N, 6, 6)
+            d(elements) / d(state)
+        '''
+        st, shape = _rows(state, 6)
+        el = _cartesianToKeplerian(st, mu)
+        jac = _inverse(_keplerianToCartesian(el, mu)[1], el)
+        return el.reshape(shape + (6,)), jac.reshape(shape + (6, 6))
+
+    def cometaryToCartesian(self, elements, epoch, mu=GM_SUN):
+        '''
+        Cartesian states at epoch from cometary elements
+
+        Parameters
+        ----------
+        elements    :   ndarray, shape (6,) or (N, 6)
+            q, e, i, Omega, omega, tp
+        epoch       :   float or ndarray, shape (N,)
+            Time of the states, on the same scale as tp
+        mu          :   float
+
+        Returns
+        -------
+        state       :   ndarray, shape (6,) or (N, 6)
+        jacobian    :   ndarray, shape (6, 6) or (N, 6, 6)
+            d(state) / d(elements)
+        '''
+        el, shape = _rows(elements, 6)
+        kep, dkep = _cometaryToKeplerian(el, np.ravel(epoch), mu)
+        state, jac = _keplerianToCartesian(kep, mu)
+        jac = np.matmul(jac, dkep)
+        return state.reshape(shape + (6,)), jac.reshape(shape + (6, 6))
+
+    def cartesianToCometary(self, state, epoch, mu=GM_SUN):
+        '''
+        Cometary elements from Cartesian states at epoch
+
+        Parameters
+        ----------
+        state       :   ndarray, shape (6,) or (N, 6)
+        epoch       :   float or ndarray, shape (N,)
+        mu          :   float
+
+        Returns
+        -------
+        elements    :   ndarray, shape (6,) or (N, 6)
+            q, e, i, Omega, omega, tp; tp is the perihelion nearest epoch
+        jacobian    :   ndarray, shape (6, 6) or (N, 6, 6)
+            d(elements) / d(state); NaN where the elements are
+            undefined, as for cartesianToKeplerian
+        '''
+        st, shape = _rows(state, 6)
+        kep = _cartesianToKeplerian(st, mu)
+        a, e, M = kep[:, 0], kep[:, 1], kep[:, 5]
+        M = np.where(e < 1, np.remainder(M + np.pi, 2 * np.pi) - np.pi, M)
+        el = kep.copy()
+        el[:, 0] = a * (1 - e)
+        el[:, 5] = epoch - M / np.sqrt(mu / np.abs(a)**3)
+        jac = self.cometaryToCartesian(el, epoch, mu)[1]
+        return el.reshape(shape + (6,)), \
+            _inverse(jac, el).reshape(shape + (6, 6))
+
+    def equatorialToEcliptic(self, x):
+        '''
+        Rotate positions or states from the equatorial to the ecliptic
+        frame (J2000)
+
+        Parameters
+        ----------
+        x           :   ndarray, shape (..., 3) or (..., 6)
+
+        Returns
+        -------
+        y           :   ndarray, same shape as x
+        jacobian    :   ndarray, shape (..., k, k)
+            dy / dx; a read-only broadcast of one rotation matrix
+        '''
+        return self._rotate(x, 1)
+
+    def eclipticToEquatorial(self, x):
+        '''
+        Rotate positions or states from the ecliptic to the equatorial
+        frame (J2000). Inverse of equatorialToEcliptic.
+        '''
+        return self._rotate(x, -1)
 
+    def _rotate(self, x, sign):
+        x = np.asarray(x, dtype=float)
+        k = x.shape[-1]
+        if k not in (3, 6):
+            raise ValueError('last dimension must have length 3 or 6')
+        R = _eclipticRotation(k, sign)
+        return np.matmul(x, R.T), np.broadcast_to(R, x.shape[:-1] + (k, k))
@@ -28,22 +28,28 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
         'Natural Language :: English',
-        "Programming Language :: Python :: 2",
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
+    entry_points={
+        'console_scripts': [
+            'mpcfit-gcmscreen=mpcfit.gcmscreen:main',
+        ],
+    },
     description="MPC Fit contains all the boilerplate you need \
 to create a Python package for the MPC",
     install_requires=requirements,
+    extras_require={'scipy': ['scipy']},
     license="MIT license",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
     keywords='mpcfit',
     name='mpcfit',
     packages=find_packages(include=['mpcfit']),
+    python_requires='>=3.8',
     setup_requires=setup_requirements,
     test_suite='tests',
     tests_require=test_requirements,
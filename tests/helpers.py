@@ -0,0 +1,113 @@
+# /mpcfit/tests/helpers.py
+
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Test data shared by the tests of several modules
+# - Orbits & their observations
+# - Two-body planets, tabulated for ephemeris stores
+# - MPC 80-column records
+#
+# --------------------------------------------------------------
+"""
+
+# Import third-party packages
+# --------------------------------------------------------------
+import numpy as np
+
+# Import the packages the data are made with
+# --------------------------------------------------------------
+from mpcfit import ephemeris
+from mpcfit import kepler
+from mpcfit import mpcfit
+from mpcfit import transformations
+
+
+# Orbits & observations
+# ----------------------------------------------------------
+
+def make_observations(n, seed=0, noise=0., elements=(2.5, 0.15, 0.2, 1., 2.,
+                                                     3.)):
+    '''An elliptic orbit observed n times from a circular Earth orbit.'''
+    rng = np.random.RandomState(seed)
+    T = transformations.TRANSFORMS()
+    x = T.keplerianToCartesian(elements)[0]
+    epoch = 58000.
+    t = epoch + np.sort(rng.uniform(-100, 100, n))
+    lon = 2 * np.pi * (t - epoch) / 365.25
+    observer = T.eclipticToEquatorial(np.column_stack(
+        (np.cos(lon), np.sin(lon), np.zeros(n))))[0]
+    rho = kepler.advance(x, epoch, t)[:, :3] - observer
+    d = np.column_stack((np.arctan2(rho[:, 1], rho[:, 0]),
+                         np.arcsin(rho[:, 2] / np.linalg.norm(rho, axis=1))))
+    d += rng.normal(0, noise, d.shape)
+    return x, dict(epoch=epoch, observer=observer), t, d
+
+
+def predict(x, t, params):
+    '''
+    RA, Dec (N, 2) of x at times t, as FIT computes them with params:
+    the residuals of observations at RA = Dec = 0 are minus these.
+    '''
+    nu = mpcfit.FIT().get_residuals(x, t, np.zeros((len(t), 2)), params)
+    return -nu / mpcfit.RAD_TO_ARCSEC
+
+
+# Planets
+# ----------------------------------------------------------
+
+ELEMENTS = {'earth': [1.0, 0.0167, 0.409, 0., 1.8, 0.],
+            'jupiter': [5.2, 0.048, 0.4, 1.7, 0.3, 0.3]}
+
+
+def planets(t, epoch=57800.):
+    '''Two-body states of the ELEMENTS bodies, shape (2, N, 6).'''
+    x = transformations.TRANSFORMS().keplerianToCartesian(
+        list(ELEMENTS.values()))[0]
+    return np.stack([kepler.advance(xi, epoch, t) for xi in x])
+
+
+def table(start=57800., end=58200.):
+    '''Half-daily positions of the ELEMENTS bodies.'''
+    t = np.arange(start, end + 0.25, 0.5)
+    return t, planets(t)[..., :3]
+
+
+def store(start=57800., end=58200.):
+    '''An ephemeris store of the ELEMENTS bodies.'''
+    return ephemeris.EPHEMERIS.fromTable(*table(start, end),
+                                         names=list(ELEMENTS))
+
+
+# MPC records
+# ----------------------------------------------------------
+
+def mpc80(num, prov, note2, date, ra, dec, code):
+    '''One 80-column record.'''
+    line = '{:5s}{:7s}  {:1s}{:17s}{:12s}{:12s}         20.5 V      {:3s}'\
+        .format(num, prov, note2, date, ra, dec, code)
+    assert len(line) == 80
+    return line
+
+
+def mpc80Second(first, note2, text):
+    '''The second line of a two-line record, with columns 33-77 text.'''
+    line = first[:14] + note2 + first[15:32] + '{:45s}'.format(text) + \
+        first[77:]
+    assert len(line) == 80
+    return line
+
+
+def records(objects, nobs, shift=0.):
+    '''MPC80 records of objects, nobs each.'''
+    lines = []
+    for num in objects:
+        for j in range(nobs):
+            s = 10 + j + shift + int(num)
+            lines.append(mpc80(num, '', 'C',
+                               '2014 01 {:08.5f} '.format(1 + 0.01 * j),
+                               '01 02 {:06.3f}'.format(s),
+                               '-04 05 {:05.2f}'.format(s), 'F51'))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,117 @@
+# /mpcfit/tests/test_cache.py
+
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Test the functions in /mpcfit/mpcfit/cache.py
+# - On-disk cache of observations & fits
+#
+# --------------------------------------------------------------
+"""
+
+# Import third-party packages
+# --------------------------------------------------------------
+import numpy as np
+import pytest
+
+# Import the specific package/module/function we are testing
+# --------------------------------------------------------------
+from mpcfit import cache
+from mpcfit import ingest
+from mpcfit import mpcfit
+from helpers import records
+
+
+# Test data & fitter
+# ----------------------------------------------------------
+
+class FITTER:
+    '''Stand-in fitter, recording what it is asked to fit.'''
+
+    def __init__(self):
+        self.fitted = []
+
+    def __call__(self, objId, obs, previous):
+        self.fitted.append((objId, len(obs), previous is not None))
+        orbit = mpcfit.ORBIT_FIT()
+        orbit.xBest_Vec = np.full(6, len(self.fitted), dtype=float)
+        orbit.G_Mat = np.eye(6)
+        orbit.nu_Vec = np.column_stack((obs.ra, obs.dec))
+        orbit.Q_Mat, orbit.converged = 1., True
+        return orbit, obs.time[0]
+
+
+# Tests of the cache
+# ----------------------------------------------------------
+
+def test_update(tmpdir):
+    path = str(tmpdir.join('cache'))
+    obs = ingest.parseMPC80(records(['00001', '00002', '00003'], 4).encode())
+    fitter = FITTER()
+    c = cache.CACHE(path)
+    assert len(c) == 0 and '00001' not in c
+    assert c.update(obs, fitter) == ['00001', '00002', '00003']
+
+    # reopened: everything comes from the (memory mapped) cache
+    c = cache.CACHE(path)
+    assert len(c) == 3 and '00002' in c
+    view, orbit = c.get('00002')
+    assert isinstance(view.ra, np.memmap) and isinstance(orbit.nu_Vec,
+                                                         np.memmap)
+    assert np.array_equal(view.time, obs.object('00002').time)
+    assert np.array_equal(orbit.nu_Vec[:, 0], view.ra)
+    assert np.all(orbit.xBest_Vec == 2) and orbit.converged
+    assert orbit.rms == pytest.approx(
+        np.sqrt(np.mean(np.concatenate((view.ra, view.dec))**2)))
+    assert orbit.epoch == view.time[0]
+    assert c.update(obs, fitter) == []
+
+    # one object changed, one added: only those are fitted, the
+    # changed one with its previous fit
+    fitter.fitted = []
+    changed = ingest.parseMPC80(
+        (records(['00001'], 4) + records(['00002'], 5) +
+         records(['00004'], 2)).encode())
+    assert c.update(changed, fitter) == ['00002', '00004']
+    assert fitter.fitted == [('00002', 5, True), ('00004', 2, False)]
+    assert len(c) == 4
+    assert len(c.get('00002')[0]) == 5 and len(c.get('00003')[0]) == 4
+    assert np.array_equal(c.get('00003')[0].ra, obs.object('00003').ra)
+
+    with pytest.raises(ValueError):
+        c.update(changed[[0, 5, 1]], fitter)
+    with pytest.raises(KeyError):
+        c.get('00009')
+
+
+def test_updateFile(tmpdir, monkeypatch):
+    path = str(tmpdir.join('cache'))
+    source = tmpdir.join('obs.txt')
+    source.write(records(['00001', '00002', '00003'], 40))
+
+    # count the records that are decoded
+    parsed = []
+    parse = ingest.parseMPC80
+
+    def counting(data, *args):
+        obs = parse(data, *args)
+        parsed.append(len(obs))
+        return obs
+    monkeypatch.setattr(ingest, 'parseMPC80', counting)
+
+    fitter = FITTER()
+    c = cache.CACHE(path)
+    # small chunks, so that objects straddle chunks
+    assert c.updateFile(str(source), fitter, chunkSize=1000) == \
+        ['00001', '00002', '00003']
+    assert parsed == [120]
+
+    assert cache.CACHE(path).updateFile(str(source), fitter) == []
+    assert parsed == [120, 0]
+
+    source.write(records(['00001'], 40) + records(['00002'], 40, 0.5) +
+                 records(['00003'], 40))
+    assert cache.CACHE(path).updateFile(str(source), fitter) == ['00002']
+    assert parsed == [120, 0, 40]
@@ -0,0 +1,95 @@
+# /mpcfit/tests/test_ephemeris.py
+
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Test the functions in /mpcfit/mpcfit/ephemeris.py
+# - Chebyshev ephemeris stores
+#
+# --------------------------------------------------------------
+"""
+
+# Import third-party packages
+# --------------------------------------------------------------
+import numpy as np
+import pytest
+
+# Import the specific package/module/function we are testing
+# --------------------------------------------------------------
+from mpcfit import ephemeris
+from mpcfit import mpcfit
+from helpers import ELEMENTS, make_observations, planets, store, table
+
+
+# Tests of the store
+# ----------------------------------------------------------
+
+def test_fromTable():
+    t, positions = table()
+    ephem = ephemeris.EPHEMERIS.fromTable(t, positions, list(ELEMENTS))
+    assert ephem.coef.shape == (2, 50, 3, 13)
+    assert ephem.start == t[0] and ephem.end == t[-1]
+
+    # arbitrary times, also segment ends
+    times = np.concatenate((np.random.RandomState(1).uniform(
+        t[0], t[-1], 500), [t[0], t[0] + 8., t[-1]]))
+    truth = planets(times)
+    p, v = ephem.evaluate(times, velocity=True)
+    assert np.allclose(p, truth[..., :3], rtol=0, atol=1e-12)
+    assert np.allclose(v, truth[..., 3:], rtol=0, atol=1e-11)
+    jupiter = ephem.evaluate(times, ['jupiter'])
+    assert jupiter.shape == (1, 503, 3)
+    assert np.array_equal(jupiter[0], p[1])
+
+    with pytest.raises(ValueError):
+        ephem.evaluate([t[-1] + 1])
+    with pytest.raises(ValueError):
+        ephem.evaluate(times, ['mars'])
+    with pytest.raises(ValueError):
+        ephemeris.EPHEMERIS.fromTable(t[::20], positions[:, ::20],
+                                      list(ELEMENTS))
+
+
+def test_load(tmpdir):
+    path = str(tmpdir.join('ephem'))
+    t, positions = table()
+    built = ephemeris.EPHEMERIS.fromTable(t, positions, list(ELEMENTS))
+    built.save(path)
+    ephem = ephemeris.load(path)
+    assert isinstance(ephem.coef, np.memmap)
+    assert ephemeris.load(path) is ephem
+    assert np.array_equal(ephem.evaluate(t[::7]), built.evaluate(t[::7]))
+    assert list(ephem.names) == list(ELEMENTS)
+
+
+def test_get_residuals_ephemeris(monkeypatch):
+    x, params, t, d = make_observations(40)
+    ephem = store()
+    calls = []
+    evaluate = ephem.evaluate
+
+    def counting(*args, **kwargs):
+        calls.append(1)
+        return evaluate(*args, **kwargs)
+    monkeypatch.setattr(ephem, 'evaluate', counting)
+
+    # the geocentre, unless there is an observer
+    f = mpcfit.FIT()
+    earth = evaluate(t, ['earth'])[0]
+    nu = f.get_residuals(x, t, d, dict(epoch=params['epoch'],
+                                       ephemeris=ephem))
+    assert np.allclose(nu, f.get_residuals(
+        x, t, d, dict(epoch=params['epoch'], observer=earth)))
+    assert np.array_equal(f.get_residuals(x, t, d, dict(
+        params, ephemeris=ephem)), f.get_residuals(x, t, d, params))
+
+    # evaluated once while the times are the same
+    for _ in range(3):
+        f.get_residuals(x, t, d, dict(epoch=params['epoch'],
+                                      ephemeris=ephem))
+    assert len(calls) == 1
+    f.get_residuals(x, t + 1, d, dict(epoch=params['epoch'],
+                                      ephemeris=ephem))
+    assert len(calls) == 2
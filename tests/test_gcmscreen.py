@@ -0,0 +1,110 @@
+# /mpcfit/tests/test_gcmscreen.py
+
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Test the functions in /mpcfit/mpcfit/gcmscreen.py
+# - Streaming great circle screening of tracklets
+#
+# --------------------------------------------------------------
+"""
+
+# Import third-party packages
+# --------------------------------------------------------------
+import itertools
+import io
+import math
+import numpy as np
+
+# Import the specific package/module/function we are testing
+# --------------------------------------------------------------
+import mpcfit.gcm as gcm
+import mpcfit.gcmscreen as gcmscreen
+
+
+# Tests of the gcmscreen module
+# ----------------------------------------------------------
+
+OBS = '''# trkId date ra dec (degrees)
+a 56123.00 10.0000 5.0000
+a 56123.01 10.0100 5.0050
+a 56123.02 10.0200 5.0100
+
+b 56123.00 20.0000 -5.0000
+b 56123.01 20.0100 -5.0050
+b 56123.02 20.0200 -5.0000
+c 56123.00 30.0000 0.0000
+d 56123.00 40.0000 0.0000
+d 56123.01 40.0000 0.0000
+'''
+
+
+def test_readTracklets():
+    t = list(gcmscreen.readTracklets(io.StringIO(OBS)))
+    assert [x[0] for x in t] == ['a', 'b', 'c', 'd']
+    assert [len(x[1]) for x in t] == [3, 3, 1, 2]
+    assert np.allclose(t[0][2], np.radians([10., 10.01, 10.02]))
+    assert np.allclose(t[1][3], np.radians([-5., -5.005, -5.]))
+
+
+def test_screen():
+    t = list(gcmscreen.readTracklets(io.StringIO(OBS)))
+    s = list(gcmscreen.screen(t, maxRMS=1., chunkSize=2))
+    assert [x.trkId for x in s] == ['a', 'b', 'c', 'd']
+    assert [x.passed for x in s] == [True, False, False, False]
+
+    # results are those of GCM
+    for x, (trkId, date, ra, dec) in zip(s[:2], t[:2]):
+        g = gcm.GCM(list(date), [gcm.Sphr(r, d) for r, d in zip(ra, dec)])
+        assert math.isclose(x.rms, g.rms(), rel_tol=1e-6, abs_tol=1e-8)
+        assert math.isclose(x.fit.rr, g.rr, rel_tol=1e-9)
+        assert x.fit.t0 == g.t0
+
+    # tracklets that can't be fit
+    assert s[2].fit is None and math.isnan(s[2].rms)
+    assert s[3].fit is None and math.isnan(s[3].rms)
+
+
+def test_screen_lazy():
+    '''Results come out before an endless input is exhausted.'''
+    def endless():
+        for i in itertools.count():
+            date = 56123. + np.array([0., 0.01, 0.02])
+            yield i, date, 1. + 0.01 * (date - date[0]), np.zeros(3)
+
+    s = gcmscreen.screen(endless(), chunkSize=100)
+    first = list(itertools.islice(s, 250))
+    assert [x.trkId for x in first] == list(range(250))
+    assert all(x.passed for x in first)
+
+
+def test_screen_one_pool(monkeypatch):
+    '''With workers, every chunk is fit in the same pool.'''
+    pools = []
+
+    class Pool(gcmscreen.futures.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            pools.append(self)
+
+    monkeypatch.setattr(gcmscreen.futures, 'ProcessPoolExecutor', Pool)
+    t = list(gcmscreen.readTracklets(io.StringIO(OBS)))
+    s = list(gcmscreen.screen(t * 3, maxRMS=1., chunkSize=2, nWorkers=2))
+    assert len(pools) == 1
+    assert [x.passed for x in s] == [True, False, False, False] * 3
+
+
+def test_main(tmpdir, capsys):
+    f = tmpdir.join('obs.txt')
+    f.write(OBS)
+    assert gcmscreen.main([str(f), '--max-rms', '1000000']) == 0
+    out = capsys.readouterr().out.splitlines()
+    assert [line.split()[0] for line in out] == ['a', 'b', 'c', 'd']
+    assert [line.split()[2] for line in out] == \
+        ['PASS', 'PASS', 'FAIL', 'FAIL']
+
+    assert gcmscreen.main([str(f), '--failed-only', '--workers', '2']) == 0
+    out = capsys.readouterr().out.splitlines()
+    assert [line.split()[0] for line in out] == ['b', 'c', 'd']
@@ -0,0 +1,197 @@
+# /mpcfit/tests/test_ingest.py
+
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Test the functions in /mpcfit/mpcfit/ingest.py
+# - Reading MPC 80-column & ADES observations
+#
+# --------------------------------------------------------------
+"""
+
+# Import third-party packages
+# --------------------------------------------------------------
+import numpy as np
+import pytest
+
+# Import the specific package/module/function we are testing
+# --------------------------------------------------------------
+from mpcfit import ingest
+from mpcfit import gcm
+from mpcfit import observatories
+from helpers import mpc80, mpc80Second
+
+
+# Test data
+# ----------------------------------------------------------
+
+SATELLITE = mpc80('00433', '', 'S', '2014 01 03.25    ', '01 10 00.00 ',
+                  '+00 30 00.0 ', 'C51')
+ROVING = mpc80('00433', '', 'V', '2014 01 03.50000 ', '01 11 00.00 ',
+               '+00 31 00.0 ', '247')
+
+MPC80 = '\n'.join([
+    mpc80('00433', '', 'C', '2014 01 01.50000 ', '01 02 03.456',
+          '-04 05 06.78', 'F51'),
+    mpc80('00433', '', 'C', '2014 01 01.51000 ', '01 02 04.456',
+          '-04 05 05.78', 'F51'),
+    SATELLITE,
+    mpc80Second(SATELLITE, 's', '1 - 1234.5678 +  567.1234 +  890.5678'),
+    ROVING,
+    mpc80Second(ROVING, 'v', '  249.123456 +32.123456  2000'),
+    mpc80('', 'K14A00A', 'R', '2014 01 04.00000 ', '', '', '253'),
+    # a satellite observation without its second line
+    mpc80('', 'K14A00A', 'S', '2014 01 04.00000 ', '23 59 59.999',
+          '+89 59 59.99', 'C51'),
+    mpc80('', 'K14A00A', 'C', '2014 01 04.00000 ', '23 59 59.999',
+          '+89 59 59.99', '568'),
+]) + '\r\n\n'
+
+PSV = '\n'.join([
+    '# version=2017',
+    '# observatory',
+    '! mpcCode F51',
+    'permID |provID   |trkSub |stn |obsTime                 |ra         '
+    '|dec        |rmsRA|rmsDec|mag',
+    '433    |         |a1     |F51 |2014-01-01T12:00:00.00Z | 15.5144000'
+    '|-4.0852167 |0.100|0.200 |20.5',
+    '433    |         |a1     |F51 |2014-01-01T12:14:24Z | 15.5184000'
+    '|-4.0849389 |  |0.200|',
+    '# observatory',
+    '! mpcCode 568',
+    'stn|obsTime|ra|dec|provID|trkID',
+    '568|2014-01-04T00:00:00Z|359.9999958|89.9999972|2014 AA|0000001',
+]) + '\n'
+
+XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<ades version="2017">
+ <obsBlock>
+  <obsContext><observatory><mpcCode>F51</mpcCode></observatory></obsContext>
+  <obsData>
+   <optical><permID>433</permID><trkSub>a1</trkSub><stn>F51</stn>
+    <obsTime>2014-01-01T12:00:00.00Z</obsTime><ra>15.5144000</ra>
+    <dec>-4.0852167</dec><rmsRA>0.100</rmsRA><rmsDec>0.200</rmsDec>
+   </optical>
+   <optical><permID>433</permID><trkSub>a1</trkSub><stn>F51</stn>
+    <obsTime>2014-01-01T12:14:24Z</obsTime><ra>15.5184000</ra>
+    <dec>-4.0849389</dec><rmsDec>0.200</rmsDec>
+   </optical>
+   <optical><provID>2014 AA</provID><trkID>0000001</trkID><stn>568</stn>
+    <obsTime>2014-01-04T00:00:00Z</obsTime><ra>359.9999958</ra>
+    <dec>89.9999972</dec>
+   </optical>
+  </obsData>
+ </obsBlock>
+</ades>
+'''
+
+
+# Tests of the parsers
+# ----------------------------------------------------------
+
+def test_number():
+    field = ingest._chars([b' 12.50', b'-0.001', b'    7 ', b'      ',
+                           b'+3Z   '])
+    value = ingest._number(field)
+    assert np.allclose(value[[0, 1, 2, 4]], [12.5, -0.001, 7., 3.],
+                       rtol=0, atol=1e-15)
+    assert np.isnan(value[3])
+
+
+def test_utcToTT():
+    # either side of the leap seconds at the starts of 2017 & 1972
+    utc = np.array([57753.5, 57754., 41316.5, 41317.5, np.nan])
+    tt = ingest._utcToTT(utc)
+    assert np.allclose((tt - utc)[:4] * 86400,
+                       [68.184, 69.184, 42.184, 42.184], rtol=0, atol=1e-5)
+    assert np.isnan(tt[4])
+
+
+def test_parseMPC80():
+    obs = ingest.parseMPC80(MPC80.encode())
+    # the 's', 'v' & 'R' lines, & the 'S' line without an 's', are
+    # skipped
+    assert len(obs) == 5
+    assert list(obs.objId) == [b'00433'] * 4 + [b'K14A00A']
+    assert list(obs.obsCode) == [b'F51', b'F51', b'C51', b'247', b'568']
+    # MJD 56658 is 2014-01-01; TT - UTC was 67.184 s
+    assert np.allclose(obs.time - 67.184 / 86400,
+                       [56658.5, 56658.51, 56660.25, 56660.5, 56661.],
+                       rtol=0, atol=1e-9)
+    hours = 1 + 2 / 60 + 3.456 / 3600
+    degrees = -(4 + 5 / 60 + 6.78 / 3600)
+    assert np.isclose(obs.ra[0], np.radians(15 * hours), rtol=1e-14)
+    assert np.isclose(obs.dec[0], np.radians(degrees), rtol=1e-14)
+    assert obs.ra[4] < 2 * np.pi and obs.dec[4] < np.pi / 2
+    assert np.all(obs.sigma == 1.)
+    # 1 tracklet on the first night, then one per site
+    assert list(obs.trkId) == [b'F51-5665850000'] * 2 + \
+        [b'C51-5666025000', b'247-5666050000', b'568-5666100000']
+    assert list(obs.tracklets()[1]) == [0, 2, 3, 4, 5]
+
+    # the observers' positions, from the second lines
+    position = obs.obsPosition
+    assert np.isnan(position[[0, 1, 4]]).all()
+    assert np.allclose(position[2], np.array([-1234.5678, 567.1234,
+                                              890.5678]) /
+                       observatories.AU_KM, rtol=1e-14)
+    rhoCos, rhoSin = observatories.parallaxConstants([32.123456], [2000.])
+    assert np.allclose(position[3], observatories.sitePositions(
+        np.radians([249.123456]), rhoCos, rhoSin, obs.time[3:4])[0],
+        rtol=0, atol=1e-16)
+    assert np.isclose(np.linalg.norm(position[3]),
+                      observatories.EARTH_RADIUS_AU *
+                      np.hypot(rhoCos[0], rhoSin[0]), rtol=1e-12)
+
+
+def test_parseADES():
+    psv = ingest.parsePSV(PSV.encode())
+    xml = ingest.parseXML(XML.encode())
+    assert len(psv) == len(xml) == 3
+    for obs in (psv, xml):
+        assert list(obs.objId) == [b'433', b'433', b'2014 AA']
+        assert list(obs.trkId) == [b'a1', b'a1', b'0000001']
+        assert list(obs.obsCode) == [b'F51', b'F51', b'568']
+        assert np.allclose(obs.time - 67.184 / 86400,
+                           [56658.5, 56658.51, 56661.], rtol=0, atol=1e-9)
+        assert np.allclose(obs.sigmaRA, [0.1, 1., 1.])
+        assert np.allclose(obs.sigmaDec, [0.2, 0.2, 1.])
+        assert np.isclose(obs.ra[0], np.radians(15.5144))
+        assert np.isclose(obs.dec[0], np.radians(-4.0852167))
+    for c in ingest.OBSERVATIONS.COLUMNS:
+        np.testing.assert_array_equal(getattr(psv, c), getattr(xml, c))
+
+    with pytest.raises(ValueError):
+        ingest.parsePSV(b'stn|obsTime|ra|dec\nF51|2014-01-01|1.|2.|3.\n')
+    with pytest.raises(ValueError):
+        ingest.parsePSV(b'stn|ra|dec\nF51|1.|2.\n')
+
+
+def test_files(tmpdir):
+    for name, text, format in (('obs.txt', MPC80 * 50, 'mpc80'),
+                               ('obs.psv', PSV * 50, 'psv'),
+                               ('obs.dat', XML, 'xml')):
+        path = str(tmpdir.join(name))
+        with open(path, 'w') as f:
+            f.write(text)
+        assert ingest.guessFormat(path) == format
+        whole = ingest.read(path)
+        chunks = list(ingest.iterChunks(path, chunkSize=500))
+        assert len(chunks) > 1 or format == 'xml'
+        both = ingest.OBSERVATIONS.concatenate(chunks)
+        for c in ('time', 'ra', 'dec', 'sigmaRA', 'objId', 'obsCode',
+                  'obsX', 'obsY', 'obsZ'):
+            np.testing.assert_array_equal(getattr(whole, c),
+                                          getattr(both, c))
+    assert len(whole) == 3
+    assert len(ingest.read(str(tmpdir.join('obs.txt')))) == 250
+    with pytest.raises(ValueError):
+        ingest.read(path, format='csv')
+
+    # straight into gcm (the first tracklet; gcm needs 2 or more points)
+    obs = ingest.read(str(tmpdir.join('obs.txt')))[:2]
+    date, ra, dec, offsets = obs.gcmInputs()
+    assert list(offsets) == [0, 2]
+    assert len(gcm.GCMBATCH(date, ra, dec, offsets).rms()) == 1
@@ -0,0 +1,101 @@
+# /mpcfit/tests/test_kepler.py
+
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Test the functions in /mpcfit/mpcfit/kepler.py
+# - Universal-variable two-body propagation & its STM
+#
+# --------------------------------------------------------------
+"""
+
+# Import third-party packages
+# --------------------------------------------------------------
+import numpy as np
+import pytest
+
+# Import the specific package/module/function we are testing
+# --------------------------------------------------------------
+from mpcfit import kepler
+from mpcfit import mpcfit
+from mpcfit import transformations
+from helpers import make_observations
+
+
+MU = transformations.GM_SUN
+
+
+def orbits():
+    '''Elliptic (also very eccentric), parabolic & hyperbolic states.'''
+    x = np.zeros((5, 6))
+    x[:, 0] = 1.
+    speed = np.sqrt(2 * MU) * np.array([0.5, 0.9999, 1., 1.0001, 2.])
+    x[:, 4], x[:, 5] = 0.8 * speed, 0.6 * speed
+    return x
+
+
+def invariants(states):
+    '''Energy & angular momentum of each state.'''
+    r, v = states[:, :3], states[:, 3:]
+    energy = np.sum(v**2, axis=1) / 2 - MU / np.linalg.norm(r, axis=1)
+    return energy, np.cross(r, v)
+
+
+# Tests of propagation
+# ----------------------------------------------------------
+
+def test_advance():
+    x, params, t, d = make_observations(20)
+    states, stm = kepler.advance(x, params['epoch'], t, stm=True)
+
+    # against the elements, advanced in mean anomaly
+    T = transformations.TRANSFORMS()
+    el, dEl = T.cartesianToKeplerian(x)
+    elt = np.tile(el, (len(t), 1))
+    n = np.sqrt(MU / el[0]**3)
+    elt[:, 5] += n * (t - params['epoch'])
+    s2, J = T.keplerianToCartesian(elt)
+    J[:, :, 0] -= 1.5 * (elt[:, 5] - el[5])[:, None] / el[0] * J[:, :, 5]
+    assert np.allclose(states, s2, rtol=0, atol=1e-12)
+    assert np.allclose(stm, np.matmul(J, dEl), rtol=1e-10, atol=1e-10)
+
+    # back at epoch: the same state and identity STM
+    s0, stm0 = kepler.advance(x, params['epoch'], [params['epoch']], stm=True)
+    assert np.array_equal(s0[0], x) and np.allclose(stm0[0], np.eye(6))
+
+    # many states at once, each to its own times
+    both = kepler.advance(np.array([x, 2 * x]), np.array([0., 10.]),
+                          [5., 15., 20.], index=np.array([0, 1, 1]))
+    assert np.allclose(both[0], kepler.advance(x, 0., [5.])[0])
+    assert np.allclose(both[1:], kepler.advance(2 * x, 10., [15., 20.]))
+
+
+def test_propagate_unbound():
+    x = orbits()
+    dt = np.array([3000., -700., 400., 400., -50.])
+    states, stm = kepler.propagate(x, dt, stm=True)
+    for a, b in zip(invariants(x), invariants(states)):
+        assert np.allclose(a, b, rtol=1e-12, atol=1e-14)
+    # and back again
+    assert np.allclose(kepler.propagate(states, -dt), x, rtol=0, atol=1e-11)
+
+    # as mpcfit's advance function
+    assert np.allclose(mpcfit.twoBodyAdvance(x, np.zeros(5), dt,
+                                             index=np.arange(5)), states)
+
+    # the STM against finite differences
+    h = 1e-7
+    for j in range(6):
+        dx = np.zeros(6)
+        dx[j] = h * max(1., np.abs(x[:, j]).max())
+        diff = (kepler.propagate(x + dx, dt) -
+                kepler.propagate(x - dx, dt)) / (2 * dx[j])
+        assert np.allclose(stm[:, :, j], diff, rtol=1e-5, atol=1e-5)
+
+
+def test_not_converged(monkeypatch):
+    monkeypatch.setattr(kepler, 'MAX_ITER', 0)
+    with pytest.raises(ValueError):
+        kepler.propagate(orbits(), np.full(5, 100.))
@@ -0,0 +1,92 @@
+# /mpcfit/tests/test_lighttime.py
+
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Test the functions in /mpcfit/mpcfit/lighttime.py
+# - Light-time & aberration corrections
+#
+# --------------------------------------------------------------
+"""
+
+# Import third-party packages
+# --------------------------------------------------------------
+import numpy as np
+import pytest
+
+# Import the specific package/module/function we are testing
+# --------------------------------------------------------------
+from mpcfit import lighttime
+from mpcfit import mpcfit
+from test_mpcfit import make_observations
+
+
+C = lighttime.C_AU_PER_DAY
+
+
+def retarded(x, epoch, t, observer):
+    '''Light-time corrected observations, one at a time.'''
+    d = []
+    for ti, oi in zip(t, observer):
+        tau = 0.
+        for _ in range(10):
+            rho = mpcfit.twoBodyAdvance(x, epoch, [ti - tau])[0, :3] - oi
+            tau = np.linalg.norm(rho) / C
+        d.append([np.arctan2(rho[1], rho[0]),
+                  np.arcsin(rho[2] / np.linalg.norm(rho))])
+    return np.array(d)
+
+
+# Tests of the corrections
+# ----------------------------------------------------------
+
+def test_correct():
+    x, params, t, d = make_observations(30)
+    observer = params['observer']
+    rho, drho, counters = lighttime.correct(
+        mpcfit.twoBodyAdvance, x, params['epoch'], t, observer, stm=True)
+    tau = np.linalg.norm(rho, axis=1) / C
+    states = mpcfit.twoBodyAdvance(x, params['epoch'], t - tau)
+    assert np.allclose(rho, states[:, :3] - observer, rtol=0, atol=1e-13)
+
+    # only the unconverged observations are advanced again
+    assert 2 < counters['nIter'] <= 5
+    assert counters['nCalls'] == counters['nIter'] + 1
+    assert counters['nProp'] <= 30 * counters['nCalls']
+
+    # d(rho) / d(x_Vec) against finite differences
+    for j in range(6):
+        dx = np.zeros(6)
+        dx[j] = 1e-5
+        diff = (lighttime.correct(mpcfit.twoBodyAdvance, x + dx,
+                                  params['epoch'], t, observer)[0] -
+                lighttime.correct(mpcfit.twoBodyAdvance, x - dx,
+                                  params['epoch'], t, observer)[0]) / 2e-5
+        assert np.allclose(drho[:, :, j], diff, rtol=1e-6, atol=1e-8)
+
+    # aberration shifts directions by about v / c
+    velocity = np.array([0., 0.0172, 0.])
+    shifted = lighttime.correct(mpcfit.twoBodyAdvance, x, params['epoch'],
+                                t, observer, observerVelocity=velocity)[0]
+    cosine = np.einsum('ij,ij->i', rho, shifted) / \
+        np.linalg.norm(rho, axis=1) / np.linalg.norm(shifted, axis=1)
+    assert np.all(np.arccos(np.minimum(cosine, 1)) <= 0.0172 / C * 1.0001)
+    assert np.max(np.arccos(np.minimum(cosine, 1))) > 0.0172 / C / 2
+
+    with pytest.raises(ValueError):
+        lighttime.correct(mpcfit.twoBodyAdvance, x, params['epoch'], t,
+                          observer, maxIter=1)
+
+
+def test_get_residuals_lightTime():
+    x, params, t, d = make_observations(30)
+    d = retarded(x, params['epoch'], t, params['observer'])
+    f = mpcfit.FIT()
+    # light time is several minutes: without it the residuals are large
+    assert np.max(np.abs(f.get_residuals(x, t, d, params))) > 1.
+    params['lightTime'] = True
+    nu, B = f.get_residuals(x, t, d, params, partials=True)
+    assert np.allclose(nu, 0, atol=1e-6)
+    assert f.lightTimeCounters['nCalls'] >= 3
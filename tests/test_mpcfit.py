@@ -3,10 +3,15 @@
 
 """Tests for `mpcfit` package."""
 
+import numpy as np
 import pytest
 
 
+from mpcfit import kepler
 from mpcfit import mpcfit
+from mpcfit import nbody
+from mpcfit import transformations
+from helpers import make_observations, predict, store
 
 
 @pytest.fixture
@@ -23,3 +28,517 @@ def test_content(response):
     """Sample pytest test function with the pytest fixture as an argument."""
     # from bs4 import BeautifulSoup
     # assert 'GitHub' in BeautifulSoup(response.content).title.string
+
+
+# Tests of orbit advance & residuals
+# ----------------------------------------------------------
+
+
+def test_twoBodyAdvance():
+    x, params, t, d = make_observations(20)
+    states, stm = mpcfit.twoBodyAdvance(x, params['epoch'], t, stm=True)
+    assert states.shape == (20, 6) and stm.shape == (20, 6, 6)
+
+    # back at epoch: the same state and identity STM
+    s0, stm0 = mpcfit.twoBodyAdvance(x, params['epoch'], [params['epoch']],
+                                     stm=True)
+    assert np.allclose(s0[0], x, rtol=1e-12, atol=1e-14)
+    assert np.allclose(stm0[0], np.eye(6), atol=1e-9)
+
+    # energy is conserved
+    mu = transformations.GM_SUN
+    energy = (np.sum(states[:, 3:]**2, axis=1) / 2 -
+              mu / np.linalg.norm(states[:, :3], axis=1))
+    assert np.allclose(energy, energy[0], rtol=1e-12)
+
+    # STM against finite differences
+    for j in range(6):
+        dx = np.zeros(6)
+        dx[j] = 1e-6 * np.linalg.norm(x[3:] if j > 2 else x[:3])
+        col = (mpcfit.twoBodyAdvance(x + dx, params['epoch'], t) -
+               mpcfit.twoBodyAdvance(x - dx, params['epoch'], t)) / (2 * dx[j])
+        assert np.allclose(stm[:, :, j], col, atol=1e-6 * np.abs(col).max())
+
+
+def test_get_residuals():
+    x, params, t, d = make_observations(50, noise=1e-6)
+    f = mpcfit.FIT()
+    nu = f.get_residuals(x, t, d, params)
+    assert nu.shape == (50, 2)
+    assert 0.05 < np.std(nu) < 0.5     # 1e-6 radians is 0.2"
+
+    # against one observation at a time
+    s = mpcfit.twoBodyAdvance(x, params['epoch'], t)
+    for i in range(0, 50, 7):
+        rho = s[i, :3] - params['observer'][i]
+        ra = np.arctan2(rho[1], rho[0])
+        dec = np.arcsin(rho[2] / np.linalg.norm(rho))
+        dra = (d[i, 0] - ra + np.pi) % (2 * np.pi) - np.pi
+        assert np.allclose(nu[i], np.array(
+            [dra * np.cos(d[i, 1]), d[i, 1] - dec]) * mpcfit.RAD_TO_ARCSEC)
+
+    # out= is filled & returned, and scratch space is reused
+    out = np.empty((50, 2))
+    assert f.get_residuals(x, t, d, params, out=out) is out
+    assert np.array_equal(out, nu)
+
+
+def test_get_residuals_wrap():
+    '''RA differences across RA = 0 are small.'''
+    x, params, t, d = make_observations(5)
+    f = mpcfit.FIT()
+    d[:, 0] = np.remainder(d[:, 0], 2 * np.pi)
+    d[:, 0] += 2 * np.pi * (d[:, 0] < np.pi)
+    assert np.allclose(f.get_residuals(x, t, d, params), 0, atol=1e-6)
+
+
+def test_get_residuals_advance():
+    '''The orbit is advanced with params['advance'].'''
+    x, params, t, d = make_observations(5)
+    calls = []
+
+    def advance(x_Vec, epoch, t_Vec, stm=False):
+        calls.append(len(t_Vec))
+        return mpcfit.twoBodyAdvance(x_Vec, epoch, t_Vec, stm)
+    params['advance'] = advance
+    nu = mpcfit.FIT().get_residuals(x, t, d, params)
+    assert calls == [5]
+    assert np.allclose(nu, 0, atol=1e-6)
+
+
+# Tests of the explicit fitter
+# ----------------------------------------------------------
+
+def test_choleskySolve():
+    rng = np.random.RandomState(2)
+    a = rng.normal(size=(4, 6, 6))
+    C = np.matmul(a, a.transpose(0, 2, 1)) + np.eye(6)
+    b = rng.normal(size=(4, 6))
+    L = mpcfit.cholesky(C)
+    assert np.allclose(np.matmul(L, L.transpose(0, 2, 1)), C)
+    x = mpcfit.choleskySolve(L, b)
+    assert np.allclose(np.matmul(C, x[..., None])[..., 0], b)
+    assert np.allclose(mpcfit.choleskySolve(L[1], b[1]), x[1])
+    eye = np.broadcast_to(np.eye(6), C.shape)
+    assert np.allclose(mpcfit.choleskySolve(L, eye), np.linalg.inv(C))
+
+
+def test_get_residuals_partials():
+    x, params, t, d = make_observations(30)
+    f = mpcfit.FIT()
+    nu, B = f.get_residuals(x, t, d, params, partials=True)
+    assert B.shape == (30, 2, 6)
+    assert np.array_equal(nu, f.get_residuals(x, t, d, params))
+    for j in range(6):
+        dx = np.zeros(6)
+        dx[j] = 1e-6 * np.linalg.norm(x[3:] if j > 2 else x[:3])
+        col = (f.get_residuals(x + dx, t, d, params) -
+               f.get_residuals(x - dx, t, d, params)) / (2 * dx[j])
+        assert np.allclose(B[..., j], col, atol=1e-5 * np.abs(col).max())
+
+
+def test_get_best_fit_EXPLICIT():
+    x, params, t, d = make_observations(40, noise=1e-6)
+    params['sigma'] = 0.2
+    start = x * (1 + 1e-4 * np.array([1, -1, 2, 1, -2, 1]))
+    fit = mpcfit.FIT().get_best_fit_EXPLICIT(start, t, d, params)
+    assert fit.converged and fit.nIter < 10
+    assert np.array_equal(fit.x_Vec, start)
+
+    # within errors of the truth, & chi-squared about the number of data
+    dx = fit.xBest_Vec - x
+    assert dx.dot(fit.C_Mat).dot(dx) < 30
+    assert 40 < fit.Q_Mat < 130
+    assert np.allclose(fit.Q_Mat, np.sum(fit.W_Mat * fit.nu_Vec**2))
+
+    # the normal & covariance matrices
+    assert np.allclose(fit.C_Mat, fit.C_Mat.T)
+    assert np.allclose(np.dot(fit.G_Mat, fit.C_Mat), np.eye(6), atol=1e-6)
+    assert np.allclose(np.dot(fit.L_Mat, fit.L_Mat.T), fit.C_Mat)
+
+    # a fit started from the solution stays there
+    again = mpcfit.FIT().get_best_fit_EXPLICIT(fit.xBest_Vec, t, d, params)
+    assert again.nIter == 1 and again.converged
+    assert np.allclose(again.xBest_Vec, fit.xBest_Vec, rtol=1e-10)
+
+
+def test_get_best_fit_EXPLICIT_equatorial():
+    '''Orbits with undefined elements have good STMs, & can be fit.'''
+    x, params, t, d = make_observations(40, elements=(2.5, 0., 0., 0., 0.,
+                                                      3.))
+    stm = mpcfit.twoBodyAdvance(x, params['epoch'], t, stm=True)[1]
+    assert np.all(np.isfinite(stm))
+    start = x * (1 + 1e-4 * np.array([1, -1, 2, 1, -2, 1]))
+    start[2] = 1e-5
+    fit = mpcfit.FIT().get_best_fit_EXPLICIT(start, t, d, params)
+    assert fit.converged
+    assert np.allclose(fit.xBest_Vec, x, rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize('model', ['twoBody', 'kepler', 'nbody',
+                                   'lightTime', 'ephemeris'])
+def test_get_best_fit_EXPLICIT_models(model):
+    '''Fits with each advance function & observer, of exact data.'''
+    x, params, t, d = make_observations(40)
+    if model == 'twoBody':
+        params['advance'] = mpcfit.twoBodyAdvance
+    elif model == 'kepler':
+        params['advance'] = kepler.advance
+    elif model == 'nbody':
+        n = nbody.NBODY(store())
+        params['advance'] = n.advance
+    elif model == 'lightTime':
+        params['lightTime'] = True
+    else:
+        params = dict(epoch=params['epoch'], ephemeris=store())
+    d = predict(x, t, params)
+
+    start = x * (1 + 1e-6 * np.arange(1, 7))
+    f = mpcfit.FIT()
+    orbit = f.get_best_fit_EXPLICIT(start, t, d, params)
+    assert orbit.converged
+    assert np.allclose(orbit.xBest_Vec, x, rtol=1e-9, atol=1e-11)
+    assert np.allclose(orbit.nu_Vec, 0, atol=1e-6)
+
+    if model == 'nbody':
+        # one integration per evaluation of residuals & design matrix
+        # (& the one of the observations)
+        assert n.counters['nIntegrations'] == orbit.counters['nFev'] + 1
+    if model == 'lightTime':
+        counters = orbit.counters['lightTime']
+        assert counters['nCalls'] > orbit.counters['nFev']
+        assert counters['nProp'] <= 40 * counters['nCalls']
+
+
+def test_get_best_fit_EXPLICIT_not_converged():
+    x, params, t, d = make_observations(40, noise=1e-6)
+    start = x * (1 + 1e-3 * np.array([1, -1, 2, 1, -2, 1]))
+    fit = mpcfit.FIT().get_best_fit_EXPLICIT(start, t, d, params, maxIter=1)
+    assert fit.nIter == 1 and not fit.converged
+
+
+def test_get_best_fit_EXPLICIT_large_residuals():
+    '''Converges where rounding error hides the last steps' gains.'''
+    x, params, t, d = make_observations(60, noise=1e-6)
+    params['sigma'] = 0.2
+    d[[5, 17, 40], 0] += 2e-5          # 4" off
+    fit = mpcfit.FIT().get_best_fit_EXPLICIT(x, t, d, params)
+    assert fit.converged and fit.Q_Mat > 1000
+
+
+def uphill(x_Vec, epoch, t_Vec, stm=False, **kwargs):
+    '''kepler.advance with STMs of the wrong sign: steps go uphill.'''
+    result = kepler.advance(x_Vec, epoch, t_Vec, stm, **kwargs)
+    return (result[0], -result[1]) if stm else result
+
+
+def test_get_best_fit_EXPLICIT_failures():
+    '''Fits that can't go on stop, not converged, without raising.'''
+    x, params, t, d = make_observations(40, noise=1e-6)
+    start = x * (1 + 1e-4 * np.array([1, -1, 2, 1, -2, 1]))
+    fit = mpcfit.FIT().get_best_fit_EXPLICIT(start, t, d,
+                                             dict(params, advance=uphill))
+    assert not fit.converged and fit.nIter == 1
+    assert fit.counters['nFev'] == 11
+    assert np.array_equal(fit.xBest_Vec, start)
+
+    # two observations can't determine an orbit
+    fit = mpcfit.FIT().get_best_fit_EXPLICIT(
+        start, t[:2], d[:2], dict(params, observer=params['observer'][:2]))
+    assert not fit.converged
+    assert np.isnan(fit.G_Mat).all()
+
+
+def make_batch(nobs, noise=1e-6):
+    '''Several objects' observations concatenated, & perturbed orbits.'''
+    T = transformations.TRANSFORMS()
+    x, t, d, observer, truth = [], [], [], [], []
+    for i, n in enumerate(nobs):
+        xi, params, ti, di = make_observations(n, seed=i, noise=noise)
+        # a different orbit for each object
+        el = T.cartesianToKeplerian(xi)[0] + [0.1 * i, 0, 0.05 * i, 0, 0, 0]
+        xi = T.keplerianToCartesian(el)[0]
+        rho = mpcfit.twoBodyAdvance(xi, params['epoch'], ti)[:, :3] - \
+            params['observer']
+        di = np.column_stack((
+            np.arctan2(rho[:, 1], rho[:, 0]),
+            np.arcsin(rho[:, 2] / np.linalg.norm(rho, axis=1)))) + \
+            np.random.RandomState(i).normal(0, noise, di.shape)
+        truth.append(xi)
+        x.append(xi * (1 + 1e-4 * np.cos(np.arange(6) + i)))
+        t.append(ti), d.append(di), observer.append(params['observer'])
+    params = dict(epoch=params['epoch'], observer=np.concatenate(observer),
+                  sigma=0.2)
+    return (np.array(x), np.concatenate(t), np.concatenate(d),
+            np.cumsum([0] + list(nobs)), params, np.array(truth))
+
+
+def test_get_best_fit_BATCH():
+    x, t, d, offsets, params, truth = make_batch([20, 35, 8, 50])
+    f = mpcfit.FIT()
+    batch = f.get_best_fit_BATCH(x, t, d, offsets, params)
+    assert batch.xBest_Vec.shape == (4, 6)
+    assert batch.converged.all()
+    assert batch.G_Mat.shape == (4, 6, 6)
+    assert batch.counters['method'] == 'BATCH'
+    assert batch.counters['nIter'] == batch.nIter.max()
+    assert batch.counters['nFev'] > batch.counters['nIter']
+
+    # the same as fitting one at a time
+    for i in range(4):
+        s = slice(offsets[i], offsets[i + 1])
+        p = dict(params, observer=params['observer'][s])
+        one = f.get_best_fit_EXPLICIT(x[i], t[s], d[s], p)
+        assert np.allclose(batch.xBest_Vec[i], one.xBest_Vec, rtol=1e-9)
+        assert np.isclose(batch.Q_Mat[i], one.Q_Mat, rtol=1e-6)
+        assert np.allclose(batch.G_Mat[i], one.G_Mat, rtol=1e-5)
+        assert np.allclose(batch.nu_Vec[s], one.nu_Vec, atol=1e-6)
+
+
+def test_get_best_fit_BATCH_failures():
+    x, t, d, offsets, params, truth = make_batch([20, 2, 30])
+    batch = mpcfit.FIT().get_best_fit_BATCH(x, t, d, offsets, params,
+                                            maxIter=3)
+    # two observations can't determine an orbit
+    assert list(batch.converged) == [True, False, True]
+    assert np.isnan(batch.G_Mat[1]).all()
+    assert np.isfinite(batch.G_Mat[[0, 2]]).all()
+
+    # no step lowers the cost: the objects stay where they started
+    batch = mpcfit.FIT().get_best_fit_BATCH(x, t, d, offsets,
+                                            dict(params, advance=uphill))
+    assert not batch.converged.any()
+    assert np.array_equal(batch.xBest_Vec, x)
+    assert batch.counters['nIter'] == 1 and batch.counters['nFev'] == 11
+
+    with pytest.raises(ValueError):
+        mpcfit.FIT().get_best_fit_BATCH(x, t, d, offsets[:-1], params)
+    with pytest.raises(ValueError):
+        mpcfit.FIT().get_best_fit_BATCH(x, t, d, [0, 20, 20, 52], params)
+
+
+# Tests of outlier rejection
+# ----------------------------------------------------------
+
+def test_choleskyUpdate():
+    rng = np.random.RandomState(3)
+    a = rng.normal(size=(6, 6))
+    C = np.dot(a, a.T) + 6 * np.eye(6)
+    V = rng.normal(size=(6, 3))
+    L = mpcfit.cholesky(C)
+    up = mpcfit.choleskyUpdate(L, V, 1)
+    assert np.allclose(up, mpcfit.cholesky(C + np.dot(V, V.T)))
+    assert np.allclose(mpcfit.choleskyUpdate(up, V, -1), L)
+    assert np.allclose(mpcfit.choleskyUpdate(L, V[:, :0]), L)
+    with pytest.raises(np.linalg.LinAlgError):
+        mpcfit.choleskyUpdate(L, 10 * V, -1)
+
+
+def test_get_best_fit_REJECT():
+    x, params, t, d = make_observations(60, noise=1e-6)
+    params['sigma'] = 0.2
+    outliers = [5, 17, 40]
+    d[outliers, 0] += 2e-5          # 4" off
+    d[outliers[1], 1] -= 3e-5
+    f = mpcfit.FIT()
+    fit = f.get_best_fit_REJECT(x * (1 + 1e-5), t, d, params)
+    assert list(np.flatnonzero(~fit.selected)) == outliers
+    assert fit.nRounds >= 2
+    assert np.all(fit.chi2_Vec[outliers] > 100)
+    assert np.all(fit.W_Mat[outliers] == 0)
+    assert fit.converged
+
+    # the corrections after rejection decide convergence: from the fit
+    # to all the data, which converges at once, one is too few
+    start = f.get_best_fit_EXPLICIT(x, t, d, params).xBest_Vec
+    short = f.get_best_fit_REJECT(start, t, d, params, maxIter=1)
+    assert short.nRounds >= 1 and not short.converged
+
+    # the same as fitting the selected observations from scratch
+    keep = fit.selected
+    p = dict(params, observer=params['observer'][keep])
+    clean = f.get_best_fit_EXPLICIT(x, t[keep], d[keep], p)
+    assert np.allclose(fit.xBest_Vec, clean.xBest_Vec, rtol=1e-8)
+    assert np.allclose(fit.C_Mat, clean.C_Mat, rtol=1e-6)
+    assert np.isclose(fit.Q_Mat, clean.Q_Mat, rtol=1e-6)
+
+
+def test_get_best_fit_REJECT_clean():
+    '''Nothing is rejected from good data.'''
+    x, params, t, d = make_observations(40, noise=1e-6)
+    params['sigma'] = 0.2
+    fit = mpcfit.FIT().get_best_fit_REJECT(x, t, d, params, chiReject=30.)
+    assert fit.selected.all() and fit.nRounds == 1
+
+    # too few observations to judge any
+    p = dict(params, observer=params['observer'][:2])
+    fit = mpcfit.FIT().get_best_fit_REJECT(x, t[:2], d[:2], p)
+    assert not fit.converged and fit.selected.all()
+    assert np.isnan(fit.chi2_Vec).all()
+
+
+# Tests of the lazy fitter
+# ----------------------------------------------------------
+
+@pytest.mark.parametrize('backend', ['lm', 'scipy'])
+def test_get_best_fit_LAZY(backend):
+    if backend == 'scipy':
+        pytest.importorskip('scipy')
+    x, params, t, d = make_observations(50, noise=1e-6)
+    params['sigma'] = 0.2
+    start = x * (1 + 1e-4 * np.array([1, -1, 2, 1, -2, 1]))
+    f = mpcfit.FIT()
+    lazy = f.get_best_fit_LAZY(start, t, d, params, backend=backend)
+    explicit = f.get_best_fit_EXPLICIT(start, t, d, params)
+    assert lazy.converged
+    assert np.allclose(lazy.xBest_Vec, explicit.xBest_Vec, rtol=1e-8)
+    assert np.isclose(lazy.Q_Mat, explicit.Q_Mat, rtol=1e-6)
+    assert np.allclose(lazy.G_Mat, explicit.G_Mat, rtol=1e-4)
+
+    c = lazy.counters
+    assert c['method'] == 'LAZY' and c['backend'] == backend
+    assert c['nFev'] >= 1 and c['nJev'] >= 1
+    if backend == 'scipy':
+        assert c['nIter'] is None and lazy.nIter is None
+    else:
+        assert c['nIter'] >= 1 and lazy.nIter == c['nIter']
+    assert c['seconds'] > 0
+    assert set(explicit.counters) >= {'nIter', 'nFev', 'nJev', 'seconds'}
+
+
+def test_get_best_fit_LAZY_backends():
+    x, params, t, d = make_observations(30, noise=1e-6)
+    f = mpcfit.FIT()
+    calls = []
+
+    def mine(fun, jac, x0, bounds, maxIter, tol):
+        calls.append(jac(x0).shape)
+        return dict(x=x0, nIter=0, converged=False)
+    fit = f.get_best_fit_LAZY(x, t, d, params, backend=mine)
+    assert calls == [(60, 6)]
+    assert fit.counters['backend'] == 'mine' and fit.counters['nJev'] == 1
+
+    # ... or its own counts, without iterations
+    def counted(fun, jac, x0, bounds, maxIter, tol):
+        return dict(x=x0, nFev=3, nJev=2, converged=False)
+    fit = f.get_best_fit_LAZY(x, t, d, params, backend=counted)
+    assert fit.nIter is None and fit.counters['nIter'] is None
+    assert fit.counters['nFev'] == 3 and fit.counters['nJev'] == 2
+    assert np.array_equal(fit.xBest_Vec, x)
+
+    with pytest.raises(ValueError):
+        f.get_best_fit_LAZY(x, t, d, params, backend='nonesuch')
+
+
+def test_get_best_fit_LAZY_bounds():
+    x, params, t, d = make_observations(30, noise=1e-6)
+    f = mpcfit.FIT()
+    lower, upper = np.full(6, -np.inf), np.full(6, np.inf)
+    upper[0] = x[0] - 1e-4
+    start = x.copy()
+    start[0] -= 2e-4
+    fit = f.get_best_fit_LAZY(start, t, d, params, backend='lm',
+                              bounds=(lower, upper))
+    assert fit.xBest_Vec[0] <= upper[0]
+    assert np.isclose(fit.xBest_Vec[0], upper[0])
+
+
+# Tests of the weight representations
+# ----------------------------------------------------------
+
+def random_blocks(counts, seed=4):
+    '''Covariance blocks (arc seconds^2) for groups of observations.'''
+    rng = np.random.RandomState(seed)
+    blocks = []
+    for c in counts:
+        a = rng.normal(size=(2 * c, 2 * c))
+        blocks.append(0.02 * (np.dot(a, a.T) / (2 * c) + np.eye(2 * c)))
+    return blocks
+
+
+def test_weights_dense():
+    '''Q and C agree with dense 2N x 2N weight matrices.'''
+    rng = np.random.RandomState(5)
+    n = 12
+    nu, B = rng.normal(size=(n, 2)), rng.normal(size=(n, 2, 6))
+    counts = [3, 1, 3, 5]
+    offsets = np.cumsum([0] + counts)
+    cov = random_blocks(counts)
+    block = mpcfit.BLOCK_WEIGHTS.fromCovariance(offsets, cov)
+    pairs = np.linalg.inv(random_blocks([1] * n))
+    diag = rng.uniform(1, 4, (n, 2))
+
+    dense = {}
+    dense['diag'] = np.diag(diag.ravel())
+    dense['pairs'] = np.zeros((2 * n, 2 * n))
+    dense['block'] = np.zeros((2 * n, 2 * n))
+    for i in range(n):
+        dense['pairs'][2 * i:2 * i + 2, 2 * i:2 * i + 2] = pairs[i]
+    for k, c in enumerate(cov):
+        s = slice(2 * offsets[k], 2 * offsets[k + 1])
+        dense['block'][s, s] = np.linalg.inv(c)
+
+    for name, W in (('diag', diag), ('pairs', pairs), ('block', block)):
+        D = dense[name]
+        Bd, nud = B.reshape(-1, 6), nu.ravel()
+        assert np.isclose(mpcfit.weightedCost(nu, W), nud.dot(D).dot(nud))
+        C, g = mpcfit.normalEquations(B, W, nu)
+        assert np.allclose(C, Bd.T.dot(D).dot(Bd))
+        assert np.allclose(g, Bd.T.dot(D).dot(nud))
+        if name != 'block':
+            perObs = mpcfit.weightedCost(nu, W, perObs=True)
+            assert perObs.shape == (n,)
+            assert np.isclose(perObs.sum(), nud.dot(D).dot(nud))
+            C2 = mpcfit.normalEquations(B, W, nu, offsets=[0, 5, n])[0]
+            assert np.allclose(C2.sum(axis=0), C)
+
+    # each observation's covariance from the blocks
+    obsCov = block.obsCovariance()
+    assert np.allclose(obsCov[4:7], cov[2].reshape(3, 2, 3, 2)[
+        [0, 1, 2], :, [0, 1, 2], :])
+
+    with pytest.raises(ValueError):
+        mpcfit.BLOCK_WEIGHTS([0, 2, 4], cov[:2])
+    with pytest.raises(ValueError):
+        mpcfit.normalEquations(B, block, nu, offsets=[0, n])
+
+
+def test_get_best_fit_weights():
+    '''Fits with each weight representation.'''
+    x, params, t, d = make_observations(40, noise=1e-6)
+    start = x * (1 + 1e-5)
+    f = mpcfit.FIT()
+    n = len(t)
+    sigma = np.linspace(0.1, 0.5, n)
+
+    # the same weights, three ways
+    diag = f.get_best_fit_EXPLICIT(start, t, d, dict(params, sigma=sigma))
+    pairs = np.zeros((n, 2, 2))
+    pairs[:, 0, 0] = pairs[:, 1, 1] = sigma**-2
+    offsets = np.arange(0, n + 1, 8)
+    blocks = [np.diag(np.repeat(sigma[i:i + 8]**-2, 2))
+              for i in offsets[:-1]]
+    for W in (pairs, mpcfit.BLOCK_WEIGHTS(offsets, blocks)):
+        fit = f.get_best_fit_EXPLICIT(start, t, d, dict(params, weights=W))
+        assert np.allclose(fit.xBest_Vec, diag.xBest_Vec, rtol=1e-10)
+        assert np.isclose(fit.Q_Mat, diag.Q_Mat)
+        assert np.allclose(fit.C_Mat, diag.C_Mat)
+        lazy = f.get_best_fit_LAZY(start, t, d, dict(params, weights=W),
+                                   backend='lm')
+        assert np.allclose(lazy.xBest_Vec, diag.xBest_Vec, rtol=1e-8)
+
+    # correlations change the fit
+    block = mpcfit.BLOCK_WEIGHTS.fromCovariance(offsets,
+                                                random_blocks([8] * 5))
+    fit = f.get_best_fit_EXPLICIT(start, t, d, dict(params, weights=block))
+    assert fit.converged
+    assert not np.allclose(fit.C_Mat, diag.C_Mat)
+
+    with pytest.raises(ValueError):
+        f.get_best_fit_REJECT(start, t, d, dict(params, weights=block))
+    with pytest.raises(ValueError):
+        f.get_best_fit_EXPLICIT(start, t, d, dict(params, weights=pairs[1:]))
+
+    # rejection with 2 x 2 weights
+    rej = f.get_best_fit_REJECT(start, t, d, dict(params, weights=pairs))
+    assert rej.W_Mat.shape == (n, 2, 2)
@@ -0,0 +1,129 @@
+# /mpcfit/tests/test_nbody.py
+
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Test the functions in /mpcfit/mpcfit/nbody.py
+# - N-body advance with variational equations
+#
+# --------------------------------------------------------------
+"""
+
+# Import third-party packages
+# --------------------------------------------------------------
+import numpy as np
+import pytest
+
+# Import the specific package/module/function we are testing
+# --------------------------------------------------------------
+from mpcfit import kepler
+from mpcfit import lighttime
+from mpcfit import mpcfit
+from mpcfit import nbody
+from mpcfit import transformations
+from helpers import make_observations, store
+
+
+# Tests of the integrator
+# ----------------------------------------------------------
+
+def test_twoBody():
+    '''Without perturbers, the same as kepler.advance.'''
+    x, params, t, d = make_observations(50)
+    t = np.concatenate((t, [params['epoch'], params['epoch'] + 400]))
+    n = nbody.NBODY()
+    states, stm = n.advance(x, params['epoch'], t, stm=True)
+    k, kstm = kepler.advance(x, params['epoch'], t, stm=True)
+    assert np.allclose(states, k, rtol=0, atol=1e-13)
+    assert np.allclose(stm, kstm, rtol=0, atol=1e-10)
+    assert np.array_equal(states[-2], x)
+    assert n.counters['nIntegrations'] == 1
+
+    # served by the same integration, also without STMs
+    assert np.array_equal(n.advance(x, params['epoch'], t[::3]),
+                          states[::3])
+    assert n.counters['nIntegrations'] == 1
+    n.advance(x, params['epoch'] + 1, t)
+    assert n.counters['nIntegrations'] == 2
+
+    # many states at once
+    both = n.advance(np.array([x, k[0]]), np.array([params['epoch'], t[0]]),
+                     t[:4], index=np.array([0, 0, 1, 1]))
+    assert np.allclose(both[:2], k[:2], rtol=0, atol=1e-13)
+    assert np.allclose(both[2:], kepler.advance(k[0], t[0], t[2:4]),
+                       rtol=0, atol=1e-13)
+
+
+def test_eccentric():
+    '''Steps shrink at perihelion: q = 0.1 au, e = 0.95, +-200 days.'''
+    x = transformations.TRANSFORMS().keplerianToCartesian(
+        [0.1 / 0.05, 0.95, 0.3, 1., 2., 0.])[0]
+    epoch = 58000.
+    t = epoch + np.linspace(-200, 200, 81)
+    n = nbody.NBODY()
+    states, stm = n.advance(x, epoch, t, stm=True)
+    k, kstm = kepler.advance(x, epoch, t, stm=True)
+    assert np.allclose(states, k, rtol=0, atol=1e-12)
+    assert np.allclose(stm, kstm, rtol=0, atol=1e-10 * np.max(np.abs(kstm)))
+    assert n.counters['nSteps'] > 4 * 400 / nbody.STEP
+
+
+def test_perturbed():
+    x, params, t, d = make_observations(30)
+    ephem = store()
+    n = nbody.NBODY(ephem)
+    assert n.bodies == ['earth', 'jupiter']
+    states, stm = n.advance(x, params['epoch'], t, stm=True)
+
+    # Jupiter's pull shows over 100 days ...
+    k = kepler.advance(x, params['epoch'], t)
+    assert 1e-7 < np.max(np.abs(states[:, :3] - k[:, :3])) < 1e-3
+    # ... & smaller steps make no difference
+    fine = nbody.NBODY(ephem, step=2.).advance(x, params['epoch'], t)
+    assert np.allclose(states, fine, rtol=0, atol=1e-13)
+
+    # the STM against finite differences
+    for j in range(6):
+        dx = np.zeros(6)
+        dx[j] = 1e-6 * np.abs(x[j])
+        diff = (n.advance(x + dx, params['epoch'], t) -
+                n.advance(x - dx, params['epoch'], t)) / (2 * dx[j])
+        assert np.allclose(stm[:, :, j], diff, rtol=1e-6, atol=1e-6)
+
+    with pytest.raises(ValueError):
+        n.advance(x, params['epoch'], [params['epoch'] + 1000])
+    with pytest.raises(ValueError):
+        nbody.NBODY(bodies=['jupiter'])
+
+
+def test_lightTime():
+    '''Light-time iterations are served by one integration.'''
+    x, params, t, d = make_observations(40)
+    n = nbody.NBODY(store())
+    params = dict(params, advance=n.advance, lightTime=True)
+    f = mpcfit.FIT()
+    f.get_residuals(x, t, d, params, partials=True)
+    assert f.lightTimeCounters['nCalls'] > 2
+    assert n.counters['nIntegrations'] == 1
+
+
+def test_lightTime_objects():
+    '''... & so are those of many objects, one integration each.'''
+    x, params, t, d = make_observations(40)
+    x2 = np.array([x, kepler.advance(x, params['epoch'], t[:1])[0]])
+    epochs = np.array([params['epoch'], t[0]])
+    index = np.arange(len(t)) % 2
+    n = nbody.NBODY(store())
+    rho, counters = lighttime.correct(n.advance, x2, epochs, t,
+                                      params['observer'], index=index)
+    assert counters['nCalls'] > 2
+    assert n.counters['nIntegrations'] == 2
+
+    # the same as for each object alone
+    for m in range(2):
+        mine = index == m
+        alone = lighttime.correct(n.advance, x2[m], epochs[m], t[mine],
+                                  params['observer'][mine])[0]
+        assert np.allclose(rho[mine], alone, rtol=0, atol=1e-14)
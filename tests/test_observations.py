@@ -0,0 +1,113 @@
+# /mpcfit/tests/test_observations.py
+
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Test the functions in /mpcfit/mpcfit/observations.py
+# - Columnar container of observations
+#
+# --------------------------------------------------------------
+"""
+
+# Import third-party packages
+# --------------------------------------------------------------
+import numpy as np
+import pytest
+
+# Import the specific package/module/function we are testing
+# --------------------------------------------------------------
+from mpcfit.observations import OBSERVATIONS
+from mpcfit import gcm
+
+
+# Tests of the OBSERVATIONS class
+# ----------------------------------------------------------
+
+def make_obs():
+    objId = ['a'] * 5 + ['b'] * 3 + ['c'] * 4
+    trkId = ['1', '1', '1', '2', '2', '1', '1', '1', '1', '1', '3', '3']
+    time = 58000. + np.arange(12) * 0.01
+    ra = np.linspace(1., 1.1, 12)
+    dec = np.linspace(-0.2, -0.1, 12)
+    return OBSERVATIONS(time, ra, dec, sigmaRA=0.5,
+                        sigmaDec=np.linspace(0.1, 0.2, 12),
+                        obsCode='F51', objId=objId, trkId=trkId)
+
+
+def test_columns():
+    obs = make_obs()
+    assert len(obs) == 12
+    for c in OBSERVATIONS.COLUMNS:
+        col = getattr(obs, c)
+        assert col.shape == (12,) and col.flags['C_CONTIGUOUS']
+        assert col.dtype == np.dtype(OBSERVATIONS.DTYPES[c])
+    assert np.all(obs.obsCode == b'F51')
+    assert obs.d_Vec.shape == (12, 2) and obs.sigma.shape == (12, 2)
+    assert not hasattr(obs, '__dict__')
+    with pytest.raises(ValueError):
+        OBSERVATIONS([1., 2.], [1., 2.], [0.])
+
+
+def test_getitem():
+    obs = make_obs()
+    # integers, also numpy's, select one observation
+    for i in (1, np.int64(1), np.intp(-11)):
+        one = obs[i]
+        assert len(one) == 1 and one.time[0] == obs.time[1]
+        assert np.shares_memory(one.time, obs.time)
+    assert len(obs[-1]) == 1 and obs[-1].time[0] == obs.time[-1]
+    with pytest.raises(IndexError):
+        obs[np.int32(12)]
+    # index arrays & masks copy
+    assert len(obs[np.array([0, 2])]) == 2
+    assert len(obs[obs.time > obs.time[5]]) == 6
+
+
+def test_grouping():
+    obs = make_obs()
+    ids, offsets = obs.objects()
+    assert list(ids) == [b'a', b'b', b'c']
+    assert list(offsets) == [0, 5, 8, 12]
+    # tracklet '1' of objects a, b & c are different tracklets
+    ids, offsets = obs.tracklets()
+    assert list(offsets) == [0, 3, 5, 8, 10, 12]
+
+    # views, not copies
+    b = obs.object('b')
+    assert len(b) == 3 and np.shares_memory(b.time, obs.time)
+    assert [i for i, o in obs.iterObjects()] == ['a', 'b', 'c']
+    assert [len(o) for i, o in obs.iterTracklets()] == [3, 2, 3, 2, 2]
+    with pytest.raises(KeyError):
+        obs.object('z')
+
+    # shuffled observations are regrouped by sort
+    shuffled = obs[np.random.RandomState(0).permutation(12)]
+    assert not np.shares_memory(shuffled.time, obs.time)
+    s = shuffled.sort()
+    assert np.array_equal(s.time, obs.time)
+    assert list(s.objects()[1]) == [0, 5, 8, 12]
+
+    date, ra, dec, offsets = obs.gcmInputs()
+    g = gcm.GCMBATCH(date, ra, dec, offsets)
+    assert len(g.rms()) == 5
+
+
+def test_archive(tmpdir):
+    obs = make_obs()
+    path = str(tmpdir.join('archive'))
+    obs.save(path)
+    for mmap in (True, False):
+        back = OBSERVATIONS.open(path, mmap=mmap)
+        assert isinstance(back.ra, np.memmap) == mmap
+        for c in OBSERVATIONS.COLUMNS:
+            np.testing.assert_array_equal(getattr(back, c), getattr(obs, c))
+        c = back.object('c')
+        assert np.array_equal(c.dec, obs.dec[8:])
+        if mmap:
+            assert isinstance(c.dec, np.memmap)
+            assert not back.ra.flags['WRITEABLE']
+
+    both = OBSERVATIONS.concatenate([obs[:5], back[5:]])
+    assert np.array_equal(both.trkId, obs.trkId)
@@ -0,0 +1,147 @@
+# /mpcfit/tests/test_observatories.py
+
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Test the functions in /mpcfit/mpcfit/observatories.py
+# - Observatory codes & geocentric positions
+#
+# --------------------------------------------------------------
+"""
+
+# Import third-party packages
+# --------------------------------------------------------------
+import numpy as np
+import pytest
+
+# Import the specific package/module/function we are testing
+# --------------------------------------------------------------
+from mpcfit import mpcfit
+from mpcfit import observatories
+from helpers import make_observations, store
+
+
+# Test data
+# ----------------------------------------------------------
+
+OBSCODES = '''Code  Long.   cos      sin    Name
+000   0.0000 0.62411 +0.77873 Greenwich
+568 204.52780 0.94171 +0.33725 Mauna Kea
+F51 203.744090.936241+0.351543Pan-STARRS 1, Haleakala
+C51                           WISE
+500   0.0000 0.00000 +0.00000 Geocentric
+'''
+
+
+# Tests of the table
+# ----------------------------------------------------------
+
+def test_parse(tmpdir):
+    obs = observatories.OBSCODES.parse(OBSCODES)
+    assert list(obs.codes) == [b'000', b'500', b'568', b'C51', b'F51']
+    assert obs.names[4] == 'Pan-STARRS 1, Haleakala'
+    assert np.isclose(obs.longitude[4], np.radians(203.74409))
+    assert obs.rhoCos[4] == 0.936241 and obs.rhoSin[4] == 0.351543
+    assert np.isnan(obs.rhoCos[3])
+    assert list(obs.index(['F51', b'000', '568', 'F51'])) == [4, 0, 2, 4]
+    with pytest.raises(ValueError):
+        obs.index(['F51', 'ZZZ'])
+
+    path = str(tmpdir.join('ObsCodes.html'))
+    with open(path, 'w') as f:
+        f.write('<pre>\n' + OBSCODES + '</pre>\n')
+    assert observatories.load(path) is observatories.load(path)
+    assert len(observatories.load(path)) == 5
+
+
+def test_geocentric():
+    obs = observatories.OBSCODES.parse(OBSCODES)
+    R = observatories.EARTH_RADIUS_AU
+
+    # Greenwich at J2000.0: the Earth rotation angle is 280.46 degrees
+    # in the intermediate frame
+    p = obs.geocentric(obs.index(['000']), [51544.5])[0] / R
+    Q = observatories._precessionNutation(np.array([51544.5]))[0]
+    era = np.radians(280.46061837504)
+    assert np.allclose(Q.T.dot(p), [0.62411 * np.cos(era),
+                                    0.62411 * np.sin(era), 0.77873],
+                       rtol=0, atol=1e-12)
+
+    # the CIP against IAU 2006/2000A (SOFA's iauXy06) at MJD 53736:
+    # within 0.3", where precession alone is 8" off
+    Q = observatories._precessionNutation(np.array([53736.]))[0]
+    assert np.allclose(Q[:2, 2], [5.791308486706011e-4,
+                                  4.020579816732961e-5],
+                       rtol=0, atol=0.3 / 206265)
+    assert np.allclose(Q.dot(Q.T), np.eye(3), rtol=0, atol=1e-15)
+
+    # a sidereal day later, back in the same place (but for precession)
+    t = np.array([58000., 58000. + 1 / observatories.ERA_RATE])
+    index = obs.index(['F51', 'F51'])
+    p, v = obs.geocentric(index, t, velocity=True)
+    assert np.allclose(p[0], p[1], rtol=0, atol=1e-10)
+    assert np.allclose(np.linalg.norm(p, axis=1),
+                       R * np.hypot(0.936241, 0.351543))
+    # 1 minute of UT1 is 15' of rotation
+    later = obs.geocentric(index, t, deltaT=-1 / 1440.)
+    turned = np.arctan2(later[:, 1], later[:, 0]) - \
+        np.arctan2(p[:, 1], p[:, 0])
+    assert np.allclose(np.degrees(turned), 0.25 * observatories.ERA_RATE,
+                       rtol=1e-3)
+
+    h = 1e-4
+    diff = (obs.geocentric(index, t + h) - obs.geocentric(index, t - h)) / \
+        (2 * h)
+    assert np.allclose(v, diff, rtol=0, atol=1e-10)
+
+    assert np.array_equal(obs.geocentric(obs.index(['500']), [58000.]),
+                          np.zeros((1, 3)))
+    with pytest.raises(ValueError):
+        obs.geocentric(obs.index(['C51']), [58000.])
+
+
+def test_get_residuals_observatories():
+    x, params, t, d = make_observations(40)
+    ephem = store()
+    obs = observatories.OBSCODES.parse(OBSCODES)
+    codes = np.array(['F51', '568'] * 20, dtype='S3')
+    observer = ephem.evaluate(t, ['earth'])[0] + \
+        obs.geocentric(obs.index(codes), t)
+
+    f = mpcfit.FIT()
+    p = dict(epoch=params['epoch'], ephemeris=ephem, observatories=obs)
+    expected = f.get_residuals(x, t, d, dict(p, observer=observer))
+    for c in (codes, obs.index(codes)):
+        assert np.allclose(f.get_residuals(x, t, d, dict(p, obsCode=c)),
+                           expected, rtol=0, atol=1e-10)
+    # the geocentric offset matters: ~ 1e-4 au at ~1 au
+    assert not np.allclose(f.get_residuals(
+        x, t, d, dict(epoch=params['epoch'], ephemeris=ephem)), expected,
+        rtol=0, atol=1.)
+
+    # kept while the times & codes are the same
+    f.get_residuals(x, t, d, dict(p, obsCode=codes))
+    kept = f._work['observer']
+    f.get_residuals(x, t, d, dict(p, obsCode=codes))
+    assert f._work['observer'] is kept
+    f.get_residuals(x, t, d, dict(p, obsCode=codes[::-1]))
+    assert f._work['observer'] is not kept
+
+    # satellites: the positions given, in place of the sites'
+    satellite = codes.copy()
+    satellite[::4] = b'C51'
+    position = np.full((40, 3), np.nan)
+    position[::4] = [1e-4, -2e-4, 3e-4]
+    observer[::4] = ephem.evaluate(t[::4], ['earth'])[0] + position[::4]
+    p = dict(p, obsCode=satellite, obsPosition=position)
+    assert np.allclose(f.get_residuals(x, t, d, p), f.get_residuals(
+        x, t, d, dict(epoch=params['epoch'], observer=observer)),
+        rtol=0, atol=1e-10)
+    with pytest.raises(ValueError):
+        f.get_residuals(x, t, d, dict(p, obsPosition=position[::-1]))
+
+    with pytest.raises(ValueError):
+        f.get_residuals(x, t, d, dict(epoch=params['epoch'],
+                                      observatories=obs, obsCode=codes))
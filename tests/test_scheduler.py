@@ -0,0 +1,81 @@
+# /mpcfit/tests/test_scheduler.py
+
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Test the functions in /mpcfit/mpcfit/scheduler.py
+# - Parallel fitting of many objects
+#
+# --------------------------------------------------------------
+"""
+
+# Import third-party packages
+# --------------------------------------------------------------
+import time
+import numpy as np
+import pytest
+
+# Import the specific package/module/function we are testing
+# --------------------------------------------------------------
+import mpcfit.mpcfit as mpcfit
+import mpcfit.scheduler as scheduler
+from helpers import make_observations
+
+
+# Tests of the scheduler module
+# ----------------------------------------------------------
+
+def slowAdvance(x_Vec, epoch, t_Vec, stm=False, **kwargs):
+    time.sleep(0.2)
+    return mpcfit.twoBodyAdvance(x_Vec, epoch, t_Vec, stm, **kwargs)
+
+
+def make_jobs(nobs):
+    jobs = []
+    for i, n in enumerate(nobs):
+        x, params, t, d = make_observations(n, seed=i, noise=1e-6)
+        params['sigma'] = 0.2
+        jobs.append(scheduler.Job(i, x * (1 + 1e-5), t, d, params))
+    return jobs
+
+
+def test_refit_serial():
+    jobs = make_jobs([10, 40, 20, 30])
+    results = list(scheduler.refit(jobs, nWorkers=1))
+    # longest first
+    assert [r.objId for r in results] == [1, 3, 2, 0]
+    assert all(r.status == 'ok' and r.fit.converged for r in results)
+    for r in results:
+        j = jobs[r.objId]
+        fit = mpcfit.FIT().get_best_fit_EXPLICIT(j.x_Vec, j.t_Vec, j.d_Vec,
+                                                 j.params)
+        assert np.allclose(r.fit.xBest_Vec, fit.xBest_Vec)
+        assert r.seconds > 0
+
+
+def test_refit_parallel():
+    jobs = make_jobs([10, 40, 20, 30, 15, 25])
+    results = list(scheduler.refit(jobs, nWorkers=2, maxIter=5))
+    assert sorted(r.objId for r in results) == list(range(6))
+    assert all(r.status == 'ok' for r in results)
+    assert all(r.fit.nIter <= 5 for r in results)
+
+
+@pytest.mark.parametrize('nWorkers', [1, 2])
+def test_refit_timeout_and_errors(nWorkers):
+    jobs = make_jobs([10, 12, 14])
+    jobs[1].params['advance'] = slowAdvance
+    jobs[2] = jobs[2]._replace(d_Vec=jobs[2].d_Vec[:3])
+    results = {r.objId: r for r in
+               scheduler.refit(jobs, nWorkers=nWorkers, timeout=0.1)}
+    assert results[0].status == 'ok'
+    assert results[1].status == 'timeout' and results[1].fit is None
+    assert results[1].seconds < 1.
+    assert results[2].status.startswith('error')
+
+
+def test_refit_exceptions():
+    with pytest.raises(ValueError):
+        list(scheduler.refit(make_jobs([10]), nWorkers=0))
@@ -0,0 +1,204 @@
+# /mpcfit/tests/test_transformations.py
+
+"""
+# --------------------------------------------------------------
+# Oct 2018
+# Payne
+#
+# Test the functions in /mpcfit/mpcfit/transformations.py
+#
+# --------------------------------------------------------------
+"""
+
+# Import third-party packages
+# --------------------------------------------------------------
+import numpy as np
+import pytest
+
+# Import the specific package/module/function we are testing
+# --------------------------------------------------------------
+import mpcfit.transformations as transformations
+
+
+# Basic test(s) of the transformations module
+# ----------------------------------------------------------
+
+def covar_map(covar_in, derivs):
+    '''Explicit loop, as in Bernstein orbit/orbfit1.c/covar_map.'''
+    kout, kin = derivs.shape
+    covar_out = np.zeros((kout, kout))
+    for i in range(kout):
+        for j in range(kout):
+            for m in range(kin):
+                for n in range(kin):
+                    covar_out[i][j] += derivs[i][m] * derivs[j][n] * \
+                        covar_in[m][n]
+    return covar_out
+
+
+def random_covariances(n, k, m, seed=0):
+    rng = np.random.RandomState(seed)
+    a = rng.normal(size=(n, k, k))
+    cov = np.matmul(a, a.transpose(0, 2, 1)) + k * np.eye(k)
+    return cov, rng.normal(size=(n, m, k))
+
+
+def test_covarianceRemap_single():
+    T = transformations.TRANSFORMS()
+    cov, partial = random_covariances(1, 4, 2)
+    got = T.covarianceRemap(cov[0], partial[0])
+    assert got.shape == (2, 2)
+    assert np.allclose(got, covar_map(cov[0], partial[0]))
+    assert np.array_equal(got, got.T)
+
+
+def test_covarianceRemap_stacked():
+    T = transformations.TRANSFORMS()
+    cov, partial = random_covariances(20, 6, 3)
+    got = T.covarianceRemap(cov, partial)
+    assert got.shape == (20, 3, 3)
+    for i in range(20):
+        assert np.allclose(got[i], covar_map(cov[i], partial[i]))
+    assert np.array_equal(got, got.transpose(0, 2, 1))
+
+    # one partial shared by all the covariances
+    got = T.covarianceRemap(cov, partial[0])
+    for i in range(20):
+        assert np.allclose(got[i], covar_map(cov[i], partial[0]))
+
+
+def test_covarianceRemap_out(capsys):
+    T = transformations.TRANSFORMS()
+    cov, partial = random_covariances(5, 6, 6)
+    out = np.empty((5, 6, 6))
+    got = T.covarianceRemap(cov, partial, out=out)
+    assert got is out
+    assert np.allclose(out, T.covarianceRemap(cov, partial))
+    assert capsys.readouterr().out == ''
+
+
+def test_covarianceRemap_shapes():
+    T = transformations.TRANSFORMS()
+    with pytest.raises(AssertionError):
+        T.covarianceRemap(np.eye(4), np.ones((2, 3)))
+
+
+def random_elements(n, hyperbolic=False, seed=1):
+    rng = np.random.RandomState(seed)
+    a = rng.uniform(0.5, 5, n)
+    e = rng.uniform(0.01, 0.95, n)
+    M = rng.uniform(0, 2 * np.pi, n)
+    if hyperbolic:
+        a, e, M = -a, 1 + 2 * e, M - np.pi
+    return np.column_stack((a, e, rng.uniform(0.05, 3., n),
+                            rng.uniform(0, 2 * np.pi, (2, n)).T, M))
+
+
+def numerical_jacobian(f, x, h=1e-7):
+    J = np.empty(x.shape + x.shape[-1:])
+    for j in range(x.shape[-1]):
+        d = np.zeros(x.shape[-1])
+        d[j] = h
+        J[..., j] = (f(x + d) - f(x - d)) / (2 * h)
+    return J
+
+
+@pytest.mark.parametrize('hyperbolic', [False, True])
+def test_keplerian(hyperbolic):
+    T = transformations.TRANSFORMS()
+    el = random_elements(100, hyperbolic)
+    state, J = T.keplerianToCartesian(el)
+    assert state.shape == (100, 6) and J.shape == (100, 6, 6)
+
+    # vis-viva
+    r = np.linalg.norm(state[:, :3], axis=1)
+    v2 = np.sum(state[:, 3:]**2, axis=1)
+    assert np.allclose(v2, transformations.GM_SUN * (2 / r - 1 / el[:, 0]))
+
+    Jn = numerical_jacobian(lambda x: T.keplerianToCartesian(x)[0], el)
+    assert np.allclose(J, Jn, rtol=1e-6, atol=1e-8)
+
+    # round trip
+    el2, Ji = T.cartesianToKeplerian(state)
+    d = el2 - el
+    d[:, 2:] = np.remainder(d[:, 2:] + np.pi, 2 * np.pi) - np.pi
+    assert np.allclose(d, 0, atol=1e-11)
+    assert np.allclose(np.matmul(Ji, J), np.eye(6), atol=1e-8)
+
+
+@pytest.mark.parametrize('hyperbolic', [False, True])
+def test_cometary(hyperbolic):
+    T = transformations.TRANSFORMS()
+    epoch = 58000.
+    state = T.keplerianToCartesian(random_elements(50, hyperbolic))[0]
+    com, Ji = T.cartesianToCometary(state, epoch)
+    state2, J = T.cometaryToCartesian(com, epoch)
+    assert np.allclose(state2, state, atol=1e-12)
+    assert np.allclose(np.matmul(Ji, J), np.eye(6), atol=1e-8)
+    Jn = numerical_jacobian(lambda x: T.cometaryToCartesian(x, epoch)[0],
+                            com, h=1e-6)
+    assert np.allclose(J, Jn, rtol=1e-5, atol=1e-7)
+
+    # q and tp are the perihelion distance & time
+    peri = T.cometaryToCartesian(com, com[:, 5])[0]
+    assert np.allclose(np.linalg.norm(peri[:, :3], axis=1), com[:, 0])
+
+
+@pytest.mark.parametrize('cometary', [False, True])
+def test_singular_in_batch(cometary):
+    '''Equatorial & circular orbits get NaN Jacobians, the rest don't.'''
+    T = transformations.TRANSFORMS()
+    el = random_elements(5)
+    el[1, 2] = 0.
+    el[3, 1] = 0.
+    state, J = T.keplerianToCartesian(el)
+    if cometary:
+        el2, Ji = T.cartesianToCometary(state, 58000.)
+        J = T.cometaryToCartesian(el2, 58000.)[1]
+    else:
+        el2, Ji = T.cartesianToKeplerian(state)
+    bad = np.isnan(Ji).any(axis=(1, 2))
+    assert list(bad) == [False, True, False, True, False]
+    assert np.all(np.isfinite(el2))
+    assert np.allclose(np.matmul(Ji[~bad], J[~bad]), np.eye(6), atol=1e-8)
+
+
+def test_single_object():
+    T = transformations.TRANSFORMS()
+    el = random_elements(3)
+    state, J = T.keplerianToCartesian(el[1])
+    assert state.shape == (6,) and J.shape == (6, 6)
+    assert np.allclose(state, T.keplerianToCartesian(el)[0][1])
+
+
+def test_elements_exceptions():
+    T = transformations.TRANSFORMS()
+    el = random_elements(3)
+    el[1, 1] = 1.
+    with pytest.raises(ValueError):
+        T.keplerianToCartesian(el)
+    el[1, 1] = 1.5
+    with pytest.raises(ValueError):
+        T.keplerianToCartesian(el)
+    with pytest.raises(ValueError):
+        T.keplerianToCartesian(np.ones(5))
+
+
+def test_ecliptic():
+    T = transformations.TRANSFORMS()
+    # the ecliptic pole is at RA = 18h, Dec = 90 - obliquity
+    pole = T.eclipticToEquatorial(np.array([0., 0., 1.]))[0]
+    assert np.allclose(pole, [0., -np.sin(transformations.OBLIQUITY),
+                              np.cos(transformations.OBLIQUITY)])
+
+    state = T.keplerianToCartesian(random_elements(10))[0]
+    ecl, J = T.equatorialToEcliptic(state)
+    assert J.shape == (10, 6, 6)
+    assert np.allclose(np.matmul(J, state[..., None])[..., 0], ecl)
+    assert np.allclose(T.eclipticToEquatorial(ecl)[0], state)
+
+    # Jacobians chain through covarianceRemap
+    cov = random_covariances(10, 6, 6)[0]
+    el, Jel = T.cartesianToKeplerian(ecl)
+    out = T.covarianceRemap(T.covarianceRemap(cov, J), Jel)
+    assert np.allclose(out, T.covarianceRemap(cov, np.matmul(Jel, J)))